@@ -1,6 +1,6 @@
 import os
 import secrets
-from flask import Flask, render_template, g
+from flask import Flask, render_template, g, flash, redirect, request
 
 def create_app(test_config=None):
     """Create and configure an instance of the Flask application."""
@@ -18,6 +18,71 @@ def create_app(test_config=None):
         UPLOAD_FOLDER=os.path.join(app.root_path, '..', 'static', 'uploads'), # Relative to app package
         THUMBNAIL_FOLDER=os.path.join(app.root_path, '..', 'static', 'adventure_thumbnails'),
         MAX_CONTENT_LENGTH=500 * 1024 * 1024,  # 500MB max upload size (Increased significantly)
+        # Connection pool: max open connections and seconds to wait for a free one
+        DB_POOL_SIZE=8,
+        DB_POOL_TIMEOUT=10.0,
+        # Applied once to every pooled connection when it is opened
+        DB_PRAGMAS={
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -16000,  # Negative = KiB, so ~16MB page cache per connection
+            'mmap_size': 128 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,  # ms
+        },
+        CATALOG_PAGE_SIZE=24,  # Adventures per page on /adventures
+        # Statistics counters are buffered in memory and flushed every N seconds
+        # or once this many increments are waiting (interval 0 = write immediately)
+        STATS_FLUSH_INTERVAL=5.0,
+        STATS_FLUSH_THRESHOLD=1000,
+        # API request logs are queued and written in batches by a background thread.
+        # When the queue is full: 'drop' (discard and count) or 'block' (wait for room)
+        API_LOG_QUEUE_SIZE=10000,
+        API_LOG_BATCH_SIZE=500,
+        API_LOG_OVERFLOW='drop',
+        # Raw API logs older than this are pruned (their daily counts are kept); 0 = keep forever
+        API_LOG_RETENTION_DAYS=90,
+        API_LOG_PRUNE_INTERVAL=3600,  # Seconds between automatic prunes
+        STATS_CHART_DAYS=30,  # Days shown on the admin statistics charts
+        # Mixed into every ETag; change it on deploy when templates change so
+        # clients do not keep revalidating old pages
+        ETAG_SALT='',
+        # API key authentication cache (LRU, unknown keys included)
+        API_KEY_CACHE_SIZE=1024,
+        API_KEY_CACHE_TTL=60,
+        HOME_CACHE_TTL=60,  # Seconds the home page featured/recent/tags blocks are reused
+        DASHBOARD_CACHE_TTL=30,  # Seconds the admin dashboard numbers are reused
+        # Seconds between checks of the database cache version stamps; other
+        # worker processes see a settings change within this window
+        CACHE_VERSION_CHECK_INTERVAL=1.0,
+        # Background jobs (API submission processing, thumbnails). Set
+        # JOB_WORKERS=0 to run them only with `flask run-jobs`
+        JOB_WORKERS=2,
+        JOB_POLL_INTERVAL=2.0,  # Seconds between checks for jobs queued by other processes
+        JOB_MAX_ATTEMPTS=3,
+        JOB_RETRY_DELAY=10.0,  # Seconds before the first retry, doubled for each further one
+        JOB_LOCK_TIMEOUT=300,  # Seconds after which a running job is assumed lost and run again
+        JOB_RETENTION_DAYS=7,  # Finished jobs are kept this long for status queries
+        # Resumable API uploads (/api/uploads)
+        UPLOAD_CHUNK_MAX_SIZE=8 * 1024 * 1024,  # Largest accepted chunk, also the suggested chunk size
+        UPLOAD_SESSIONS_PER_USER=5,  # Unfinished uploads a user may have at once
+        UPLOAD_SESSION_TTL=24 * 3600,  # Seconds without a new chunk before a session is removed
+        UPLOAD_SESSION_GC_INTERVAL=600,  # Seconds between automatic sweeps for abandoned sessions
+        API_BATCH_MAX_ITEMS=20,  # Packages accepted in one /api/submit_batch request
+        # Zip-bomb guard: limits checked against the ZIP central directory
+        # before anything is decompressed (see inspector.check_archive)
+        ZIP_MAX_ENTRIES=10000,
+        ZIP_MAX_TOTAL_SIZE=1024 * 1024 * 1024,  # Bytes all members unpack to together
+        ZIP_MAX_MEMBER_SIZE=256 * 1024 * 1024,  # Bytes one member may unpack to
+        ZIP_MAX_RATIO=100,  # Largest uncompressed:compressed ratio of a member...
+        ZIP_RATIO_MIN_SIZE=1024 * 1024,  # ...once it unpacks to more than this many bytes
+        ZIP_ALLOW_NESTED_ARCHIVES=False,  # Reject .zip/.rar/.7z/... members
+        ZIP_MAX_GAME_DATA_SIZE=16 * 1024 * 1024,  # Read cap for game_data.json
+        ZIP_MAX_THUMBNAIL_SIZE=10 * 1024 * 1024,  # Copy cap for the extracted thumbnail
+        # Let the front-end server send adventure downloads: 'x-accel-redirect'
+        # (nginx) or 'x-sendfile' (Apache, lighttpd); None streams them from Python
+        DOWNLOAD_OFFLOAD=None,
+        DOWNLOAD_ACCEL_PREFIX='/protected-uploads/',  # nginx `internal` location aliased to UPLOAD_FOLDER
     )
 
     if test_config is None:
@@ -48,8 +113,19 @@ def create_app(test_config=None):
         pass
 
     # --- Database Initialization ---
-    from . import db
+    from . import db, stats, api_log, cache, tags, storage, jobs, upload_sessions
     db.init_app(app)
+    cache.init_app(app)
+    stats.init_app(app)
+    api_log.init_app(app)
+    tags.init_app(app)
+    storage.init_app(app)
+    jobs.init_app(app)
+    upload_sessions.init_app(app)
+
+    # Stream file uploads to disk as they arrive (see uploads.py)
+    from .uploads import StreamingRequest, UploadTooLarge
+    app.request_class = StreamingRequest
 
     # --- Blueprints ---
     from . import main, auth, user, admin, moderate, api
@@ -78,6 +154,13 @@ def create_app(test_config=None):
     def page_not_found(e):
         return render_template('errors/404.html'), 404
 
+    @app.errorhandler(413)
+    def request_too_large(e):
+        # Raised while an upload is still streaming in (uploads.UploadTooLarge)
+        # or by MAX_CONTENT_LENGTH; send the user back to the form
+        flash(e.description if isinstance(e, UploadTooLarge) else 'The upload is too large.', 'error')
+        return redirect(request.url)
+
     @app.errorhandler(500)
     def server_error(e):
         # Log the error details
@@ -2,14 +2,19 @@ from flask import (
     Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
 )
 from .db import get_db
-from .utils import parse_datetime, log_statistic, hash_password, get_site_settings
+from .utils import parse_datetime, log_statistic, hash_password, hash_api_key, get_site_settings, invalidate_site_settings
 from .decorators import admin_required
+from .stats import get_stats_buffer
+from .cache import get_cache, cache_stats
+from .main import invalidate_home_cache
+from .api import invalidate_api_key_cache
+from .tags import get_tag_registry
+from .storage import store_upload, release_packages, unlink_files, discard_upload
+from .inspector import inspect_package, UnsafePackage
 import secrets  # For generating API keys
 import datetime
 import sqlite3
 import os
-import zipfile
-import json
 from werkzeug.utils import secure_filename
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -129,6 +134,7 @@ def admin_settings():
             conn.execute("UPDATE site_settings SET setting_value = ? WHERE setting_name = 'theme'", (theme,))
             conn.execute("INSERT OR REPLACE INTO site_settings (setting_name, setting_value) VALUES (?, ?)", ('max_upload_size', str(max_upload_size)))
             conn.commit()
+            invalidate_site_settings()
             flash('Settings updated successfully', 'success')
         except sqlite3.Error as e:
             current_app.logger.error(f"Database error updating settings: {e}")
@@ -185,8 +191,10 @@ def admin_create_api_key():
             return redirect(url_for('admin.admin_api_keys'))
 
         new_key = secrets.token_urlsafe(32)  # Generate a secure random key
-        conn.execute('INSERT INTO api_keys (key, name, user_id) VALUES (?, ?, ?)', (new_key, name, user_id))
+        conn.execute('INSERT INTO api_keys (key, key_hash, name, user_id) VALUES (?, ?, ?, ?)',
+                     (new_key, hash_api_key(new_key), name, user_id))
         conn.commit()
+        invalidate_api_key_cache()  # Drops a cached 'unknown key' entry, if any
         flash(f'API Key "{name}" created successfully.', 'success')
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error creating API key: {e}")
@@ -207,6 +215,7 @@ def admin_toggle_api_key(key_id):
         new_status = 0 if key['is_active'] else 1
         conn.execute('UPDATE api_keys SET is_active = ? WHERE id = ?', (new_status, key_id))
         conn.commit()
+        invalidate_api_key_cache()
         status_text = "deactivated" if new_status == 0 else "activated"
         flash(f'API Key {status_text} successfully.', 'success')
     except sqlite3.Error as e:
@@ -229,6 +238,7 @@ def admin_delete_api_key(key_id):
         # Optional: Consider deleting related logs? For now, we keep them.
         conn.execute('DELETE FROM api_keys WHERE id = ?', (key_id,))
         conn.commit()
+        invalidate_api_key_cache()
         flash('API Key deleted successfully.', 'success')
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error deleting API key (ID: {key_id}): {e}")
@@ -238,51 +248,75 @@ def admin_delete_api_key(key_id):
 
 # --- End API Key Management ---
 
-@admin_bp.route('/dashboard-data')
-@admin_required
-def admin_dashboard_data():
-    conn = get_db()
-    data = {
-        'total_users': 0, 'total_adventures': 0, 'total_downloads': 0,
-        'today_stats': {'page_views': 0, 'logins': 0, 'registrations': 0, 'downloads': 0, 'uploads': 0},
-        'trends': {'page_views': 0, 'logins': 0, 'registrations': 0, 'downloads': 0, 'uploads': 0}
-    }
-    try:
-        data['total_users'] = conn.execute('SELECT COUNT(*) as count FROM users').fetchone()['count']
-        data['total_adventures'] = conn.execute('SELECT COUNT(*) as count FROM adventures WHERE approved = 1').fetchone()['count']
-        data['total_downloads'] = conn.execute('SELECT SUM(downloads) as count FROM adventures WHERE approved = 1').fetchone()['count'] or 0
-
-        today = datetime.date.today().isoformat()
-        yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
-
-        stat_names = ['page_views', 'logins', 'registrations', 'downloads', 'uploads']
-        today_stats = {}
-        yesterday_stats = {}
+DASHBOARD_STAT_NAMES = ['page_views', 'logins', 'registrations', 'downloads', 'uploads', 'rejected_packages']
 
-        for stat_name in stat_names:
-            today_val_row = conn.execute('SELECT SUM(stat_value) as value FROM statistics WHERE stat_name = ? AND date(date) = ?', (stat_name, today)).fetchone()
-            today_stats[stat_name] = today_val_row['value'] if today_val_row and today_val_row['value'] else 0
+def _build_dashboard_data(conn):
+    """Collect the dashboard numbers with one totals query and one grouped stats query."""
+    today = datetime.date.today().isoformat()
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
 
-            yesterday_val_row = conn.execute('SELECT SUM(stat_value) as value FROM statistics WHERE stat_name = ? AND date(date) = ?', (stat_name, yesterday)).fetchone()
-            yesterday_stats[stat_name] = yesterday_val_row['value'] if yesterday_val_row and yesterday_val_row['value'] else 0
-
-            # Calculate trend
-            today_val = today_stats[stat_name]
-            yesterday_val = yesterday_stats[stat_name]
-            if yesterday_val == 0:
-                data['trends'][stat_name] = 100 if today_val > 0 else 0
-            else:
-                change = ((today_val - yesterday_val) / yesterday_val) * 100
-                data['trends'][stat_name] = round(change)
+    totals = conn.execute('''
+        SELECT (SELECT COUNT(*) FROM users) as total_users,
+               (SELECT COUNT(*) FROM adventures WHERE approved = 1) as total_adventures,
+               (SELECT COALESCE(SUM(downloads), 0) FROM adventures WHERE approved = 1) as total_downloads
+    ''').fetchone()
+    data = {
+        'total_users': totals['total_users'],
+        'total_adventures': totals['total_adventures'],
+        'total_downloads': totals['total_downloads'],
+        'today_stats': dict.fromkeys(DASHBOARD_STAT_NAMES, 0),
+        'yesterday_stats': dict.fromkeys(DASHBOARD_STAT_NAMES, 0),
+        'stat_totals': dict.fromkeys(DASHBOARD_STAT_NAMES, 0),
+        'trends': dict.fromkeys(DASHBOARD_STAT_NAMES, 0)
+    }
 
-        data['today_stats'] = today_stats
+    stat_rows = conn.execute('''
+        SELECT stat_name,
+               SUM(CASE WHEN day = ? THEN stat_value ELSE 0 END) as today,
+               SUM(CASE WHEN day = ? THEN stat_value ELSE 0 END) as yesterday,
+               SUM(stat_value) as total
+        FROM daily_statistics
+        GROUP BY stat_name
+    ''', (today, yesterday)).fetchall()
+    for row in stat_rows:
+        data['today_stats'][row['stat_name']] = row['today']
+        data['yesterday_stats'][row['stat_name']] = row['yesterday']
+        data['stat_totals'][row['stat_name']] = row['total']
+
+    # Include counts still buffered in memory and not yet flushed
+    for (stat_name, day), delta in get_stats_buffer().pending().items():
+        if day == today:
+            data['today_stats'][stat_name] = data['today_stats'].get(stat_name, 0) + delta
+        elif day == yesterday:
+            data['yesterday_stats'][stat_name] = data['yesterday_stats'].get(stat_name, 0) + delta
+        data['stat_totals'][stat_name] = data['stat_totals'].get(stat_name, 0) + delta
+
+    for stat_name in DASHBOARD_STAT_NAMES:
+        # Calculate trend
+        today_val = data['today_stats'][stat_name]
+        yesterday_val = data['yesterday_stats'][stat_name]
+        if yesterday_val == 0:
+            data['trends'][stat_name] = 100 if today_val > 0 else 0
+        else:
+            change = ((today_val - yesterday_val) / yesterday_val) * 100
+            data['trends'][stat_name] = round(change)
+
+    return data
 
+@admin_bp.route('/dashboard-data')
+@admin_required
+def admin_dashboard_data():
+    # The dashboard polls this endpoint, so the numbers are computed at most
+    # once per DASHBOARD_CACHE_TTL seconds and shared by all admins.
+    cache = get_cache('dashboard', ttl=current_app.config['DASHBOARD_CACHE_TTL'], maxsize=1)
+    try:
+        data, age = cache.get_or_set('dashboard', lambda: _build_dashboard_data(get_db()))
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error fetching dashboard data: {e}")
         # Return empty/default data on error, maybe set an error flag?
         return jsonify({"error": "Could not fetch dashboard data"}), 500
 
-    return jsonify(data)
+    return jsonify(dict(data, cache_age=round(age, 1), cache_stats=cache_stats()))
 
 
 @admin_bp.route('/stats')
@@ -306,42 +340,55 @@ def admin_stats():
             WHERE a.approved = 1 GROUP BY t.id ORDER BY count DESC LIMIT 10
         ''').fetchall()
 
-        daily_stats = {}
-        stat_names = ['page_views', 'logins', 'registrations', 'downloads', 'uploads']
-        thirty_days_ago = (datetime.date.today() - datetime.timedelta(days=30)).isoformat()
-
-        for stat_name in stat_names:
-            rows = conn.execute('''
-                SELECT date(date) as day, SUM(stat_value) as value FROM statistics
-                WHERE stat_name = ? AND date(date) >= ?
-                GROUP BY day ORDER BY day
-            ''', (stat_name, thirty_days_ago)).fetchall()
-            daily_stats[stat_name] = {'days': [row['day'] for row in rows], 'values': [row['value'] for row in rows]}
+        # Both charts get one point per day for the last STATS_CHART_DAYS days;
+        # the days CTE supplies the zero rows for days with no activity.
+        chart_days = current_app.config['STATS_CHART_DAYS']
+        today = datetime.date.today()
+        daily_stats = {name: {'days': [], 'values': []} for name in DASHBOARD_STAT_NAMES}
+        stat_rows = conn.execute(f'''
+            WITH RECURSIVE days(day) AS (
+                SELECT ? UNION ALL SELECT date(day, '+1 day') FROM days WHERE day < ?
+            ), names(stat_name) AS (VALUES {', '.join(['(?)'] * len(DASHBOARD_STAT_NAMES))})
+            SELECT n.stat_name, d.day, COALESCE(s.stat_value, 0) as value
+            FROM names n CROSS JOIN days d
+            LEFT JOIN daily_statistics s ON s.stat_name = n.stat_name AND s.day = d.day
+            ORDER BY n.stat_name, d.day
+        ''', ((today - datetime.timedelta(days=chart_days - 1)).isoformat(), today.isoformat(),
+              *DASHBOARD_STAT_NAMES)).fetchall()
+        for row in stat_rows:
+            daily_stats[row['stat_name']]['days'].append(row['day'])
+            daily_stats[row['stat_name']]['values'].append(row['value'])
         stats_data['daily_stats'] = daily_stats
 
-        # Fetch API usage data (last 30 days, grouped by key name and success)
+        # API usage from the daily rollup (api_logs days are UTC), one success
+        # and one failure series per key seen in the window.
+        # Structure: { 'KeyName1': {'days': [...], 'success': [...], 'failure': [...]}, ... }
+        api_today = datetime.datetime.now(datetime.timezone.utc).date()
+        api_first_day = (api_today - datetime.timedelta(days=chart_days - 1)).isoformat()
         api_usage = {}
-        api_log_rows = conn.execute('''
-            SELECT date(timestamp) as day, api_key_name, success, COUNT(*) as count
-            FROM api_logs
-            WHERE date(timestamp) >= ?
-            GROUP BY day, api_key_name, success
-            ORDER BY day
-        ''', (thirty_days_ago,)).fetchall()
-
-        # Process API logs into a structure suitable for Chart.js
-        # Example structure: { 'KeyName1': {'days': [...], 'success': [...], 'failure': [...]}, ... }
-        for row in api_log_rows:
-            key_name = row['api_key_name'] if row['api_key_name'] else 'Invalid/Unknown'
-            if key_name not in api_usage:
-                api_usage[key_name] = {'days': [], 'success': [], 'failure': []}
-            # This aggregation might need refinement for charting (e.g., filling missing days)
-            # For simplicity, we'll just store counts per day found in logs
-            api_usage[key_name]['days'].append(row['day'])
-            if row['success']:
-                api_usage[key_name]['success'].append(row['count'])
-            else:
-                api_usage[key_name]['failure'].append(row['count'])
+        api_rows = conn.execute('''
+            WITH RECURSIVE days(day) AS (
+                SELECT ? UNION ALL SELECT date(day, '+1 day') FROM days WHERE day < ?
+            ), usage AS (
+                SELECT day, api_key_name,
+                       SUM(CASE WHEN success THEN request_count ELSE 0 END) as success,
+                       SUM(CASE WHEN success THEN 0 ELSE request_count END) as failure
+                FROM api_log_daily
+                WHERE day >= ?
+                GROUP BY day, api_key_name
+            ), key_names AS (SELECT DISTINCT api_key_name FROM usage)
+            SELECT k.api_key_name, d.day,
+                   COALESCE(u.success, 0) as success, COALESCE(u.failure, 0) as failure
+            FROM key_names k CROSS JOIN days d
+            LEFT JOIN usage u ON u.api_key_name = k.api_key_name AND u.day = d.day
+            ORDER BY k.api_key_name, d.day
+        ''', (api_first_day, api_today.isoformat(), api_first_day)).fetchall()
+        for row in api_rows:
+            key_name = row['api_key_name'] or 'Invalid/Unknown'
+            series = api_usage.setdefault(key_name, {'days': [], 'success': [], 'failure': []})
+            series['days'].append(row['day'])
+            series['success'].append(row['success'])
+            series['failure'].append(row['failure'])
         stats_data['api_usage'] = api_usage
 
     except sqlite3.Error as e:
@@ -363,11 +410,9 @@ def admin_manage_adventures():
         adventures_data = conn.execute('''
             SELECT a.id, a.name, a.description, u.username as author_username, a.author_id,
                    a.creation_date, a.file_path, a.file_size, a.game_version, a.version_compat, a.downloads,
-                   a.thumbnail_filename, a.approved, COALESCE(AVG(r.rating), 0) as avg_rating, COUNT(DISTINCT r.id) as rating_count
+                   a.thumbnail_filename, a.approved, a.avg_rating, a.rating_count
             FROM adventures a
             JOIN users u ON a.author_id = u.id
-            LEFT JOIN ratings r ON a.id = r.adventure_id
-            GROUP BY a.id
             ORDER BY a.creation_date DESC
         ''').fetchall()
 
@@ -401,11 +446,13 @@ def admin_edit_adventure(adventure_id):
         version_compat = request.form.get('version_compat')
         approved = request.form.get('approved', type=int)  # 0 or 1
         file = request.files.get('adventure_file')
+        # The connection was released while the body streamed in; check one out again
+        conn = get_db()
 
         if not name or not description or not game_version or not version_compat or approved not in [0, 1] or not new_tag_ids_str:
             flash('All fields (Name, Description, Tags, Game Version, Engine Compatibility, Approval) are required.', 'danger')
             # Re-fetch data for rendering the form again
-            all_tags = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
+            all_tags = get_tag_registry()
             current_tag_ids = [row['tag_id'] for row in conn.execute('SELECT tag_id FROM adventure_tags WHERE adventure_id = ?', (adventure_id,)).fetchall()]
             return render_template('admin/edit_adventure.html', adventure=dict(adventure), all_tags=all_tags, current_tag_ids=current_tag_ids, settings=get_site_settings(), current_admin_page='adventures')
 
@@ -416,6 +463,7 @@ def admin_edit_adventure(adventure_id):
             # Handle file update if a new file is provided
             new_file_path = adventure['file_path']
             new_file_size = adventure['file_size']
+            new_content_hash = adventure['content_hash']
             new_game_version = game_version  # Use form input by default
             new_version_compat = version_compat  # Use form input by default
             new_thumbnail_filename = adventure['thumbnail_filename']  # Keep existing thumbnail
@@ -424,51 +472,27 @@ def admin_edit_adventure(adventure_id):
                 if not file.filename.lower().endswith('.zip'):
                     flash('Only ZIP files are allowed for adventure file.', 'danger')
                     # Re-render form
-                    all_tags = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
+                    all_tags = get_tag_registry()
                     current_tag_ids = [row['tag_id'] for row in conn.execute('SELECT tag_id FROM adventure_tags WHERE adventure_id = ?', (adventure_id,)).fetchall()]
                     return render_template('admin/edit_adventure.html', adventure=dict(adventure), all_tags=all_tags, current_tag_ids=current_tag_ids, settings=get_site_settings(), current_admin_page='adventures')
 
-                # File Size Check
-                site_settings = get_site_settings()
-                max_mb = int(site_settings.get('max_upload_size', 50))
-                max_bytes = max_mb * 1024 * 1024
-                file.seek(0, os.SEEK_END)
-                file_size_new_file = file.tell()
-                file.seek(0)
-                if file_size_new_file > max_bytes:
-                    flash(f'New file size ({file_size_new_file // 1024 // 1024}MB) exceeds the maximum allowed size ({max_mb}MB).', 'danger')
-                    all_tags = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
-                    current_tag_ids = [row['tag_id'] for row in conn.execute('SELECT tag_id FROM adventure_tags WHERE adventure_id = ?', (adventure_id,)).fetchall()]
-                    return render_template('admin/edit_adventure.html', adventure=dict(adventure), all_tags=all_tags, current_tag_ids=current_tag_ids, settings=get_site_settings(), current_admin_page='adventures')
-
-                # Delete old file
-                if adventure['file_path'] and os.path.exists(adventure['file_path']):
-                    try:
-                        os.remove(adventure['file_path'])
-                    except OSError as e:
-                        current_app.logger.warning(f"Could not delete old file {adventure['file_path']}: {e}")
-
-                # Save new file
-                author_username = conn.execute('SELECT username FROM users WHERE id = ?', (adventure['author_id'],)).fetchone()['username']
-                timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-                safe_base_filename = secure_filename(f"{author_username}_adminedit_{timestamp}.zip")
-                upload_folder = current_app.config['UPLOAD_FOLDER']
-                new_file_path = os.path.join(upload_folder, safe_base_filename)
-                file.save(new_file_path)
-                new_file_size = file_size_new_file
+                # Store new file by content; the old one is released after the update
+                safe_base_filename = secure_filename(file.filename)  # For log messages only
+                new_file_path, new_file_size, new_content_hash = store_upload(conn, file)
 
                 # Extract game_version and version_compat from new zip
                 try:
-                    with zipfile.ZipFile(new_file_path, 'r') as zip_ref:
-                        if 'game_data.json' in zip_ref.namelist():
-                            with zip_ref.open('game_data.json') as game_data_file:
-                                game_data = json.load(game_data_file)
-                                game_info = game_data.get('game_info', {})
-                                # Prioritize new zip, fallback to form input
-                                new_game_version = game_info.get('version', game_version)
-                                new_version_compat = game_info.get('builder_version', version_compat)
-                        else:  # If new zip has no game_data.json, keep versions from form
-                            flash("Warning: New ZIP file does not contain 'game_data.json'. Versions from form used.", "warning")
+                    package = inspect_package(new_file_path)
+                    if package.game_data_error:
+                        raise package.game_data_error
+                    if package.has_game_data:
+                        # Prioritize new zip, fallback to form input
+                        new_game_version = package.game_info.get('version', game_version)
+                        new_version_compat = package.game_info.get('builder_version', version_compat)
+                    else:  # If new zip has no game_data.json, keep versions from form
+                        flash("Warning: New ZIP file does not contain 'game_data.json'. Versions from form used.", "warning")
+                except UnsafePackage:
+                    raise
                 except Exception as e:
                     current_app.logger.warning(f"Could not extract version from new zip {safe_base_filename}: {e}")
                     flash(f"Warning: Could not read 'game_data.json' from new ZIP: {e}. Versions from form used.", "warning")
@@ -476,30 +500,43 @@ def admin_edit_adventure(adventure_id):
             # Update adventure details
             conn.execute('''
                 UPDATE adventures 
-                SET name = ?, description = ?, game_version = ?, version_compat = ?, approved = ?, file_path = ?, file_size = ?, thumbnail_filename = ?
+                SET name = ?, description = ?, game_version = ?, version_compat = ?, approved = ?, file_path = ?, file_size = ?, content_hash = ?, thumbnail_filename = ?
                 WHERE id = ?
-            ''', (name, description, new_game_version, new_version_compat, approved, new_file_path, new_file_size, new_thumbnail_filename, adventure_id))
+            ''', (name, description, new_game_version, new_version_compat, approved, new_file_path, new_file_size, new_content_hash, new_thumbnail_filename, adventure_id))
 
             # Update tags: remove old, add new
             conn.execute('DELETE FROM adventure_tags WHERE adventure_id = ?', (adventure_id,))
             for tag_id in new_tag_ids:
                 conn.execute('INSERT INTO adventure_tags (adventure_id, tag_id) VALUES (?, ?)', (adventure_id, tag_id))
 
+            # Old package file goes only if no other adventure still uses it
+            released = []
+            if new_file_path != adventure['file_path']:
+                if adventure['content_hash']:
+                    released = release_packages(conn, [adventure['content_hash']])
+                elif adventure['file_path']:
+                    released = [adventure['file_path']]  # Not yet migrated to content storage
+
             conn.commit()
+            unlink_files(conn, released)
+            invalidate_home_cache()
             flash('Adventure updated successfully.', 'success')
             return redirect(url_for('admin.admin_manage_adventures'))
 
+        except UnsafePackage as e:
+            flash(f'The new adventure file was rejected: {e}', 'danger')
+            discard_upload(conn, new_content_hash if new_content_hash != adventure['content_hash'] else None)
         except sqlite3.Error as e:
-            conn.rollback()
             current_app.logger.error(f"Database error editing adventure {adventure_id}: {e}")
             flash('A database error occurred while updating the adventure.', 'danger') # type: ignore
+            discard_upload(conn, new_content_hash if new_content_hash != adventure['content_hash'] else None)
         except Exception as e:
-            conn.rollback()
             current_app.logger.error(f"Error editing adventure {adventure_id}: {e}")
+            discard_upload(conn, new_content_hash if new_content_hash != adventure['content_hash'] else None)
             flash(f'An unexpected error occurred: {e}', 'danger') # type: ignore
 
     # GET request
-    all_tags = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
+    all_tags = get_tag_registry()
     current_tag_ids_rows = conn.execute('SELECT tag_id FROM adventure_tags WHERE adventure_id = ?', (adventure_id,)).fetchall()
     current_tag_ids = [row['tag_id'] for row in current_tag_ids_rows]
     
@@ -516,7 +553,7 @@ def admin_delete_adventure(adventure_id):
     conn = get_db()
     try:
         conn.execute('BEGIN TRANSACTION') # Explicitly start a transaction
-        adventure = conn.execute('SELECT file_path, name, thumbnail_filename FROM adventures WHERE id = ?', (adventure_id,)).fetchone()
+        adventure = conn.execute('SELECT file_path, content_hash, name, thumbnail_filename FROM adventures WHERE id = ?', (adventure_id,)).fetchone()
         if not adventure:
             flash('Adventure not found.', 'danger')
             return redirect(url_for('admin.admin_manage_adventures'))
@@ -527,15 +564,11 @@ def admin_delete_adventure(adventure_id):
         conn.execute('DELETE FROM notifications WHERE related_id = ? AND (type = "moderation" OR type = "approval" OR type = "rejection")', (adventure_id,))  # Delete related notifications
         conn.execute('DELETE FROM adventures WHERE id = ?', (adventure_id,))
 
-        # Delete the file and thumbnail
-        if adventure['file_path'] and os.path.exists(adventure['file_path']):
-            try:
-                os.remove(adventure['file_path'])
-                current_app.logger.info(f"Admin deleted adventure file: {adventure['file_path']}")
-            except OSError as e:
-                current_app.logger.error(f"Error deleting adventure file {adventure['file_path']} by admin: {e}")
-                # Non-critical, proceed with DB deletion but warn admin
-                flash(f"Adventure '{adventure['name']}' database entries deleted, but failed to delete the associated file: {e}", 'warning')
+        # The package file is shared by identical uploads: drop it only with its last reference
+        if adventure['content_hash']:
+            released = release_packages(conn, [adventure['content_hash']])
+        else:
+            released = [adventure['file_path']] if adventure['file_path'] else []  # Not yet migrated to content storage
 
         if adventure['thumbnail_filename'] and os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], 'adventure_thumbnails', adventure['thumbnail_filename'])):
             try:
@@ -547,6 +580,10 @@ def admin_delete_adventure(adventure_id):
                 flash(f"Adventure '{adventure['name']}' database entries deleted, but failed to delete the associated thumbnail: {e}", 'warning')
 
         conn.commit()
+        if unlink_files(conn, released):
+            # Non-critical, DB deletion is done but warn admin
+            flash(f"Adventure '{adventure['name']}' database entries deleted, but failed to delete the associated file.", 'warning')
+        invalidate_home_cache()
         flash(f"Adventure '{adventure['name']}' and all its associated data deleted successfully.", 'success')
 
     except sqlite3.Error as e:
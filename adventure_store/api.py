@@ -1,11 +1,22 @@
 from flask import (
-    Blueprint, request, jsonify, current_app, g
+    Blueprint, request, jsonify, current_app, g, url_for
 )
 from werkzeug.utils import secure_filename
-from .db import get_db
-from .utils import log_statistic, get_site_settings, extract_and_save_thumbnail
-import os
-import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
+from .db import get_db, release_db
+from .utils import log_statistic, hash_api_key
+from .api_log import get_api_log_writer
+from .conditional import Validators
+from .cache import get_cache, get_version_stamps
+from .tags import get_tag_registry
+from .uploads import UploadTooLarge
+from .storage import store_upload, store_file, hash_file, discard_upload, add_package_ref, drop_package_ref, unlink_files
+from .upload_sessions import (
+    UploadSessionError, create_session, get_session, receive_chunk, record_chunk, received_ranges, delete_session,
+    discard_session, is_complete, maybe_collect_expired_sessions
+)
+from .inspector import inspect_package, save_thumbnail, check_package, UnsafePackage
+from .jobs import job_handler, enqueue_job, get_job_queue, JobFailed
 import zipfile
 import json
 from packaging.version import parse as parse_version
@@ -14,20 +25,45 @@ import sqlite3
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 def log_api_request(api_key_name, endpoint, status_code, success):
-    """Helper function to log API requests."""
-    conn = get_db()
-    ip_address = request.remote_addr
-    try:
-        conn.execute(
-            'INSERT INTO api_logs (api_key_name, ip_address, endpoint, status_code, success) VALUES (?, ?, ?, ?, ?)',
-            (api_key_name, ip_address, endpoint, status_code, success)
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        current_app.logger.error(f"Database error logging API request: {e}")
-    # No conn.close() here
+    """Helper function to log API requests.
+
+    The record is queued for the background API log writer (see
+    api_log.ApiLogWriter) instead of being inserted and committed inline.
+    """
+    get_api_log_writer().submit(api_key_name, request.remote_addr, endpoint, status_code, success)
 
 # --- API Key Authentication ---
+_UNKNOWN_KEY = {}  # Negative cache entry: the key does not exist
+
+def _api_key_cache():
+    return get_cache('api_keys', ttl=current_app.config['API_KEY_CACHE_TTL'],
+                     maxsize=current_app.config['API_KEY_CACHE_SIZE'])
+
+def lookup_api_key(api_key):
+    """Return the api_keys row (as a dict) for ``api_key``, or None if unknown.
+
+    Lookups go through a bounded LRU/TTL cache keyed by the key's hash, with
+    unknown keys cached too, so a warm check costs no database round trip.
+    Entries are also keyed by the 'api_keys' version stamp, so a change made
+    by another process is picked up within CACHE_VERSION_CHECK_INTERVAL.
+    """
+    key_hash = hash_api_key(api_key)
+    cache_key = (get_version_stamps().get('api_keys'), key_hash)
+    cache = _api_key_cache()
+    key_info = cache.get(cache_key)
+    if key_info is None:
+        row = get_db().execute(
+            'SELECT id, name, user_id, is_active FROM api_keys WHERE key_hash = ?', (key_hash,)
+        ).fetchone()
+        key_info = dict(row) if row else _UNKNOWN_KEY
+        cache.set(cache_key, key_info)
+    return key_info or None
+
+def invalidate_api_key_cache():
+    """Forget cached API keys; call after committing a change to api_keys."""
+    _api_key_cache().clear()
+    get_version_stamps().mark_stale()
+
 @api_bp.before_request
 def require_api_key():
     api_key = request.headers.get('X-API-Key')
@@ -37,17 +73,14 @@ def require_api_key():
         log_api_request(None, request.path, 401, False)
         return jsonify({"error": "API key required."}), 401
 
-    conn = get_db()
     try:
-        key_info = conn.execute(
-            'SELECT id, name, user_id, is_active FROM api_keys WHERE key = ?', (api_key,)
-        ).fetchone()
+        key_info = lookup_api_key(api_key)
 
         if not key_info or not key_info['is_active']:
             log_api_request(key_info['name'] if key_info else 'Invalid Key', request.path, 403, False)
             return jsonify({"error": "Invalid or inactive API key."}), 403
 
-        # Store key info for use in the view function
+        # Store key info for use in the view function (a copy: the cached dict is shared)
         g.api_key_info = dict(key_info)
 
     except sqlite3.Error as e:
@@ -56,8 +89,63 @@ def require_api_key():
         return jsonify({"error": "Internal server error during authentication."}), 500
     # No conn.close() here
 
+@api_bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    key_info = g.get('api_key_info')
+    log_api_request(key_info['name'] if key_info else None, request.path, 413, False)
+    if isinstance(e, UploadTooLarge):
+        return jsonify({"error": e.description}), 413
+    return jsonify({"error": "Request body is too large."}), 413
+
 # --- API Routes ---
 
+def parse_tag_ids(tags):
+    """Tag IDs from a comma-separated string (e.g. "1,5,8") or a list. Raises ValueError or TypeError."""
+    if isinstance(tags, list):
+        tag_ids = [int(tid) for tid in tags]
+    else:
+        tag_ids = [int(tid.strip()) for tid in tags.split(',') if tid.strip()]
+    if not tag_ids:
+        raise ValueError("No valid tag IDs provided")
+    return tag_ids
+
+def guard_package(source):
+    """check_package() on a path or upload stream before it is stored.
+
+    Raises UnsafePackage, or zipfile.BadZipFile for a file that is not a ZIP
+    at all. A stream is rewound afterwards, ready to be stored.
+    """
+    try:
+        check_package(source)
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+def bad_zip_message(e_zip):
+    """Client-facing error for a package that is not a readable ZIP."""
+    return f"Could not process ZIP file or game_data.json: {e_zip}"
+
+def queue_submission(conn, user_id, file_path, file_size, content_hash, file_name, description, tag_ids):
+    """Enqueue a submit_adventure job for a stored package, in the caller's transaction. Returns the job id."""
+    job_id = enqueue_job(conn, 'submit_adventure', {
+        'user_id': user_id,
+        'file_path': file_path,
+        'file_size': file_size,
+        'content_hash': content_hash,
+        'file_name': file_name,
+        'description': description,
+        'tag_ids': tag_ids,
+    }, user_id=user_id)
+    add_package_ref(conn, content_hash)  # Keeps the package while the job waits
+    return job_id
+
+def submission_accepted(job_id):
+    return jsonify({
+        "message": "Adventure received and queued for processing.",
+        "job_id": job_id,
+        "status_url": url_for('api.job_status', job_id=job_id)
+    }), 202
+
 @api_bp.route('/submit', methods=['POST'])
 def submit_adventure():
     # API key is validated by the before_request handler
@@ -78,179 +166,549 @@ def submit_adventure():
         log_api_request(api_key_name, request.path, 400, False)
         return jsonify({"error": "Only ZIP files are allowed."}), 400
 
-    # --- File Size Check ---
-    site_settings = get_site_settings()
-    max_mb = int(site_settings.get('max_upload_size', 50)) # Default 50MB if not set
-    max_bytes = max_mb * 1024 * 1024
-    file.seek(0, os.SEEK_END) # Go to end of file
-    file_size = file.tell() # Get size
-    file.seek(0) # Reset pointer to beginning
-    if file_size > max_bytes:
-        log_api_request(api_key_name, request.path, 400, False)
-        return jsonify({"error": f"File size ({file_size // (1024 * 1024)}MB) exceeds the maximum allowed size ({max_mb}MB)."}), 400
+    # The file size limit is enforced while the body streams in (see uploads.py)
 
     description = request.form.get('description')
-    tags_str = request.form.get('tags') # e.g., "1,5,8" or ["Fantasy", "Sci-Fi"] - needs parsing
 
     # --- Process Tags ---
-    # Assuming tags are sent as a comma-separated string of tag IDs
-    tag_ids = []
     try:
-        tag_ids = [int(tid.strip()) for tid in tags_str.split(',') if tid.strip()]
-        if not tag_ids: raise ValueError("No valid tag IDs provided")
-    except (ValueError, TypeError): # Catch if tags_str is None or not splittable
+        tag_ids = parse_tag_ids(request.form.get('tags'))
+    except (ValueError, TypeError): # Catch if tags are missing or not splittable
         log_api_request(api_key_name, request.path, 400, False)
         return jsonify({"error": "Invalid or missing 'tags'. Expected comma-separated IDs (e.g., '1,5,8')."}), 400
 
     conn = get_db()
     # Validate tag IDs exist
     try:
-        if tag_ids: # Only validate if tag_ids were provided
-            placeholders = ','.join('?' * len(tag_ids))
-            valid_tags_count_row = conn.execute(f'SELECT COUNT(*) as count FROM tags WHERE id IN ({placeholders})', tag_ids).fetchone()
-            if not valid_tags_count_row or valid_tags_count_row['count'] != len(tag_ids):
-                log_api_request(api_key_name, request.path, 400, False)
-                return jsonify({"error": "One or more provided tag IDs are invalid."}), 400
+        if tag_ids and not get_tag_registry().are_valid_ids(tag_ids):
+            log_api_request(api_key_name, request.path, 400, False)
+            return jsonify({"error": "One or more provided tag IDs are invalid."}), 400
 
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error validating tags during API submit: {e}")
         log_api_request(api_key_name, request.path, 500, False)
         return jsonify({"error": "Database error validating tags."}), 500
 
-    # --- File Handling & Processing ---
+    # --- File Handling ---
+    # Only the upload is stored here; the ZIP is inspected and the adventure
+    # created by a background job (process_submission), so the response time
+    # does not depend on the package size.
     user_id = key_info['user_id']
-    # Get username for filename (optional, could just use user_id)
-    user = conn.execute('SELECT username FROM users WHERE id = ?', (user_id,)).fetchone()
-    username = user['username'] if user else f"user_{user_id}"
-
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    safe_base_filename = secure_filename(f"{username}_api_{timestamp}.zip")
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-    file_path = os.path.join(upload_folder, safe_base_filename)
+    content_hash = None
 
     try:
-        # Save file
-        file.save(file_path)
+        # Zip-bomb guard on the central directory, before anything is stored
+        guard_package(file.stream)
+        # Store the streamed upload by content (identical packages are stored once)
+        file_path, file_size, content_hash = store_upload(conn, file)
+        job_id = queue_submission(conn, user_id, file_path, file_size, content_hash,
+                                  secure_filename(file.filename), description, tag_ids)
+        conn.commit()
+        get_job_queue().notify()
+        log_api_request(api_key_name, request.path, 202, True)
+        return submission_accepted(job_id)
+
+    except zipfile.BadZipFile as e_zip:
+        log_api_request(api_key_name, request.path, 400, False)
+        return jsonify({"error": bad_zip_message(e_zip)}), 400
+    except UnsafePackage as e:
+        log_api_request(api_key_name, request.path, 422, False)
+        return jsonify({"error": f"Package rejected: {e}"}), 422
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Database error during API submission: {e}")
+        # Drop the stored package unless another adventure uses it
+        discard_upload(conn, content_hash)
+        log_api_request(api_key_name, request.path, 500, False)
+        return jsonify({"error": "Database error during submission."}), 500
+    except Exception as e:
+        current_app.logger.error(f"Unexpected error during API submission: {e}")
+        # Drop the stored package unless another adventure uses it
+        discard_upload(conn, content_hash)
+        log_api_request(api_key_name, request.path, 500, False)
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
 
-        # Extract metadata from game_data.json inside the zip
-        new_adventure_name = None
-        new_game_version = "1.0.0"
-        version_compat = "Unknown"
+def _read_submission(item):
+    """Inspect a stored package and return the adventure fields it defines. Raises JobFailed."""
+    # Read game_data.json and locate the thumbnail in one pass over the ZIP
+    try:
+        package = inspect_package(item['file_path'])
+    except zipfile.BadZipFile as e_zip:
+        current_app.logger.warning(f"Error processing zip file {item['file_name']}: {e_zip}")
+        raise JobFailed(bad_zip_message(e_zip))
+    except UnsafePackage as e:
+        raise JobFailed(f"Package rejected: {e}")
+    if package.game_data_error:
+        current_app.logger.warning(f"Error processing zip file {item['file_name']}: {package.game_data_error}")
+        raise JobFailed(f"Could not process ZIP file or game_data.json: {package.game_data_error}")
+    if not package.has_game_data:
+        raise JobFailed("Missing 'game_data.json' inside the ZIP file.")
+
+    game_info = package.game_info
+    if not game_info.get('name'): # Name from game_data.json is mandatory
+        raise JobFailed("Adventure 'name' not found in 'game_data.json'.")
+    return {
+        'name': game_info.get('name'),
         # Use description from form if provided, otherwise fallback to game_data.json or default
-        new_description = description if description else "No description provided."
+        'description': item['description'] or game_info.get('description') or "No description provided.",
+        # Game's own version (e.g., "2.0.0")
+        'game_version': game_info.get('version', '1.0.0'),
+        # Engine/Builder version (e.g., "1.1.0")
+        'version_compat': game_info.get('builder_version', 'Unknown'),
+        'thumbnail': package.thumbnail,
+    }
+
+def _check_ownership_and_version(existing_active_adventure, user_id, name, game_version):
+    """Raise JobFailed unless ``user_id`` may submit ``name`` at ``game_version``."""
+    if not existing_active_adventure:
+        return
+    # Adventure with this name exists and is active. Check ownership and version.
+    if existing_active_adventure['author_id'] != user_id:
+        raise JobFailed(f"Adventure name '{name}' is already in use by another author.")
+
+    # It's the owner, check version
+    try:
+        current_version = parse_version(existing_active_adventure['game_version'])
+        submitted_version = parse_version(game_version)
+    except Exception as e_ver: # Catches InvalidVersion from packaging.version.parse
+        current_app.logger.warning(f"Version comparison error for '{name}': {e_ver}")
+        raise JobFailed(f"Invalid version format for new ('{game_version}') or existing ('{existing_active_adventure['game_version']}') adventure.")
+    if not (submitted_version > current_version):
+        raise JobFailed(f"New version ({game_version}) must be higher than the current active version ({existing_active_adventure['game_version']}).")
+
+def create_submissions(conn, user_id, items):
+    """Validate stored submissions and create their pending adventures in the current transaction.
+
+    The active adventures with the submitted names and the moderators are
+    looked up once for all items, and tags and notifications are inserted
+    with one executemany each. Returns one result per item, either
+    ``{"adventure_id": ...}`` or ``{"error": ...}``; the job references of
+    created items are handed over to their adventure rows.
+    """
+    results = []
+    prepared = []
+    for item in items:
+        try:
+            prepared.append(_read_submission(item))
+            results.append(None)
+        except JobFailed as e:
+            prepared.append(None)
+            results.append({"error": str(e)})
+
+    names = sorted({fields['name'].lower() for fields in prepared if fields})
+    existing = {}
+    if names:
+        rows = conn.execute(
+            f"SELECT LOWER(name) AS lower_name, author_id, game_version FROM adventures WHERE approved = 1 AND LOWER(name) IN ({', '.join(['?'] * len(names))})",
+            names
+        ).fetchall()
+        existing = {row['lower_name']: row for row in rows}
+    moderator_ids = [row['id'] for row in conn.execute("SELECT id FROM users WHERE role IN ('admin', 'moderator')")]
+
+    seen_names = set()
+    tag_rows = []
+    notification_rows = []
+    for index, (item, fields) in enumerate(zip(items, prepared)):
+        if fields is None:
+            continue
+        try:
+            if fields['name'].lower() in seen_names:
+                raise JobFailed(f"Adventure name '{fields['name']}' appears more than once in this batch.")
+            _check_ownership_and_version(existing.get(fields['name'].lower()), user_id, fields['name'], fields['game_version'])
+        except JobFailed as e:
+            results[index] = {"error": str(e)}
+            continue
+        seen_names.add(fields['name'].lower())
+
+        cursor = conn.execute(
+            'INSERT INTO adventures (name, description, author_id, file_path, file_size, content_hash, game_version, version_compat, approved, thumbnail_filename) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)',
+            (fields['name'], fields['description'], user_id, item['file_path'], item['file_size'], item['content_hash'], fields['game_version'], fields['version_compat'], None) # Thumbnail set by its own job
+        )
+        adventure_id = cursor.lastrowid
+        # The adventure row now references the package; the job's reference goes
+        drop_package_ref(conn, item['content_hash'])
+        tag_rows.extend((adventure_id, tag_id) for tag_id in item['tag_ids'])
+        notification_rows.extend(
+            (mod_id, f"New API submission '{fields['name']}' needs approval", 'moderation', adventure_id)
+            for mod_id in moderator_ids
+        )
+        if fields['thumbnail']:
+            enqueue_job(conn, 'extract_thumbnail', {'adventure_id': adventure_id, 'member': fields['thumbnail']})
+        results[index] = {"adventure_id": adventure_id}
+
+    conn.executemany('INSERT INTO adventure_tags (adventure_id, tag_id) VALUES (?, ?)', tag_rows)
+    conn.executemany('INSERT INTO notifications (user_id, content, type, related_id) VALUES (?, ?, ?, ?)', notification_rows)
+    return results
+
+def _release_packages_of(conn, items):
+    """Give up the job references held on the packages of ``items``."""
+    released = []
+    for item in items:
+        released.extend(drop_package_ref(conn, item['content_hash']))
+    conn.commit()
+    unlink_files(conn, released)
+
+def _release_submission_package(conn, payload):
+    """on_failure for submit_adventure jobs: give up the job's package reference."""
+    _release_packages_of(conn, [payload])
+
+def _count_created_submission(conn, payload, result):
+    """on_success for submit_adventure jobs: count the upload once the adventure is committed."""
+    log_statistic('uploads') # Log general upload stat
+
+@job_handler('submit_adventure', on_failure=_release_submission_package, on_success=_count_created_submission)
+def process_submission(conn, payload):
+    """Validate a stored API submission and create the pending adventure."""
+    result, = create_submissions(conn, payload['user_id'], [payload])
+    if 'error' in result:
+        raise JobFailed(result['error'])
+    return result
+
+def _finish_batch(conn, payload, result):
+    """on_success for submit_batch jobs: count the created adventures and release the packages of the others."""
+    created = sum(1 for item_result in result['items'] if 'adventure_id' in item_result)
+    if created:
+        log_statistic('uploads', created) # Log general upload stat
+    _release_packages_of(conn, [item for item, item_result in zip(payload['items'], result['items'])
+                                if 'error' in item_result])
+
+def _release_batch_packages(conn, payload):
+    """on_failure for submit_batch jobs: nothing was created, release every package."""
+    _release_packages_of(conn, payload['items'])
+
+@job_handler('submit_batch', on_failure=_release_batch_packages, on_success=_finish_batch)
+def process_batch(conn, payload):
+    """Create the adventures of a batch submission in one transaction; per-item results."""
+    results = create_submissions(conn, payload['user_id'], payload['items'])
+    return {"items": [{"index": item['index'], "status": "created" if 'adventure_id' in result else "failed", **result}
+                      for item, result in zip(payload['items'], results)]}
+
+@job_handler('extract_thumbnail')
+def process_thumbnail(conn, payload):
+    """Extract the thumbnail of a newly submitted adventure."""
+    adventure = conn.execute('SELECT file_path FROM adventures WHERE id = ?', (payload['adventure_id'],)).fetchone()
+    if not adventure:
+        return None  # Rejected or deleted in the meantime
+    thumbnail_filename = save_thumbnail(adventure['file_path'], payload['member'], payload['adventure_id'])
+    if thumbnail_filename:
+        conn.execute('UPDATE adventures SET thumbnail_filename = ? WHERE id = ?', (thumbnail_filename, payload['adventure_id']))
+    return {"thumbnail_filename": thumbnail_filename}
+
+@api_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    # API key is validated by the before_request handler
+    key_info = g.api_key_info
+    api_key_name = key_info['name'] if key_info else 'Unknown'
+
+    conn = get_db()
+    try:
+        job = conn.execute(
+            'SELECT id, kind, user_id, status, attempts, max_attempts, result, error, created_at, updated_at FROM jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Database error fetching job {job_id}: {e}")
+        log_api_request(api_key_name, request.path, 500, False)
+        return jsonify({"error": "Database error fetching job status."}), 500
+
+    # Jobs are only visible to the user who submitted them
+    if not job or job['user_id'] != key_info['user_id']:
+        log_api_request(api_key_name, request.path, 404, False)
+        return jsonify({"error": "Job not found."}), 404
+
+    log_api_request(api_key_name, request.path, 200, True)
+    return jsonify({
+        "job_id": job['id'],
+        "type": job['kind'],
+        "status": job['status'],
+        "attempts": job['attempts'],
+        "max_attempts": job['max_attempts'],
+        "result": json.loads(job['result']) if job['result'] else None,
+        "error": job['error'],
+        "created_at": job['created_at'].isoformat() if job['created_at'] else None,
+        "updated_at": job['updated_at'].isoformat() if job['updated_at'] else None,
+    }), 200
+
+# --- Resumable Uploads ---
+# Create a session, PUT chunks at offsets (any order, retried as needed),
+# check which ranges arrived, then finalize into the same job as /submit.
+
+def _upload_session_payload(conn, session):
+    received = received_ranges(conn, session['id'])
+    return {
+        "upload_id": session['id'],
+        "size": session['file_size'],
+        "received": received,
+        "complete": is_complete(session, received),
+    }
+
+@api_bp.route('/uploads', methods=['POST'])
+def create_upload():
+    key_info = g.api_key_info
+    api_key_name = key_info['name'] if key_info else 'Unknown'
+    data = request.get_json(silent=True) or {}
+
+    file_name = secure_filename(data.get('filename') or '')
+    if not file_name.lower().endswith('.zip'):
+        log_api_request(api_key_name, request.path, 400, False)
+        return jsonify({"error": "Only ZIP files are allowed."}), 400
+    file_size = data.get('size')
+    if not isinstance(file_size, int) or isinstance(file_size, bool):  # JSON true/false are ints too
+        log_api_request(api_key_name, request.path, 400, False)
+        return jsonify({"error": "Missing or invalid 'size' (bytes)."}), 400
+
+    conn = get_db()
+    try:
+        maybe_collect_expired_sessions(conn)
+        session = create_session(conn, key_info['user_id'], file_size, file_name, data.get('sha256'))
+        log_api_request(api_key_name, request.path, 201, True)
+        payload = _upload_session_payload(conn, session)
+        payload["chunk_size"] = current_app.config['UPLOAD_CHUNK_MAX_SIZE']
+        return jsonify(payload), 201
+    except UploadSessionError as e:
+        log_api_request(api_key_name, request.path, e.status_code, False)
+        return jsonify({"error": str(e)}), e.status_code
+    except (sqlite3.Error, OSError) as e:
+        current_app.logger.error(f"Error creating upload session: {e}")
+        log_api_request(api_key_name, request.path, 500, False)
+        return jsonify({"error": "Could not create upload session."}), 500
 
+@api_bp.route('/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def upload_session(upload_id):
+    key_info = g.api_key_info
+    api_key_name = key_info['name'] if key_info else 'Unknown'
+
+    conn = get_db()
+    try:
+        session = get_session(conn, upload_id, key_info['user_id'])
+        if not session:
+            log_api_request(api_key_name, request.path, 404, False)
+            return jsonify({"error": "Upload not found."}), 404
+
+        if request.method == 'GET':
+            log_api_request(api_key_name, request.path, 200, True)
+            return jsonify(_upload_session_payload(conn, session)), 200
+
+        if request.method == 'DELETE':
+            discard_session(conn, session)
+            log_api_request(api_key_name, request.path, 200, True)
+            return jsonify({"message": "Upload deleted."}), 200
+
+        # PUT: one chunk at ?offset=N, checked against X-Chunk-SHA256
+        offset = request.args.get('offset', type=int)
+        checksum = request.headers.get('X-Chunk-SHA256')
+        if offset is None or not checksum:
+            log_api_request(api_key_name, request.path, 400, False)
+            return jsonify({"error": "Missing 'offset' query parameter or 'X-Chunk-SHA256' header."}), 400
+        if request.content_length is None:
+            log_api_request(api_key_name, request.path, 411, False)
+            return jsonify({"error": "Content-Length is required."}), 411
+        # Hold no pooled connection while the chunk body arrives
+        release_db()
+        written, digest = receive_chunk(session, offset, request.content_length, request.stream)
+        conn = get_db()
+        record_chunk(conn, session, offset, request.content_length, written, digest, checksum)
+        log_api_request(api_key_name, request.path, 200, True)
+        return jsonify(_upload_session_payload(conn, session)), 200
+
+    except UploadSessionError as e:
+        log_api_request(api_key_name, request.path, e.status_code, False)
+        return jsonify({"error": str(e)}), e.status_code
+    except (sqlite3.Error, OSError) as e:
+        current_app.logger.error(f"Error handling upload session {upload_id}: {e}")
+        log_api_request(api_key_name, request.path, 500, False)
+        return jsonify({"error": "Upload session error."}), 500
+
+@api_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    key_info = g.api_key_info
+    api_key_name = key_info['name'] if key_info else 'Unknown'
+    data = request.get_json(silent=True) or request.form
+
+    try:
+        tag_ids = parse_tag_ids(data.get('tags'))
+    except (ValueError, TypeError):
+        log_api_request(api_key_name, request.path, 400, False)
+        return jsonify({"error": "Invalid or missing 'tags'. Expected comma-separated IDs (e.g., '1,5,8')."}), 400
+
+    conn = get_db()
+    content_hash = None
+    try:
+        if not get_tag_registry().are_valid_ids(tag_ids):
+            log_api_request(api_key_name, request.path, 400, False)
+            return jsonify({"error": "One or more provided tag IDs are invalid."}), 400
+        session = get_session(conn, upload_id, key_info['user_id'])
+        if not session:
+            log_api_request(api_key_name, request.path, 404, False)
+            return jsonify({"error": "Upload not found."}), 404
+        received = received_ranges(conn, session['id'])
+        if not is_complete(session, received):
+            log_api_request(api_key_name, request.path, 409, False)
+            return jsonify({"error": "Upload is incomplete.", "received": received}), 409
+
+        file_hash = hash_file(session['path'])
+        if session['sha256'] and file_hash != session['sha256']:
+            discard_session(conn, session)
+            log_api_request(api_key_name, request.path, 422, False)
+            return jsonify({"error": "File checksum does not match the 'sha256' given when the upload was created. The upload was deleted."}), 422
         try:
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                if 'game_data.json' in zip_ref.namelist():
-                    with zip_ref.open('game_data.json') as game_data_file:
-                        game_data = json.load(game_data_file)
-                        game_info = game_data.get('game_info', {})
-                        new_adventure_name = game_info.get('name')
-                        # Game's own version (e.g., "2.0.0")
-                        new_game_version = game_info.get('version', '1.0.0')
-                        # Engine/Builder version (e.g., "1.1.0")
-                        version_compat = game_info.get('builder_version', 'Unknown')
-                        if not description and game_info.get('description'): # Use description from game_data if not in form
-                            new_description = game_info.get('description')
-                else:
-                    os.remove(file_path) # Clean up saved file
-                    log_api_request(api_key_name, request.path, 400, False)
-                    return jsonify({"error": "Missing 'game_data.json' inside the ZIP file."}), 400
-
-                if not new_adventure_name: # Name from game_data.json is mandatory
-                    os.remove(file_path)
-                    log_api_request(api_key_name, request.path, 400, False)
-                    return jsonify({"error": "Adventure 'name' not found in 'game_data.json'."}), 400
-
-        except (zipfile.BadZipFile, json.JSONDecodeError) as e_zip:
-            os.remove(file_path) # Clean up saved file
-            current_app.logger.warning(f"Error processing zip file {safe_base_filename}: {e_zip}")
+            guard_package(session['path'])
+        except zipfile.BadZipFile as e_zip:
+            discard_session(conn, session)
             log_api_request(api_key_name, request.path, 400, False)
-            return jsonify({"error": f"Could not process ZIP file or game_data.json: {e_zip}"}), 400
+            return jsonify({"error": f"{bad_zip_message(e_zip)}. The upload was deleted."}), 400
+        except UnsafePackage as e:
+            discard_session(conn, session)
+            log_api_request(api_key_name, request.path, 422, False)
+            return jsonify({"error": f"Package rejected: {e}. The upload was deleted."}), 422
+
+        file_path, file_size, content_hash = store_file(conn, session['path'], session['file_size'], file_hash)
+        job_id = queue_submission(conn, key_info['user_id'], file_path, file_size, content_hash,
+                                  session['file_name'], data.get('description'), tag_ids)
+        delete_session(conn, session)
+        conn.commit()
+        get_job_queue().notify()
+        log_api_request(api_key_name, request.path, 202, True)
+        return submission_accepted(job_id)
+
+    except (sqlite3.Error, OSError) as e:
+        current_app.logger.error(f"Error finalizing upload {upload_id}: {e}")
+        # Drop the stored package unless another adventure uses it
+        discard_upload(conn, content_hash)
+        log_api_request(api_key_name, request.path, 500, False)
+        return jsonify({"error": "Database error during submission."}), 500
 
-        # --- Ownership and Version Check ---
-        existing_active_adventure = conn.execute(
-            'SELECT id, author_id, game_version FROM adventures WHERE LOWER(name) = LOWER(?) AND approved = 1',
-            (new_adventure_name,)
-        ).fetchone()
+# --- Batch Submission ---
+# Several packages in one request: multipart file parts named by a 'manifest'
+# field, and/or resumable uploads staged with /api/uploads. Every accepted
+# item is stored and then processed by a single submit_batch job, which
+# creates all adventures, tags and notifications in one transaction.
+
+class BatchItemRejected(Exception):
+    """A manifest entry that cannot be accepted; the message is returned to the client."""
 
-        if existing_active_adventure:
-            # Adventure with this name exists and is active. Check ownership and version.
-            if existing_active_adventure['author_id'] != user_id:
-                os.remove(file_path) # Clean up uploaded file
-                log_api_request(api_key_name, request.path, 403, False)
-                return jsonify({"error": f"Adventure name '{new_adventure_name}' is already in use by another author."}), 403
 
-            # It's the owner, check version
+def _parse_batch_manifest():
+    """The manifest items of a batch request. Raises ValueError."""
+    if request.is_json:
+        manifest = request.get_json(silent=True)
+    else:
+        try:
+            manifest = json.loads(request.form.get('manifest') or 'null')
+        except json.JSONDecodeError:
+            manifest = None
+    items = manifest.get('items') if isinstance(manifest, dict) else None
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise ValueError("Missing or invalid manifest. Expected {\"items\": [...]} with one object per package.")
+    max_items = current_app.config['API_BATCH_MAX_ITEMS']
+    if len(items) > max_items:
+        raise ValueError(f"A batch may contain at most {max_items} items.")
+    # A file part can only be stored once: its stream is consumed by the first entry
+    file_parts = [str(item['file']) for item in items if not item.get('upload_id') and item.get('file')]
+    for part in file_parts:
+        if file_parts.count(part) > 1:
+            raise ValueError(f"File part '{part}' is used by more than one entry.")
+    return items
+
+def _stage_batch_item(conn, user_id, entry):
+    """Store the package of one manifest entry. Returns (file_path, file_size, content_hash, file_name, session).
+
+    Raises BatchItemRejected, UnsafePackage or zipfile.BadZipFile with the reason the entry is rejected.
+    """
+    if entry.get('upload_id'):
+        session = get_session(conn, str(entry['upload_id']), user_id)
+        if not session:
+            raise BatchItemRejected("Upload not found.")
+        if not is_complete(session, received_ranges(conn, session['id'])):
+            raise BatchItemRejected("Upload is incomplete.")
+        file_hash = hash_file(session['path'])
+        if session['sha256'] and file_hash != session['sha256']:
+            raise BatchItemRejected("File checksum does not match the 'sha256' given when the upload was created.")
+        guard_package(session['path'])
+        return store_file(conn, session['path'], session['file_size'], file_hash) + (session['file_name'], session)
+
+    file = request.files.get(str(entry.get('file') or ''))
+    if file is None or file.filename == '':
+        raise BatchItemRejected(f"No file part named '{entry.get('file')}' in request.")
+    if not file.filename.lower().endswith('.zip'):
+        raise BatchItemRejected("Only ZIP files are allowed.")
+    guard_package(file.stream)
+    return store_upload(conn, file) + (secure_filename(file.filename), None)
+
+@api_bp.route('/submit_batch', methods=['POST'])
+def submit_batch():
+    key_info = g.api_key_info
+    api_key_name = key_info['name'] if key_info else 'Unknown'
+    user_id = key_info['user_id']
+
+    try:
+        entries = _parse_batch_manifest()
+    except ValueError as e:
+        log_api_request(api_key_name, request.path, 400, False)
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_db()
+    results = []
+    accepted = []
+    stored_hashes = []
+    try:
+        tag_registry = get_tag_registry()
+        for index, entry in enumerate(entries):
             try:
-                current_version = parse_version(existing_active_adventure['game_version'])
-                submitted_version = parse_version(new_game_version)
-                if not (submitted_version > current_version):
-                    os.remove(file_path) # Clean up
-                    log_api_request(api_key_name, request.path, 400, False)
-                    return jsonify({"error": f"New version ({new_game_version}) must be higher than the current active version ({existing_active_adventure['game_version']})."}), 400
-            except Exception as e_ver: # Catches InvalidVersion from packaging.version.parse
-                os.remove(file_path) # Clean up
-                current_app.logger.warning(f"Version comparison error for '{new_adventure_name}': {e_ver}")
-                log_api_request(api_key_name, request.path, 400, False)
-                return jsonify({"error": f"Invalid version format for new ('{new_game_version}') or existing ('{existing_active_adventure['game_version']}') adventure."}), 400
-        # If no active adventure, or if it's an update by the owner with a higher version, proceed.
-
-        # --- Database Insertion ---
-        cursor = conn.execute(
-            'INSERT INTO adventures (name, description, author_id, file_path, file_size, game_version, version_compat, approved, thumbnail_filename) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)',
-            (new_adventure_name, new_description, user_id, file_path, file_size, new_game_version, version_compat, None) # Thumbnail initially None
-        )
-        adventure_id = cursor.lastrowid
-        conn.commit() # Commit early to get adventure_id
-
-        # Add tags
-        for tag_id in tag_ids:
-            conn.execute('INSERT INTO adventure_tags (adventure_id, tag_id) VALUES (?, ?)', (adventure_id, tag_id))
-
-        # Notify moderators
-        moderators = conn.execute("SELECT id FROM users WHERE role IN ('admin', 'moderator')").fetchall()
-        for mod in moderators:
-            conn.execute(
-                'INSERT INTO notifications (user_id, content, type, related_id) VALUES (?, ?, ?, ?)',
-                (mod['id'], f"New API submission '{new_adventure_name}' needs approval", 'moderation', adventure_id)
-            )
-
-        # Extract and save thumbnail
-        new_thumbnail_filename = extract_and_save_thumbnail(file_path, adventure_id)
-        if new_thumbnail_filename:
-            conn.execute(
-                'UPDATE adventures SET thumbnail_filename = ? WHERE id = ?',
-                (new_thumbnail_filename, adventure_id)
-            )
+                try:
+                    tag_ids = parse_tag_ids(entry.get('tags'))
+                except (ValueError, TypeError, AttributeError):
+                    raise BatchItemRejected("Invalid or missing 'tags'. Expected comma-separated IDs (e.g., '1,5,8').")
+                if not tag_registry.are_valid_ids(tag_ids):
+                    raise BatchItemRejected("One or more provided tag IDs are invalid.")
+                file_path, file_size, content_hash, file_name, session = _stage_batch_item(conn, user_id, entry)
+            except BatchItemRejected as e:
+                results.append({"index": index, "status": "rejected", "error": str(e)})
+                continue
+            except zipfile.BadZipFile as e_zip:
+                results.append({"index": index, "status": "rejected", "error": bad_zip_message(e_zip)})
+                continue
+            except UnsafePackage as e:
+                results.append({"index": index, "status": "rejected", "error": f"Package rejected: {e}"})
+                continue
+            stored_hashes.append(content_hash)
+            if session:
+                delete_session(conn, session)  # Its file now lives in package storage
+            add_package_ref(conn, content_hash)  # Keeps the package while the job waits
+            accepted.append({
+                'index': index,
+                'file_path': file_path,
+                'file_size': file_size,
+                'content_hash': content_hash,
+                'file_name': file_name,
+                'description': entry.get('description'),
+                'tag_ids': tag_ids,
+            })
+            results.append({"index": index, "status": "queued"})
+
+        if not accepted:
+            conn.rollback()
+            log_api_request(api_key_name, request.path, 400, False)
+            return jsonify({"error": "No valid items in batch.", "items": results}), 400
 
+        job_id = enqueue_job(conn, 'submit_batch', {'user_id': user_id, 'items': accepted}, user_id=user_id)
         conn.commit()
-        log_statistic('uploads') # Log general upload stat
-        log_api_request(api_key_name, request.path, 201, True) # Log successful API request
-
+        get_job_queue().notify()
+        log_api_request(api_key_name, request.path, 202, True)
         return jsonify({
-            "message": "Adventure submitted successfully and is pending approval.",
-            "adventure_id": adventure_id
-        }), 201
+            "message": f"{len(accepted)} of {len(entries)} adventure(s) received and queued for processing.",
+            "job_id": job_id,
+            "status_url": url_for('api.job_status', job_id=job_id),
+            "items": results
+        }), 202
 
-    except sqlite3.Error as e:
-        conn.rollback()
-        current_app.logger.error(f"Database error during API submission: {e}")
-        # Clean up saved file if DB insert failed
-        if os.path.exists(file_path):
-             try: os.remove(file_path)
-             except OSError: pass
-        log_api_request(api_key_name, request.path, 500, False)
-        return jsonify({"error": "Database error during submission."}), 500
     except Exception as e:
+        current_app.logger.error(f"Error during API batch submission: {e}", exc_info=True)
+        # Drop the stored packages unless other adventures use them
         conn.rollback()
-        current_app.logger.error(f"Unexpected error during API submission: {e}")
-        # Clean up saved file on any unexpected error
-        if os.path.exists(file_path):
-             try: os.remove(file_path)
-             except OSError: pass
+        for content_hash in stored_hashes:
+            discard_upload(conn, content_hash)
         log_api_request(api_key_name, request.path, 500, False)
-        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+        return jsonify({"error": "Error during batch submission; nothing was stored."}), 500
 
 @api_bp.route('/tags', methods=['GET'])
 def get_tags():
@@ -258,16 +716,20 @@ def get_tags():
     key_info = g.api_key_info
     api_key_name = key_info['name'] if key_info else 'Unknown' # Should always have info here
 
-    conn = get_db()
-    try:
-        tags_data = conn.execute(
-            'SELECT id, name FROM tags ORDER BY name ASC'
-        ).fetchall()
-
-        tags_list = [{"id": tag['id'], "name": tag['name']} for tag in tags_data]
+    # The builder polls this endpoint; unchanged tags get a 304 without a query
+    validators = Validators(['tags'], per_user=False)
+    not_modified = validators.not_modified()
+    if not_modified:
+        log_api_request(api_key_name, request.path, 304, True)
+        not_modified.vary.add('X-API-Key')
+        return not_modified
 
+    try:
+        # Served from the tag registry's pre-serialised body
+        response = validators.apply(current_app.response_class(get_tag_registry().json, mimetype='application/json'))
         log_api_request(api_key_name, request.path, 200, True)
-        return jsonify(tags_list), 200
+        response.vary.add('X-API-Key')
+        return response, 200
 
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error fetching tags for API: {e}")
@@ -0,0 +1,218 @@
+import atexit
+import click
+import datetime
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import get_db, get_pool
+from .migrations import rebuild_api_log_rollup
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_BLOCK = 'block'
+
+_STOP = object()  # Queue sentinel that tells the writer thread to exit
+
+
+class ApiLogWriter:
+    """Writes api_logs rows from a bounded in-process queue on a background thread.
+
+    Request threads only enqueue a tuple. The writer drains up to
+    ``batch_size`` records at a time and inserts them with executemany in a
+    single transaction, together with the matching api_log_daily rollup
+    increments. When the queue is full, ``overflow`` decides what happens:
+    'drop' discards the record and counts it in ``dropped``, 'block' makes
+    the request wait for room. Outstanding records are written at
+    interpreter shutdown.
+
+    With ``retention_days`` > 0 the writer thread also deletes raw rows older
+    than that, at most once every ``prune_interval`` seconds.
+    """
+
+    def __init__(self, pool, queue_size=10000, batch_size=500, overflow=OVERFLOW_DROP,
+                 retention_days=0, prune_interval=3600):
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise ValueError(f"API_LOG_OVERFLOW must be '{OVERFLOW_DROP}' or '{OVERFLOW_BLOCK}', not {overflow!r}")
+        self.pool = pool
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self._last_prune = None
+        self.dropped = 0  # Records discarded because the queue was full or a write failed
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def submit(self, api_key_name, ip_address, endpoint, status_code, success):
+        """Queue one api_logs record. Never touches the database."""
+        # Same format and clock (UTC) as the column's CURRENT_TIMESTAMP default
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        record = (api_key_name, ip_address, endpoint, status_code, bool(success), timestamp)
+        if self._stopped:
+            self._write([record])  # Shutting down: write directly
+            return
+        self._ensure_started()
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self._queue.put(record)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"API log queue full, {dropped} record(s) dropped so far.")
+
+    def pending(self):
+        """Number of records waiting to be written."""
+        return self._queue.qsize()
+
+    def _write(self, batch):
+        conn = None
+        try:
+            conn = self.pool.acquire()
+            conn.executemany(
+                'INSERT INTO api_logs (api_key_name, ip_address, endpoint, status_code, success, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                batch
+            )
+            # Keep the daily rollup in step with the raw rows
+            rollup = Counter((timestamp[:10], api_key_name or '', status_code, int(success))
+                             for api_key_name, _, _, status_code, success, timestamp in batch)
+            conn.executemany(
+                '''INSERT INTO api_log_daily (day, api_key_name, status_code, success, request_count) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (day, api_key_name, status_code, success) DO UPDATE SET request_count = request_count + excluded.request_count''',
+                [(*key, count) for key, count in rollup.items()]
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Database error writing {len(batch)} API log record(s): {e}")
+            with self._lock:
+                self.dropped += len(batch)
+        finally:
+            if conn is not None:
+                self.pool.release(conn)
+
+    def _maybe_prune(self):
+        if self.retention_days <= 0:
+            return
+        now = time.monotonic()
+        if self._last_prune is not None and now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        conn = None
+        try:
+            conn = self.pool.acquire()
+            deleted = prune_api_logs(conn, self.retention_days)
+            conn.commit()
+            if deleted:
+                logger.info(f"Pruned {deleted} API log record(s) older than {self.retention_days} days.")
+        except sqlite3.Error as e:
+            logger.error(f"Database error pruning API logs: {e}")
+        finally:
+            if conn is not None:
+                self.pool.release(conn)
+
+    def _drain(self, first):
+        """Collect ``first`` plus whatever else is queued, up to batch_size. Returns (batch, stop_seen)."""
+        batch = [] if first is _STOP else [first]
+        stop_seen = first is _STOP
+        while len(batch) < self.batch_size:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is _STOP:
+                stop_seen = True
+                continue
+            batch.append(record)
+        return batch, stop_seen
+
+    def _run(self):
+        while True:
+            batch, stop_seen = self._drain(self._queue.get())
+            try:
+                if batch:
+                    self._write(batch)
+                    self._maybe_prune()
+            except Exception:
+                # Keep the thread alive: a dead writer would leave the queue to
+                # fill up (and block every request under the 'block' policy)
+                logger.error(f"Unexpected error writing {len(batch)} API log record(s).", exc_info=True)
+            if stop_seen and self._queue.empty():
+                return
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='api-log-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Write every queued record and stop the writer thread."""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=timeout)
+        # Anything left (no thread was started, or it timed out) is written here
+        while True:
+            batch, _ = self._drain(_STOP)
+            if not batch:
+                break
+            self._write(batch)
+
+
+def prune_api_logs(conn, retention_days):
+    """Delete raw api_logs rows from before the last ``retention_days`` days (UTC).
+
+    Their counts stay in api_log_daily. Returns the number of rows deleted;
+    the caller commits.
+    """
+    cutoff = (datetime.datetime.now(datetime.timezone.utc).date()
+              - datetime.timedelta(days=retention_days)).isoformat()
+    # date(timestamp) matches idx_api_logs_day
+    return conn.execute('DELETE FROM api_logs WHERE date(timestamp) < ?', (cutoff,)).rowcount
+
+
+def get_api_log_writer():
+    return current_app.extensions['api_log_writer']
+
+def init_app(app):
+    """Create the API log writer for this app and drain it at shutdown."""
+    writer = ApiLogWriter(
+        get_pool(app),
+        queue_size=app.config['API_LOG_QUEUE_SIZE'],
+        batch_size=app.config['API_LOG_BATCH_SIZE'],
+        overflow=app.config['API_LOG_OVERFLOW'],
+        retention_days=app.config['API_LOG_RETENTION_DAYS'],
+        prune_interval=app.config['API_LOG_PRUNE_INTERVAL']
+    )
+    app.extensions['api_log_writer'] = writer
+    atexit.register(writer.stop)
+    app.cli.add_command(compact_api_logs_command)
+
+@click.command('compact-api-logs')
+@click.option('--retention-days', type=int, default=None,
+              help='Keep this many days of raw logs (default: API_LOG_RETENTION_DAYS).')
+@with_appcontext
+def compact_api_logs_command(retention_days):
+    """Rebuild the daily API usage rollup and prune old raw API logs."""
+    if retention_days is None:
+        retention_days = current_app.config['API_LOG_RETENTION_DAYS']
+    conn = get_db()
+    rebuild_api_log_rollup(conn)
+    deleted = prune_api_logs(conn, retention_days) if retention_days > 0 else 0
+    conn.commit()
+    click.echo(f'API usage rollup rebuilt, {deleted} raw log record(s) pruned.')
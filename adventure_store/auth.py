@@ -3,11 +3,36 @@ from flask import (
 )
 from .db import get_db
 from .utils import hash_password, log_statistic
+from .cache import get_version_stamps
 import sqlite3
 import datetime
 
 auth_bp = Blueprint('auth', __name__)
 
+@auth_bp.before_app_request
+def refresh_session_role():
+    """Keep session['role'] current without a users query per request.
+
+    The session remembers the 'user_roles' version stamp it was filled at;
+    only when the stamp has moved (some role changed or a user was deleted)
+    is this user's role read again.
+    """
+    if 'user_id' not in session:
+        return
+    role_version = get_version_stamps().get('user_roles')
+    if role_version is None or session.get('role_version') == role_version:
+        return
+    try:
+        user = get_db().execute('SELECT role FROM users WHERE id = ?', (session['user_id'],)).fetchone()
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Database error refreshing session role: {e}")
+        return
+    if user is None:
+        session.clear()  # The account was deleted
+        return
+    session['role'] = user['role']
+    session['role_version'] = role_version
+
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -45,6 +70,7 @@ def register():
             session['user_id'] = user_id
             session['username'] = username
             session['role'] = 'user'
+            session['role_version'] = get_version_stamps().get('user_roles')
 
             flash('Registration successful! Welcome.', 'success')
             return redirect(url_for('main.index'))
@@ -86,6 +112,7 @@ def login():
                 session['user_id'] = user['id']
                 session['username'] = user['username']
                 session['role'] = user['role']
+                session['role_version'] = get_version_stamps().get('user_roles')
                 log_statistic('logins')
 
                 next_page = request.args.get('next')
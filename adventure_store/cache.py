@@ -0,0 +1,195 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """A small thread-safe in-process cache with per-entry expiry.
+
+    Entries expire ``ttl`` seconds after they were stored; once ``maxsize``
+    entries are held the least recently used one is evicted. Hit and miss
+    counts are kept for monitoring.
+    """
+
+    def __init__(self, ttl, maxsize=128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get_with_age(self, key):
+        """Return (value, age in seconds), or (None, None) on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1], now - entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None, None
+
+    def get(self, key, default=None):
+        value, age = self.get_with_age(key)
+        return default if age is None else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        """Return (value, age) for ``key``, calling ``factory()`` to fill a miss."""
+        value, age = self.get_with_age(key)
+        if age is None:
+            value, age = factory(), 0.0
+            self.set(key, value)
+        return value, age
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+def get_cache(name, ttl, maxsize=128):
+    """Return the app-wide TTLCache called ``name``, creating it on first use.
+
+    Caches live on the app, so they are shared by every request (and every
+    user) served by this process.
+    """
+    caches = current_app.extensions.setdefault('caches', {})
+    cache = caches.get(name)
+    if cache is None:
+        cache = caches.setdefault(name, TTLCache(ttl, maxsize))
+    return cache
+
+
+class VersionStamps:
+    """Process-local snapshot of the cache_versions table.
+
+    Triggers bump a row in cache_versions whenever a cached table changes
+    (see migrations.version_bump_triggers). The snapshot is re-read at most
+    once every ``check_interval`` seconds, so other worker processes see a
+    change within that window; ``mark_stale()`` forces a re-read on the next
+    lookup, which is how this process sees its own writes immediately (the
+    db teardown calls it after any request that wrote).
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._versions = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Return the current version for ``name`` (0 if it has no row), or
+        None if the stamps could not be read.
+        """
+        return self.get_stamp(name)[0]
+
+    def get_stamp(self, name):
+        """Return (version, updated_at) for ``name``; (None, None) if the
+        stamps could not be read. updated_at is a naive UTC datetime or None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            fresh = self._checked_at is not None and now - self._checked_at < self.check_interval
+            if fresh:
+                return self._versions.get(name, (0, None))
+        try:
+            rows = get_db().execute('SELECT name, version, updated_at FROM cache_versions').fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Database error reading cache versions: {e}")
+            return None, None  # Unknown: callers treat this as a miss
+        versions = {row['name']: (row['version'], row['updated_at']) for row in rows}
+        with self._lock:
+            self._versions = versions
+            self._checked_at = now
+        return versions.get(name, (0, None))
+
+    def mark_stale(self):
+        with self._lock:
+            self._checked_at = None
+
+
+class VersionedCache:
+    """Holds one value that stays valid until its cache_versions stamp changes.
+
+    ``get(loader)`` returns the cached value while the stamp is unchanged
+    and otherwise calls ``loader()`` and keeps the result.
+    ``invalidate()`` is the write-through hook: call it after committing a
+    change so this process reloads straight away.
+    """
+
+    def __init__(self, name, stamps):
+        self.name = name
+        self.stamps = stamps
+        self.hits = 0
+        self.misses = 0
+        self._value = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, loader):
+        # Read the stamp before loading: a write landing in between leaves the
+        # cache one version behind, so it reloads next time instead of
+        # holding stale data.
+        version = self.stamps.get(self.name)
+        with self._lock:
+            if version is not None and version == self._version:
+                self.hits += 1
+                return self._value
+            self.misses += 1
+        value = loader()
+        if version is not None:
+            with self._lock:
+                self._value, self._version = value, version
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = self._version = None
+        self.stamps.mark_stale()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'version': self._version}
+
+
+def get_version_stamps():
+    return current_app.extensions['version_stamps']
+
+def get_versioned_cache(name):
+    """Return the app-wide VersionedCache for the cache_versions stamp ``name``."""
+    caches = current_app.extensions.setdefault('caches', {})
+    cache = caches.get(name)
+    if cache is None:
+        cache = caches.setdefault(name, VersionedCache(name, get_version_stamps()))
+    return cache
+
+def cache_stats():
+    """Hit/miss counters for every cache this process holds, by name."""
+    return {name: cache.stats() for name, cache in current_app.extensions.get('caches', {}).items()}
+
+def init_app(app):
+    app.extensions['version_stamps'] = VersionStamps(app.config['CACHE_VERSION_CHECK_INTERVAL'])
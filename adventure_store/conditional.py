@@ -0,0 +1,75 @@
+import datetime
+import hashlib
+from flask import current_app, request, session, make_response
+from .cache import get_version_stamps
+
+# HTTP conditional GET support. Validators are derived from the cache_versions
+# stamps (kept current by triggers, see migrations.version_bump_triggers), so
+# deciding whether a client's copy is still good needs no query beyond the
+# occasional stamp refresh, and a 304 is returned before the view runs any
+# of its real queries.
+
+
+class Validators:
+    """ETag and Last-Modified for a response built from the given data stamps.
+
+    ``extra`` adds anything else the body depends on (URL arguments are
+    already covered by the URL itself). With ``per_user`` the session's user
+    and role are folded in, because HTML pages render the navbar for the
+    current user; If-Modified-Since is then only honoured for anonymous
+    visitors, since a login does not move Last-Modified.
+    """
+
+    def __init__(self, stamp_names, extra=(), per_user=True):
+        stamps = get_version_stamps()
+        parts = [current_app.config['ETAG_SALT'], *map(str, extra)]
+        self.last_modified = None
+        self.valid = True
+        for name in stamp_names:
+            version, updated_at = stamps.get_stamp(name)
+            if version is None:
+                self.valid = False  # Stamps unreadable: answer unconditionally
+            parts.append(f'{name}={version}')
+            if updated_at is not None and (self.last_modified is None or updated_at > self.last_modified):
+                self.last_modified = updated_at
+        if self.last_modified is not None:
+            self.last_modified = self.last_modified.replace(tzinfo=datetime.timezone.utc)
+
+        self.per_user = per_user
+        self.anonymous = True
+        if per_user:  # Only touch the session when needed: reading it adds Vary: Cookie
+            self.anonymous = 'user_id' not in session
+            parts += [f"user={session.get('user_id')}", f"role={session.get('role')}"]
+        self.etag = hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+
+    def not_modified(self):
+        """Return a 304 response if the client's copy is current, else None."""
+        if not self.valid or request.method not in ('GET', 'HEAD'):
+            return None
+        # A pending flash message would be lost if we skipped rendering
+        if self.per_user and '_flashes' in session:
+            return None
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(self.etag)
+        elif request.if_modified_since and self.last_modified and (self.anonymous or not self.per_user):
+            fresh = self.last_modified <= request.if_modified_since
+        else:
+            fresh = False
+        if not fresh:
+            return None
+        return self.apply(make_response('', 304))
+
+    def apply(self, response):
+        """Set the validator and caching headers on ``response``."""
+        if not self.valid:
+            return response
+        response.set_etag(self.etag)
+        if self.last_modified is not None:
+            response.last_modified = self.last_modified
+        # Caches may store the response but must revalidate every time
+        response.cache_control.no_cache = True
+        if self.per_user:
+            response.vary.add('Cookie')
+            if not self.anonymous:
+                response.cache_control.private = True
+        return response
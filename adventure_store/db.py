@@ -3,32 +3,137 @@ import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 import os
+import queue
+import threading
+from . import migrations, search
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection became available in time."""
+
+
+class ConnectionPool:
+    """A bounded pool of pre-configured SQLite connections.
+
+    Connections are opened lazily, up to ``size``, and configured once with
+    the given PRAGMAs. Idle connections are handed out most-recently-used
+    first so a request normally gets a connection with a warm page cache.
+    """
+
+    def __init__(self, database, size=8, timeout=10.0, pragmas=None):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(pragmas or {})
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _connect(self):
+        # Ensure the instance folder exists (only needed when opening a connection)
+        os.makedirs(os.path.dirname(self.database), exist_ok=True)
+        conn = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False  # Connections move between request threads
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        """Check out a connection, opening a new one if the pool is not full."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(
+                f"No database connection available after {self.timeout}s (pool size {self.size})"
+            )
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Connection is unusable, drop it so a fresh one can be opened
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones are closed on release)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def get_pool(app=None):
+    """Return the connection pool registered on the (current) app."""
+    app = app or current_app
+    return app.extensions['db_pool']
 
 def get_db():
-    """Connect to the application's configured database. The connection
-    is unique for each request and will be reused if this is called
-    again.
+    """Check out a pooled connection for the current app context. The
+    connection is unique for each request and will be reused if this is
+    called again; it goes back to the pool at teardown.
     """
     if 'db' not in g:
-        db_path = current_app.config['DATABASE']
-        # Ensure the instance folder exists
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        g.db = sqlite3.connect(
-            db_path,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
+        g.db_changes = g.db.total_changes
 
     return g.db
 
 def close_db(e=None):
-    """If this request connected to the database, close the
-    connection.
-    """
+    """If this request checked out a connection, return it to the pool."""
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        # This request wrote something: re-check the cache version stamps on
+        # the next lookup so this process sees its own change straight away
+        stamps = current_app.extensions.get('version_stamps')
+        if stamps is not None and db.total_changes != g.pop('db_changes', None):
+            stamps.mark_stale()
+        get_pool().release(db)
+
+def release_db():
+    """Give this request's connection back to the pool before the request ends.
+
+    Call it before work that needs no database for a while, such as reading
+    an upload body, so slow clients do not hold pooled connections. Anything
+    uncommitted is rolled back; the next get_db() checks out a connection
+    again.
+    """
+    close_db()
 
 def init_db():
     """Clear existing data and create new tables."""
@@ -56,9 +161,57 @@ def init_db_command():
     # import init_db as db_initializer
     # db_initializer.initialize() # Assuming init_db.py has an initialize function
 
+@click.command('repair-ratings')
+@with_appcontext
+def repair_ratings_command():
+    """Recompute the cached rating aggregates on adventures from ratings."""
+    conn = get_db()
+    repaired = migrations.recompute_rating_aggregates(conn)
+    conn.commit()
+    click.echo(f'Rating aggregates checked, {repaired} adventure(s) repaired.')
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuild the adventures full-text search index from scratch."""
+    conn = get_db()
+    search.rebuild_search_index(conn)
+    conn.commit()
+    click.echo('Search index rebuilt.')
+
+@click.command('repair-counters')
+@with_appcontext
+def repair_counters_command():
+    """Recompute the trigger-maintained site counters from the tables."""
+    conn = get_db()
+    pending = migrations.recompute_site_counters(conn)
+    conn.commit()
+    click.echo(f'Site counters checked, {pending} adventure(s) pending moderation.')
+
+def migrate(app):
+    """Apply pending schema migrations. A no-op (one PRAGMA read) when the
+    database is already up to date.
+    """
+    pool = get_pool(app)
+    conn = pool.acquire()
+    try:
+        return migrations.run_migrations(conn)
+    finally:
+        pool.release(conn)
+
 def init_app(app):
     """Register database functions with the Flask app. This is called by
     the application factory.
     """
+    app.extensions['db_pool'] = ConnectionPool(
+        app.config['DATABASE'],
+        size=app.config['DB_POOL_SIZE'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        pragmas=app.config['DB_PRAGMAS']
+    )
+    migrate(app)
     app.teardown_appcontext(close_db)
+    app.cli.add_command(repair_ratings_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(repair_counters_command)
     # app.cli.add_command(init_db_command) # Optional: Add CLI command to initialize DB
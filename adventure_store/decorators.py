@@ -1,7 +1,5 @@
 from functools import wraps
-from flask import session, flash, redirect, url_for, request, current_app
-from .db import get_db
-import sqlite3
+from flask import session, flash, redirect, url_for, request
 
 def login_required(f):
     """Decorator to require login for a route."""
@@ -14,23 +12,16 @@ def login_required(f):
     return decorated_function
 
 def _check_role(required_roles):
-    """Inner helper to check user role."""
+    """Inner helper to check user role.
+
+    Uses the role in the session, which auth.refresh_session_role re-reads
+    before the request whenever any user's role has changed.
+    """
     if 'user_id' not in session:
         flash('Please log in to access this page', 'error')
         return redirect(url_for('auth.login', next=request.url))
 
-    conn = get_db()
-    user = None
-    try:
-        user = conn.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    except sqlite3.Error as e:
-        current_app.logger.error(f"Database error checking role: {e}")
-        flash('An error occurred while verifying permissions.', 'error')
-        return redirect(url_for('main.index')) # Redirect to a safe page
-
-    # No conn.close() here
-
-    if not user or user['role'] not in required_roles:
+    if session.get('role') not in required_roles:
         flash('You do not have permission to access this page', 'error')
         return redirect(url_for('main.index'))
     return None # Indicates permission granted
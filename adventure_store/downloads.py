@@ -0,0 +1,88 @@
+import os
+from urllib.parse import quote
+from flask import current_app, request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+# Package downloads can be handed to the front-end server once the view has
+# checked permissions and counted the download. DOWNLOAD_OFFLOAD selects how:
+#   'x-accel-redirect'  nginx; DOWNLOAD_ACCEL_PREFIX must be an `internal`
+#                       location aliased to UPLOAD_FOLDER
+#   'x-sendfile'        Apache mod_xsendfile, lighttpd
+#   None                the worker streams the file itself (send_from_directory)
+# Offloaded responses carry the headers only; no file bytes pass through Python.
+# They include the content-hash ETag, which the front-end server must pass on
+# for If-Range to resume against it (nginx: `etag off;` and
+# `add_header ETag $upstream_http_etag;` in the internal location).
+#
+# Served from Python, downloads answer Range/If-Range and If-None-Match
+# against a strong ETag, the package's SHA-256 stored at upload time, so an
+# interrupted download resumes only while the file is unchanged. Full files
+# go out through the server's wsgi.file_wrapper where it has one, which lets
+# servers such as gunicorn use zero-copy sendfile(). Byte ranges are sliced
+# by Werkzeug: a file_wrapper always sends to the end of the file, so it cannot
+# bound a range.
+
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+
+
+def send_package(directory, filename, download_name, etag=None):
+    """Send ``filename`` (relative to ``directory``) as an attachment named ``download_name``.
+
+    ``etag`` is the package's content hash (None for unmigrated rows, which
+    get Werkzeug's mtime-based ETag). Raises NotFound, or
+    RequestedRangeNotSatisfiable for a Range outside the file.
+    """
+    path = safe_join(os.path.abspath(directory), filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    mode = current_app.config['DOWNLOAD_OFFLOAD']
+    if mode not in (X_ACCEL_REDIRECT, X_SENDFILE):
+        return send_from_directory(directory, filename, as_attachment=True, download_name=download_name,
+                                   etag=etag or True)
+
+    # Headers only (Content-Disposition, Content-Length, ETag, ...) with an
+    # X-Sendfile header instead of a body; conditional and range requests are
+    # left to the front-end server, which sees the file itself
+    response = send_file(path, request.environ, as_attachment=True, download_name=download_name,
+                         use_x_sendfile=True, conditional=False, etag=etag or False,
+                         response_class=current_app.response_class)
+    if mode == X_ACCEL_REDIRECT:
+        del response.headers['X-Sendfile']
+        prefix = current_app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f"{prefix}/{quote(filename.replace(os.sep, '/'))}"
+    return response
+
+def is_full_download(response):
+    """Whether ``response`` from send_package() delivers the whole package.
+
+    Resumed or parallel range requests, revalidations (304) and HEAD
+    requests belong to a download that was already counted. ``bytes=0-``
+    asks for everything and does count, as does a Range whose If-Range no
+    longer matches: the whole (changed) file is sent then.
+    """
+    if request.method != 'GET':
+        return False
+    if response.status_code == 206:
+        content_range = response.content_range
+        return content_range.start == 0 and content_range.stop == content_range.length
+    if response.status_code != 200:
+        return False
+    if 'X-Sendfile' in response.headers or 'X-Accel-Redirect' in response.headers:
+        # The front-end server answers Range and If-None-Match itself
+        if request.if_none_match:
+            return False
+        byte_range = request.range
+        if byte_range is None or byte_range.ranges == [(0, None)]:
+            return True
+        # A stale If-Range makes the server ignore Range and send the whole file
+        if_range = request.if_range
+        if if_range.etag is not None:
+            return if_range.etag != response.get_etag()[0]
+        if if_range.date is not None:
+            return if_range.date != response.last_modified
+        return False
+    return True
@@ -0,0 +1,176 @@
+import json
+import os
+import zipfile
+from flask import current_app
+from .utils import log_statistic
+
+# Adventure packages are inspected in a single pass: the ZIP central directory
+# is read once into a name index and a basename index, game_data.json is
+# parsed and the thumbnail is located from those indexes. Images are then
+# streamed out with a fixed-size buffer.
+#
+# Before anything is decompressed, check_archive() compares the sizes the
+# central directory declares against the ZIP_* limits, so a zip bomb is
+# rejected in O(entries). Reads of members are capped as well, in case an
+# entry decompresses to more than it claims.
+
+GAME_DATA_NAME = 'game_data.json'
+# Preferred thumbnail names, in order, matched case-insensitively anywhere in the archive
+THUMBNAIL_NAMES = (
+    'thumbnail.png', 'thumbnail.jpg', 'thumbnail.jpeg',
+    'cover.png', 'cover.jpg', 'cover.jpeg',
+    'thumb.png', 'thumb.jpg', 'thumb.jpeg',
+)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+COPY_BUFFER_SIZE = 64 * 1024
+NESTED_ARCHIVE_EXTENSIONS = ('.zip', '.jar', '.rar', '.7z', '.tar', '.gz', '.tgz', '.bz2', '.xz')
+
+
+class UnsafePackage(Exception):
+    """The archive exceeds the configured ZIP_* limits and was not extracted."""
+
+
+class PackageInfo:
+    """What inspect_package() found in an adventure ZIP.
+
+    ``game_data`` is the parsed game_data.json (None if the archive has
+    none), ``game_data_error`` the JSONDecodeError if it could not be parsed
+    and ``thumbnail`` the name of the member to use as thumbnail, or None.
+    """
+
+    def __init__(self, game_data=None, game_data_error=None, thumbnail=None):
+        self.game_data = game_data
+        self.game_data_error = game_data_error
+        self.thumbnail = thumbnail
+
+    @property
+    def has_game_data(self):
+        return self.game_data is not None or self.game_data_error is not None
+
+    @property
+    def game_info(self):
+        """The game_info object from game_data.json, or an empty dict."""
+        game_info = self.game_data.get('game_info') if isinstance(self.game_data, dict) else None
+        return game_info if isinstance(game_info, dict) else {}
+
+
+def _reject(message):
+    current_app.logger.warning(f"Package rejected: {message}")
+    # Written when the app context ends (stats.flush_after_request) if it holds
+    # a connection, so a store transaction still open here is not waited on
+    log_statistic('rejected_packages')
+    raise UnsafePackage(message)
+
+def check_archive(archive):
+    """Raise UnsafePackage if the central directory of ``archive`` exceeds the ZIP_* limits.
+
+    Only the declared entry sizes are looked at; nothing is decompressed.
+    """
+    config = current_app.config
+    entries = archive.infolist()
+    if len(entries) > config['ZIP_MAX_ENTRIES']:
+        _reject(f"Archive has {len(entries)} entries (limit {config['ZIP_MAX_ENTRIES']}).")
+    total_size = 0
+    for entry in entries:
+        if entry.is_dir():
+            continue
+        if entry.file_size > config['ZIP_MAX_MEMBER_SIZE']:
+            _reject(f"'{entry.filename}' unpacks to {entry.file_size} bytes (limit {config['ZIP_MAX_MEMBER_SIZE']}).")
+        total_size += entry.file_size
+        if total_size > config['ZIP_MAX_TOTAL_SIZE']:
+            _reject(f"Archive unpacks to more than {config['ZIP_MAX_TOTAL_SIZE']} bytes.")
+        # Small members may compress very well legitimately (e.g. JSON), so
+        # the ratio only counts above ZIP_RATIO_MIN_SIZE
+        if entry.file_size > config['ZIP_RATIO_MIN_SIZE'] and \
+                entry.file_size > max(entry.compress_size, 1) * config['ZIP_MAX_RATIO']:
+            _reject(f"'{entry.filename}' has a compression ratio above {config['ZIP_MAX_RATIO']}:1.")
+        if not config['ZIP_ALLOW_NESTED_ARCHIVES'] and entry.filename.lower().endswith(NESTED_ARCHIVE_EXTENSIONS):
+            _reject(f"Nested archive '{entry.filename}' is not allowed.")
+
+def check_package(source):
+    """check_archive() for a ZIP given as a path or a seekable binary file object.
+
+    A file object is left open, positioned wherever the ZIP reader stopped.
+    Raises UnsafePackage or zipfile.BadZipFile.
+    """
+    with zipfile.ZipFile(source, 'r') as archive:
+        check_archive(archive)
+
+def read_member(archive, entry, limit):
+    """Decompress ``entry``, raising UnsafePackage once more than ``limit`` bytes come out."""
+    with archive.open(entry) as source:
+        data = source.read(limit + 1)
+    if len(data) > limit:
+        _reject(f"'{entry.filename}' is larger than {limit} bytes.")
+    return data
+
+def inspect_package(path):
+    """Read the ZIP at ``path`` once and return a PackageInfo.
+
+    Raises zipfile.BadZipFile if the file is not a ZIP archive and
+    UnsafePackage if it exceeds the ZIP_* limits.
+    """
+    with zipfile.ZipFile(path, 'r') as archive:
+        check_archive(archive)
+        by_name = {}
+        by_basename = {}
+        for entry in archive.infolist():
+            if entry.is_dir():
+                continue
+            by_name[entry.filename] = entry
+            # First entry in archive order wins, as a namelist() scan would find it
+            by_basename.setdefault(os.path.basename(entry.filename).lower(), entry)
+
+        info = PackageInfo()
+        game_data_entry = by_name.get(GAME_DATA_NAME)
+        if game_data_entry is not None:
+            game_data = read_member(archive, game_data_entry, current_app.config['ZIP_MAX_GAME_DATA_SIZE'])
+            try:
+                info.game_data = json.loads(game_data)
+            except json.JSONDecodeError as e:
+                info.game_data_error = e
+
+        thumbnail = _find_thumbnail(by_name, by_basename, info.game_info)
+        info.thumbnail = thumbnail.filename if thumbnail else None
+        return info
+
+def _find_thumbnail(by_name, by_basename, game_info):
+    # 1. Common thumbnail names
+    for name in THUMBNAIL_NAMES:
+        if name in by_basename:
+            return by_basename[name]
+
+    # 2. game_info.start_image_path, by full path and then by file name
+    start_image_path = game_info.get('start_image_path')
+    if isinstance(start_image_path, str) and start_image_path.lower().endswith(IMAGE_EXTENSIONS):
+        start_image_path = start_image_path.replace('\\', '/')
+        return by_name.get(start_image_path) or by_basename.get(os.path.basename(start_image_path).lower())
+    return None
+
+def save_thumbnail(path, member, adventure_id):
+    """Stream ``member`` of the ZIP at ``path`` into THUMBNAIL_FOLDER.
+
+    Returns the saved thumbnail filename, or None if it could not be
+    extracted or is larger than ZIP_MAX_THUMBNAIL_SIZE.
+    """
+    thumbnail_filename = f"thumb_adv_{adventure_id}{os.path.splitext(member)[1]}"
+    thumbnail_save_path = os.path.join(current_app.config['THUMBNAIL_FOLDER'], thumbnail_filename)
+    limit = current_app.config['ZIP_MAX_THUMBNAIL_SIZE']
+    try:
+        with zipfile.ZipFile(path, 'r') as archive, archive.open(member) as source_image, \
+                open(thumbnail_save_path, 'wb') as target_file:
+            copied = 0
+            while chunk := source_image.read(COPY_BUFFER_SIZE):
+                copied += len(chunk)
+                if copied > limit:
+                    raise ValueError(f"thumbnail is larger than {limit} bytes")
+                target_file.write(chunk)
+    except (zipfile.BadZipFile, KeyError, OSError, ValueError) as e:
+        current_app.logger.error(f"Error extracting thumbnail for adventure {adventure_id} from {path}: {e}")
+        try:
+            os.remove(thumbnail_save_path)
+        except OSError:
+            pass
+        return None
+    current_app.logger.info(f"Thumbnail '{thumbnail_filename}' extracted and saved for adventure {adventure_id}.")
+    return thumbnail_filename
@@ -0,0 +1,258 @@
+import atexit
+import click
+import json
+import logging
+import sqlite3
+import threading
+import time
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# kind -> (handler, on_failure, on_success), filled by @job_handler
+JOB_HANDLERS = {}
+
+
+class JobFailed(Exception):
+    """Raised by a job handler for a permanent failure: the job is not retried."""
+
+
+def job_handler(kind, on_failure=None, on_success=None):
+    """Register ``func(conn, payload)`` as the handler for jobs of ``kind``.
+
+    The handler must not commit: its writes are committed together with the
+    job's 'succeeded' status, so a retried job never applies them twice. The
+    returned value (JSON-serialisable) becomes the job result. Raise JobFailed
+    for errors that retrying cannot fix; anything else is retried with
+    backoff until the job runs out of attempts.
+
+    ``on_failure(conn, payload)`` runs once the job has been marked failed,
+    and ``on_success(conn, payload, result)`` once it has succeeded, to
+    release whatever the job was holding; they commit their own work.
+    """
+    def decorator(func):
+        JOB_HANDLERS[kind] = (func, on_failure, on_success)
+        return func
+    return decorator
+
+
+def enqueue_job(conn, kind, payload, user_id=None, max_attempts=None):
+    """Add a job in the caller's transaction. Returns the job id.
+
+    Workers see the job once the caller commits; call
+    ``get_job_queue().notify()`` after that to have it picked up straight away.
+    """
+    if max_attempts is None:
+        max_attempts = current_app.config['JOB_MAX_ATTEMPTS']
+    cursor = conn.execute(
+        'INSERT INTO jobs (kind, payload, user_id, max_attempts) VALUES (?, ?, ?, ?)',
+        (kind, json.dumps(payload), user_id, max_attempts)
+    )
+    return cursor.lastrowid
+
+
+class JobQueue:
+    """Runs jobs from the SQLite ``jobs`` table on worker threads.
+
+    Claiming a job is one UPDATE inside BEGIN IMMEDIATE, so any number of
+    threads and processes (see ``flask run-jobs``) can share the table. A job
+    whose worker died is claimed again once its lock expires. Failed attempts
+    are retried after ``retry_delay`` seconds, doubling each time. Finished
+    jobs are deleted after ``retention_days``.
+    """
+
+    def __init__(self, app, workers=2, poll_interval=2.0, retry_delay=10.0, lock_timeout=300,
+                 retention_days=7, prune_interval=3600):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.lock_timeout = lock_timeout
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self._last_prune = None
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def notify(self):
+        """Wake an idle worker (jobs are also found by polling)."""
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _claim(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            job = conn.execute(f'''
+                UPDATE jobs SET status = '{RUNNING}', attempts = attempts + 1,
+                    locked_until = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE (status = '{QUEUED}' AND run_after <= CURRENT_TIMESTAMP)
+                       OR (status = '{RUNNING}' AND locked_until < CURRENT_TIMESTAMP)
+                    ORDER BY run_after, id LIMIT 1
+                )
+                RETURNING *
+            ''', (f'+{int(self.lock_timeout)} seconds',)).fetchone()
+            conn.commit()
+            return job
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    def _finish(self, conn, job, status, result=None, error=None):
+        conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, locked_until = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (status, json.dumps(result) if result is not None else None, error, job['id'])
+        )
+        conn.commit()
+
+    def _after(self, conn, job, hook, *args):
+        if hook is None:
+            return
+        try:
+            hook(conn, json.loads(job['payload']), *args)
+        except Exception:
+            conn.rollback()
+            logger.error(f"Cleanup after job {job['id']} ({job['kind']}) raised.", exc_info=True)
+
+    def _fail(self, conn, job, error):
+        self._finish(conn, job, FAILED, error=error)
+        logger.warning(f"Job {job['id']} ({job['kind']}) failed: {error}")
+        _, on_failure, _ = JOB_HANDLERS.get(job['kind'], (None, None, None))
+        self._after(conn, job, on_failure)
+
+    def run_job(self, conn, job):
+        """Run one claimed job and record the outcome."""
+        handler, _, on_success = JOB_HANDLERS.get(job['kind'], (None, None, None))
+        if handler is None:
+            self._fail(conn, job, f"No handler for job kind '{job['kind']}'.")
+            return
+        if job['attempts'] > job['max_attempts']:
+            self._fail(conn, job, 'Worker stopped while running the job.')
+            return
+        try:
+            result = handler(conn, json.loads(job['payload']))
+            self._finish(conn, job, SUCCEEDED, result=result)
+        except JobFailed as e:
+            conn.rollback()
+            self._fail(conn, job, str(e))
+        except Exception as e:
+            conn.rollback()
+            if job['attempts'] >= job['max_attempts']:
+                logger.error(f"Job {job['id']} ({job['kind']}) raised on its last attempt.", exc_info=True)
+                self._fail(conn, job, f'Processing error: {e}')
+                return
+            delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+            logger.warning(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} raised, retrying in {delay:.0f}s: {e}")
+            conn.execute(f'''
+                UPDATE jobs SET status = '{QUEUED}', error = ?, locked_until = NULL,
+                    run_after = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (str(e), f'+{int(delay)} seconds', job['id']))
+            conn.commit()
+        else:
+            self._after(conn, job, on_success, result)
+
+    def run_pending(self):
+        """Claim and run one due job in a fresh app context. Returns False if none was due."""
+        with self.app.app_context():
+            conn = get_db()
+            job = self._claim(conn)
+            if job is None:
+                self._maybe_prune(conn)
+                return False
+            self.run_job(conn, job)
+            return True
+
+    def _maybe_prune(self, conn):
+        if self.retention_days <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._last_prune is not None and now - self._last_prune < self.prune_interval:
+                return
+            self._last_prune = now
+        deleted = conn.execute(
+            f"DELETE FROM jobs WHERE status IN ('{SUCCEEDED}', '{FAILED}') AND updated_at < datetime('now', ?)",
+            (f'-{int(self.retention_days)} days',)
+        ).rowcount
+        conn.commit()
+        if deleted:
+            logger.info(f"Pruned {deleted} finished job(s) older than {self.retention_days} days.")
+
+    def work(self):
+        """Worker loop: run due jobs, otherwise wait for notify() or the poll interval."""
+        while not self._stop.is_set():
+            try:
+                if self.run_pending():
+                    continue
+            except sqlite3.Error as e:
+                logger.error(f"Database error in job worker: {e}")
+            with self._wakeup:
+                self._wakeup.wait(self.poll_interval)
+
+    def start(self):
+        """Start the worker threads, once."""
+        if self._threads or self.workers <= 0 or self._stop.is_set():
+            return
+        with self._lock:
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self.work, name=f'job-worker-{i + 1}', daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """Let running jobs finish and stop the worker threads."""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+
+def get_job_queue():
+    return current_app.extensions['job_queue']
+
+def init_app(app):
+    """Create the job queue; worker threads start with the first request."""
+    job_queue = JobQueue(
+        app,
+        workers=app.config['JOB_WORKERS'],
+        poll_interval=app.config['JOB_POLL_INTERVAL'],
+        retry_delay=app.config['JOB_RETRY_DELAY'],
+        lock_timeout=app.config['JOB_LOCK_TIMEOUT'],
+        retention_days=app.config['JOB_RETENTION_DAYS']
+    )
+    app.extensions['job_queue'] = job_queue
+    app.before_request(job_queue.start)  # So CLI commands do not start workers
+    atexit.register(job_queue.stop)
+    app.cli.add_command(run_jobs_command)
+
+@click.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now, then exit.')
+@with_appcontext
+def run_jobs_command(once):
+    """Process background jobs in this process (alongside or instead of JOB_WORKERS threads)."""
+    job_queue = get_job_queue()
+    if once:
+        count = 0
+        while job_queue.run_pending():
+            count += 1
+        click.echo(f'{count} job(s) processed.')
+        return
+    click.echo('Processing jobs, press Ctrl+C to stop.')
+    try:
+        job_queue.work()
+    except KeyboardInterrupt:
+        job_queue.stop()
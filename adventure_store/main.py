@@ -1,138 +1,221 @@
 from flask import (
     Blueprint, render_template, request, redirect, url_for, flash,
-    session, send_from_directory, current_app
+    session, send_from_directory, current_app, make_response
 )
 from .db import get_db
 from .utils import parse_datetime, log_statistic
+from .search import (
+    build_match_query, highlight_snippet, RANK_EXPRESSION, SNIPPET_EXPRESSION, SNIPPET_PARAMS
+)
+from .pagination import encode_cursor, decode_cursor, keyset_sql
 from .decorators import login_required
+from .cache import get_cache
+from .conditional import Validators
+from .tags import get_tag_registry
+from .downloads import send_package, is_full_download
 
 import os
 import sqlite3
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
 main_bp = Blueprint('main', __name__)
 
+HOME_CACHE_KEY = 'blocks'
+
+def _load_home_blocks():
+    """Query the featured, recent and popular-tag blocks of the home page."""
+    conn = get_db()
+    # Get featured adventures
+    featured = conn.execute('''
+        SELECT a.id, a.name, a.description, u.username as author, a.creation_date, a.file_size,
+               a.game_version, a.version_compat, a.downloads, a.thumbnail_filename, a.avg_rating, a.rating_count
+        FROM adventures a
+        JOIN users u ON a.author_id = u.id
+        WHERE a.approved = 1
+        ORDER BY a.avg_rating DESC, a.downloads DESC
+        LIMIT 6
+    ''').fetchall()
+    processed_featured = []
+    for adv in featured:
+        adv_dict = dict(adv)
+        adv_dict['creation_date'] = parse_datetime(adv_dict['creation_date'])
+        processed_featured.append(adv_dict)
+
+    # Get recent adventures
+    recent = conn.execute('''
+        SELECT a.id, a.name, a.description, u.username as author, a.creation_date, a.game_version, a.version_compat, a.thumbnail_filename
+        FROM adventures a 
+        JOIN users u ON a.author_id = u.id
+        WHERE a.approved = 1
+        ORDER BY a.creation_date DESC
+        LIMIT 6
+    ''').fetchall()
+    processed_recent = [dict(adv) for adv in recent]
+    for adv in processed_recent:
+        adv['creation_date'] = parse_datetime(adv['creation_date'])
+
+    # Get popular tags
+    tags = [dict(tag) for tag in conn.execute('''
+        SELECT t.id, t.name, COUNT(at.adventure_id) as adventure_count
+        FROM tags t
+        JOIN adventure_tags at ON t.id = at.tag_id
+        JOIN adventures a ON at.adventure_id = a.id
+        WHERE a.approved = 1
+        GROUP BY t.id
+        ORDER BY adventure_count DESC
+        LIMIT 10
+    ''').fetchall()]
+
+    return {'featured': processed_featured, 'recent': processed_recent, 'tags': tags}
+
+def invalidate_home_cache():
+    """Drop the cached home page blocks. Call after committing a change that
+    affects them (approval, rating, edit, delete). Other worker processes
+    pick the change up when their copy expires after HOME_CACHE_TTL seconds.
+    """
+    get_cache('home', ttl=current_app.config['HOME_CACHE_TTL'], maxsize=1).pop(HOME_CACHE_KEY)
+
 @main_bp.route('/')
 def index():
     log_statistic('page_views')
-    conn = get_db()
-    processed_featured = []
-    processed_recent = []
-    tags = []
+    blocks = {'featured': [], 'recent': [], 'tags': []}
 
     try:
-        # Get featured adventures
-        query_common_fields = '''a.id, a.name, a.description, u.username as author, a.creation_date, a.file_size,
-                   a.game_version, a.version_compat, a.downloads, a.thumbnail_filename, COALESCE(AVG(r.rating), 0) as avg_rating,'''
-        featured = conn.execute(f'''
-            SELECT {query_common_fields}
-                   COUNT(DISTINCT r.id) as rating_count
-            FROM adventures a
-            JOIN users u ON a.author_id = u.id
-            LEFT JOIN ratings r ON a.id = r.adventure_id
-            WHERE a.approved = 1
-            GROUP BY a.id
-            ORDER BY avg_rating DESC, downloads DESC
-            LIMIT 6
-        ''').fetchall()
-        for adv in featured:
-            adv_dict = dict(adv)
-            adv_dict['creation_date'] = parse_datetime(adv_dict['creation_date'])
-            processed_featured.append(adv_dict)
-
-        # Get recent adventures
-        recent = conn.execute('''
-            SELECT a.id, a.name, a.description, u.username as author, a.creation_date, a.game_version, a.version_compat, a.thumbnail_filename
-            FROM adventures a 
-            JOIN users u ON a.author_id = u.id
-            WHERE a.approved = 1
-            ORDER BY a.creation_date DESC
-            LIMIT 6
-        ''').fetchall()
-        processed_recent = [dict(adv) for adv in recent]
-        for adv in processed_recent:
-            adv['creation_date'] = parse_datetime(adv['creation_date'])
-
-        # Get popular tags
-        tags = conn.execute('''
-            SELECT t.id, t.name, COUNT(at.adventure_id) as adventure_count
-            FROM tags t
-            JOIN adventure_tags at ON t.id = at.tag_id
-            JOIN adventures a ON at.adventure_id = a.id
-            WHERE a.approved = 1
-            GROUP BY t.id
-            ORDER BY adventure_count DESC
-            LIMIT 10
-        ''').fetchall()
-
+        # The blocks are shared by every visitor, so they are built at most
+        # once per HOME_CACHE_TTL seconds unless a write invalidates them
+        cache = get_cache('home', ttl=current_app.config['HOME_CACHE_TTL'], maxsize=1)
+        blocks, _ = cache.get_or_set(HOME_CACHE_KEY, _load_home_blocks)
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error on index page: {e}")
         flash("Could not load page data. Please try again later.", "error")
 
-    return render_template('index.html', featured=processed_featured, recent=processed_recent, tags=tags)
+    return render_template('index.html', **blocks)
 
 
+# Catalog sort orders: ([(SQL expression, result column), ...], descending).
+# Every sort ends with a.id so the keys are unique, and for the unfiltered
+# listing each one matches an index on adventures (approved, ...).
+CATALOG_SORTS = {
+    'newest': ([('a.creation_date', 'creation_date'), ('a.id', 'id')], True),
+    'oldest': ([('a.creation_date', 'creation_date'), ('a.id', 'id')], False),
+    'highest_rated': ([('a.avg_rating', 'avg_rating'), ('a.downloads', 'downloads'), ('a.id', 'id')], True),
+    'most_downloaded': ([('a.downloads', 'downloads'), ('a.id', 'id')], True),
+    'relevance': ([(RANK_EXPRESSION, 'rank'), ('a.id', 'id')], False),  # bm25: lower is better
+}
+
 @main_bp.route('/adventures')
 def adventures():
     log_statistic('page_views')
     tag_id = request.args.get('tag', type=int)
     search = request.args.get('search', '')
-    sort = request.args.get('sort', 'newest')
+    match_query = build_match_query(search)
+    sort = request.args.get('sort', 'relevance' if match_query else 'newest')
+    if sort not in CATALOG_SORTS or (sort == 'relevance' and not match_query):
+        sort = 'newest'
+    sort_keys, descending = CATALOG_SORTS[sort]
+    page_size = current_app.config['CATALOG_PAGE_SIZE']
+
+    # ?after=<cursor> pages forward, ?before=<cursor> pages back
+    cursor = decode_cursor(request.args.get('after'), len(sort_keys))
+    backwards = False
+    if cursor is None:
+        cursor = decode_cursor(request.args.get('before'), len(sort_keys))
+        backwards = cursor is not None
+
+    # Answer revalidations from the catalog version before running any query
+    validators = Validators(['catalog', 'site_settings'])
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
     conn = get_db()
     processed_adventures = []
     tags = []
+    next_cursor = None
+    prev_cursor = None
 
     try:
-        query = '''
-            SELECT a.id, a.name, a.description, u.username as author, a.creation_date, a.file_size, 
-                   a.game_version, a.version_compat, a.downloads, a.thumbnail_filename, COALESCE(AVG(r.rating), 0) as avg_rating,
-                   COUNT(DISTINCT r.id) as rating_count
-            FROM adventures a
-            JOIN users u ON a.author_id = u.id
-            LEFT JOIN ratings r ON a.id = r.adventure_id
-        '''
+        select_fields = '''a.id, a.name, a.description, u.username as author, a.creation_date, a.file_size,
+                   a.game_version, a.version_compat, a.downloads, a.thumbnail_filename, a.avg_rating, a.rating_count'''
         params = []
         where_clauses = ['a.approved = 1']
 
+        if match_query:
+            # Full-text search: match in the FTS index, then join the adventure rows
+            query = f'''
+                SELECT {select_fields}, {SNIPPET_EXPRESSION} as snippet, {RANK_EXPRESSION} as rank
+                FROM adventures_fts
+                JOIN adventures a ON a.id = adventures_fts.rowid
+                JOIN users u ON a.author_id = u.id
+            '''
+            params.extend(SNIPPET_PARAMS)
+            where_clauses.append('adventures_fts MATCH ?')
+            params.append(match_query)
+        else:
+            query = f'''
+                SELECT {select_fields}
+                FROM adventures a
+                JOIN users u ON a.author_id = u.id
+            '''
+
         if tag_id:
             query += ' JOIN adventure_tags at ON a.id = at.adventure_id'
             where_clauses.append('at.tag_id = ?')
             params.append(tag_id)
-        if search:
-            where_clauses.append('(a.name LIKE ? OR a.description LIKE ?)')
-            search_param = f'%{search}%'
-            params.extend([search_param, search_param])
-        if where_clauses:
-            query += ' WHERE ' + ' AND '.join(where_clauses)
-
-        query += ' GROUP BY a.id'
-
-        order_map = {
-            'newest': ' ORDER BY a.creation_date DESC',
-            'oldest': ' ORDER BY a.creation_date ASC',
-            'highest_rated': ' ORDER BY avg_rating DESC',
-            'most_downloaded': ' ORDER BY a.downloads DESC'
-        }
-        query += order_map.get(sort, ' ORDER BY a.creation_date DESC')
-
-        adventures_data = conn.execute(query, params).fetchall()
-        for adv in adventures_data:
-            adv_dict = dict(adv)
-            adv_dict['creation_date'] = parse_datetime(adv_dict['creation_date'])
-            processed_adventures.append(adv_dict)
-
-        tags = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
+
+        keyset_where, order_by = keyset_sql([expr for expr, _ in sort_keys], descending, backwards)
+        if cursor is not None:
+            where_clauses.append(keyset_where)
+            params.extend(cursor)
+
+        query += ' WHERE ' + ' AND '.join(where_clauses) + order_by + ' LIMIT ?'
+        params.append(page_size + 1)  # One extra row tells us whether another page exists
+
+        # A search without any searchable words matches nothing
+        if match_query or not search:
+            adventures_data = conn.execute(query, params).fetchall()
+            has_more = len(adventures_data) > page_size
+            adventures_data = adventures_data[:page_size]
+            if backwards:
+                adventures_data.reverse()
+
+            if adventures_data:
+                first_key = [adventures_data[0][column] for _, column in sort_keys]
+                last_key = [adventures_data[-1][column] for _, column in sort_keys]
+                if backwards:
+                    prev_cursor = encode_cursor(first_key) if has_more else None
+                    next_cursor = encode_cursor(last_key)
+                else:
+                    prev_cursor = encode_cursor(first_key) if cursor is not None else None
+                    next_cursor = encode_cursor(last_key) if has_more else None
+
+            for adv in adventures_data:
+                adv_dict = dict(adv)
+                adv_dict['creation_date'] = parse_datetime(adv_dict['creation_date'])
+                adv_dict['snippet'] = highlight_snippet(adv_dict.get('snippet'))
+                processed_adventures.append(adv_dict)
+
+        tags = get_tag_registry()
 
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error on adventures page: {e}")
         flash("Could not load adventures. Please try again later.", "error")
+        validators = None  # Never let clients revalidate an error page
 
-    return render_template('adventures.html', adventures=processed_adventures, tags=tags,
-                          current_tag=tag_id, search=search, sort=sort)
+    response = make_response(render_template('adventures.html', adventures=processed_adventures, tags=tags,
+                                             current_tag=tag_id, search=search, sort=sort,
+                                             next_cursor=next_cursor, prev_cursor=prev_cursor))
+    return validators.apply(response) if validators else response
 
 
 @main_bp.route('/adventure/<int:adventure_id>')
 def adventure_detail(adventure_id):
     log_statistic('page_views')
+    validators = Validators(['catalog', 'site_settings'])
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
     conn = get_db()
     adventure_dict = None
     tags = []
@@ -143,12 +226,10 @@ def adventure_detail(adventure_id):
         adventure = conn.execute('''
             SELECT a.id, a.name, a.description, u.username as author, a.author_id, 
                    a.creation_date, a.file_path, a.file_size, a.game_version, a.version_compat,
-                   a.downloads, a.thumbnail_filename, COALESCE(AVG(r.rating), 0) as avg_rating, COUNT(DISTINCT r.id) as rating_count
+                   a.downloads, a.thumbnail_filename, a.avg_rating, a.rating_count
             FROM adventures a
             JOIN users u ON a.author_id = u.id
-            LEFT JOIN ratings r ON a.id = r.adventure_id
             WHERE a.id = ? AND a.approved = 1
-            GROUP BY a.id
         ''', (adventure_id,)).fetchone()
 
         if not adventure:
@@ -175,15 +256,15 @@ def adventure_detail(adventure_id):
         flash("Could not load adventure details. Please try again later.", "error")
         return redirect(url_for('main.adventures'))
 
-    return render_template('adventure_detail.html', adventure=adventure_dict, tags=tags,
-                          reviews=processed_reviews, user_rating=user_rating)
+    return validators.apply(make_response(render_template('adventure_detail.html', adventure=adventure_dict, tags=tags,
+                                                          reviews=processed_reviews, user_rating=user_rating)))
 
 
 @main_bp.route('/download/<int:adventure_id>')
 @login_required
 def download_adventure(adventure_id):
     conn = get_db()
-    adventure = conn.execute('SELECT id, name, file_path, approved FROM adventures WHERE id = ?', (adventure_id,)).fetchone()
+    adventure = conn.execute('SELECT id, name, file_path, content_hash, approved FROM adventures WHERE id = ?', (adventure_id,)).fetchone()
 
     if not adventure:
         flash('Adventure not found.', 'error')
@@ -202,40 +283,44 @@ def download_adventure(adventure_id):
             flash('You do not have permission to download this adventure.', 'error')
         return redirect(request.referrer or url_for('main.adventures'))
 
-    # Proceed with download logic
+    if not adventure['file_path']:
+        # Fallback if adventure or file_path was somehow null after initial check
+        flash('Adventure file path is missing.', 'error')
+        return redirect(url_for('main.adventure_detail', adventure_id=adventure_id))
+
+    try:
+        # Packages live in sharded subdirectories of UPLOAD_FOLDER (see storage.package_path)
+        directory = current_app.config['UPLOAD_FOLDER']
+        filename = os.path.relpath(os.path.abspath(adventure['file_path']), os.path.abspath(directory))
+        # Paths outside the folder are legacy rows: serve the file by name from the folder itself
+        if filename.startswith(os.pardir):
+            filename = os.path.basename(adventure['file_path'])
+
+        # Streamed here, or handed to the front-end server (DOWNLOAD_OFFLOAD).
+        # The content hash is the ETag that Range/If-Range requests resume against
+        response = send_package(directory, filename, f"{adventure['name']}.zip", etag=adventure['content_hash'])
+    except RequestedRangeNotSatisfiable:
+        raise  # 416 with the file length, so the client can start over
+    except Exception as e:
+        current_app.logger.error(f"File serving error for {adventure['file_path']}: {e}")
+        flash('Error serving the file.', 'error')
+        return redirect(url_for('main.adventure_detail', adventure_id=adventure_id))
+
     try:
-        if is_approved_public:
-            # Update download count only for publicly approved adventures
+        # Update download count only for publicly approved adventures, and only
+        # once per download: resumed ranges and revalidations are not counted
+        if is_approved_public and is_full_download(response):
             conn.execute('UPDATE adventures SET downloads = downloads + 1 WHERE id = ?', (adventure_id,))
             conn.commit()
             log_statistic('downloads')
 
     except sqlite3.Error as e:
+        response.close()
         current_app.logger.error(f"Database error downloading adventure (ID: {adventure_id}): {e}")
         flash("Could not process download. Please try again later.", "error")
         return redirect(url_for('main.adventure_detail', adventure_id=adventure_id))
 
-    if adventure['file_path']:
-        try:
-            # Construct absolute path from stored relative path
-            # Assuming file_path is stored relative to the UPLOAD_FOLDER config
-            directory = current_app.config['UPLOAD_FOLDER']
-            filename = os.path.basename(adventure['file_path'])
-            # Ensure the constructed path is safe and within the intended directory
-            safe_path = os.path.abspath(os.path.join(directory, filename))
-            if not safe_path.startswith(os.path.abspath(directory)):
-                 raise ValueError("Attempted path traversal")
-
-            return send_from_directory(directory, filename, as_attachment=True,
-                                      download_name=f"{adventure['name']}.zip")
-        except Exception as e:
-            current_app.logger.error(f"File serving error for {adventure['file_path']}: {e}")
-            flash('Error serving the file.', 'error')
-            return redirect(url_for('main.adventure_detail', adventure_id=adventure_id))
-    else:
-        # Fallback if adventure or file_path was somehow null after initial check
-        flash('Adventure file path is missing.', 'error')
-        return redirect(url_for('main.adventure_detail', adventure_id=adventure_id))
+    return response
 
 @main_bp.route('/favicon.ico')
 def favicon():
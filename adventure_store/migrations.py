@@ -0,0 +1,657 @@
+import hashlib
+import sqlite3
+import logging
+from .search import rebuild_search_index
+
+logger = logging.getLogger(__name__)
+
+# Each migration is (version, description, steps). A step is either a SQL
+# statement or a callable taking the connection. Migrations run in order and
+# the schema version is tracked in PRAGMA user_version, so a migration is
+# applied exactly once per database. Never edit a released migration; append
+# a new one instead.
+
+BASE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS adventures (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT NOT NULL,
+        author_id INTEGER NOT NULL,
+        creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_path TEXT NOT NULL,
+        file_size INTEGER NOT NULL,
+        game_version TEXT NOT NULL DEFAULT '1.0.0',
+        version_compat TEXT NOT NULL DEFAULT 'Unknown',
+        approved INTEGER DEFAULT 0,
+        downloads INTEGER DEFAULT 0,
+        thumbnail_filename TEXT,
+        FOREIGN KEY (author_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS adventure_tags (
+        adventure_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        PRIMARY KEY (adventure_id, tag_id),
+        FOREIGN KEY (adventure_id) REFERENCES adventures (id),
+        FOREIGN KEY (tag_id) REFERENCES tags (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS ratings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        adventure_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (adventure_id) REFERENCES adventures (id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        UNIQUE(adventure_id, user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        adventure_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (adventure_id) REFERENCES adventures (id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        type TEXT NOT NULL,
+        related_id INTEGER,
+        is_read INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS site_settings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        setting_name TEXT UNIQUE NOT NULL,
+        setting_value TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS statistics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stat_name TEXT NOT NULL,
+        stat_value INTEGER NOT NULL,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT UNIQUE NOT NULL,
+        name TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS api_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        api_key_name TEXT,
+        ip_address TEXT,
+        endpoint TEXT NOT NULL,
+        status_code INTEGER NOT NULL,
+        success BOOLEAN NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+]
+
+
+def _add_column_if_missing(conn, table, column, definition):
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        logger.info(f"Schema migration: Added column '{column}' to '{table}' table.")
+
+
+def _add_adventure_metadata_columns(conn):
+    # Older databases were created before these columns existed
+    _add_column_if_missing(conn, 'adventures', 'game_version', "TEXT NOT NULL DEFAULT '1.0.0'")
+    _add_column_if_missing(conn, 'adventures', 'version_compat', "TEXT NOT NULL DEFAULT 'Unknown'")
+    _add_column_if_missing(conn, 'adventures', 'thumbnail_filename', 'TEXT')
+
+
+HOT_QUERY_INDEXES = [
+    # Public listings: approved = 1 ORDER BY creation_date
+    'CREATE INDEX IF NOT EXISTS idx_adventures_approved_created ON adventures (approved, creation_date)',
+    # My adventures: author_id = ? ORDER BY creation_date
+    'CREATE INDEX IF NOT EXISTS idx_adventures_author_created ON adventures (author_id, creation_date)',
+    # Case-insensitive title checks: LOWER(name) = LOWER(?) AND approved ...
+    'CREATE INDEX IF NOT EXISTS idx_adventures_lower_name ON adventures (LOWER(name), approved)',
+    # Moderation version checks / supersede: name = ? AND author_id = ? AND approved = 1
+    'CREATE INDEX IF NOT EXISTS idx_adventures_name_author ON adventures (name, author_id, approved)',
+    # Rating aggregates per adventure (covering, no table lookup for AVG)
+    'CREATE INDEX IF NOT EXISTS idx_ratings_adventure ON ratings (adventure_id, rating)',
+    # Tag filter: tag_id = ? -> adventure ids
+    'CREATE INDEX IF NOT EXISTS idx_adventure_tags_tag ON adventure_tags (tag_id, adventure_id)',
+    'CREATE INDEX IF NOT EXISTS idx_reviews_adventure_created ON reviews (adventure_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications (user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_related ON notifications (related_id)',
+    'CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)',
+    # stat_name = ? AND date(date) = ? (covering, includes the summed value)
+    'CREATE INDEX IF NOT EXISTS idx_statistics_name_day ON statistics (stat_name, date(date), stat_value)',
+    # date(timestamp) >= ? for the 30 day API usage chart
+    'CREATE INDEX IF NOT EXISTS idx_api_logs_day ON api_logs (date(timestamp))',
+]
+
+
+def _add_rating_aggregate_columns(conn):
+    _add_column_if_missing(conn, 'adventures', 'rating_sum', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column_if_missing(conn, 'adventures', 'rating_count', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column_if_missing(conn, 'adventures', 'avg_rating', 'REAL NOT NULL DEFAULT 0')
+
+
+# Keep adventures.rating_sum/rating_count/avg_rating in step with ratings.
+# Expressions in an UPDATE's SET clause see the row's pre-update values.
+RATING_AGGREGATE_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_ratings_after_insert AFTER INSERT ON ratings
+    BEGIN
+        UPDATE adventures
+        SET rating_sum = rating_sum + NEW.rating,
+            rating_count = rating_count + 1,
+            avg_rating = CAST(rating_sum + NEW.rating AS REAL) / (rating_count + 1)
+        WHERE id = NEW.adventure_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_ratings_after_delete AFTER DELETE ON ratings
+    BEGIN
+        UPDATE adventures
+        SET rating_sum = rating_sum - OLD.rating,
+            rating_count = rating_count - 1,
+            avg_rating = CASE WHEN rating_count > 1
+                              THEN CAST(rating_sum - OLD.rating AS REAL) / (rating_count - 1)
+                              ELSE 0 END
+        WHERE id = OLD.adventure_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_ratings_after_update AFTER UPDATE OF rating, adventure_id ON ratings
+    BEGIN
+        UPDATE adventures
+        SET rating_sum = rating_sum - OLD.rating,
+            rating_count = rating_count - 1,
+            avg_rating = CASE WHEN rating_count > 1
+                              THEN CAST(rating_sum - OLD.rating AS REAL) / (rating_count - 1)
+                              ELSE 0 END
+        WHERE id = OLD.adventure_id;
+        UPDATE adventures
+        SET rating_sum = rating_sum + NEW.rating,
+            rating_count = rating_count + 1,
+            avg_rating = CAST(rating_sum + NEW.rating AS REAL) / (rating_count + 1)
+        WHERE id = NEW.adventure_id;
+    END
+    ''',
+]
+
+
+def recompute_rating_aggregates(conn):
+    """Rebuild the cached rating columns on adventures from the ratings table.
+
+    Only rows whose cached values disagree with ratings are written.
+    Returns the number of adventures that were repaired.
+    """
+    cursor = conn.execute('''
+        UPDATE adventures
+        SET rating_sum = (SELECT COALESCE(SUM(r.rating), 0) FROM ratings r WHERE r.adventure_id = adventures.id),
+            rating_count = (SELECT COUNT(*) FROM ratings r WHERE r.adventure_id = adventures.id),
+            avg_rating = (SELECT COALESCE(AVG(r.rating), 0) FROM ratings r WHERE r.adventure_id = adventures.id)
+        WHERE rating_sum != (SELECT COALESCE(SUM(r.rating), 0) FROM ratings r WHERE r.adventure_id = adventures.id)
+           OR rating_count != (SELECT COUNT(*) FROM ratings r WHERE r.adventure_id = adventures.id)
+    ''')
+    return cursor.rowcount
+
+
+# adventures_fts mirrors name/description of every adventure plus its tag
+# names (rowid = adventures.id). Approval is filtered by joining adventures.
+_FTS_TAG_NAMES = '''COALESCE((SELECT group_concat(t.name, ' ')
+                               FROM adventure_tags at JOIN tags t ON t.id = at.tag_id
+                               WHERE at.adventure_id = {}), '')'''
+
+SEARCH_INDEX = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS adventures_fts USING fts5(
+        name, description, tags,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_fts_insert AFTER INSERT ON adventures
+    BEGIN
+        INSERT INTO adventures_fts (rowid, name, description, tags)
+        VALUES (NEW.id, NEW.name, NEW.description, '');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_fts_update AFTER UPDATE OF name, description ON adventures
+    BEGIN
+        UPDATE adventures_fts SET name = NEW.name, description = NEW.description WHERE rowid = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_fts_delete AFTER DELETE ON adventures
+    BEGIN
+        DELETE FROM adventures_fts WHERE rowid = OLD.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_adventure_tags_fts_insert AFTER INSERT ON adventure_tags
+    BEGIN
+        UPDATE adventures_fts SET tags = {_FTS_TAG_NAMES.format('NEW.adventure_id')}
+        WHERE rowid = NEW.adventure_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_adventure_tags_fts_delete AFTER DELETE ON adventure_tags
+    BEGIN
+        UPDATE adventures_fts SET tags = {_FTS_TAG_NAMES.format('OLD.adventure_id')}
+        WHERE rowid = OLD.adventure_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tags_fts_rename AFTER UPDATE OF name ON tags
+    BEGIN
+        UPDATE adventures_fts SET tags = {_FTS_TAG_NAMES.format('adventures_fts.rowid')}
+        WHERE rowid IN (SELECT adventure_id FROM adventure_tags WHERE tag_id = NEW.id);
+    END
+    ''',
+    rebuild_search_index,
+]
+
+
+# One row per stat per day, incremented with INSERT ... ON CONFLICT DO UPDATE.
+# Replaces the timestamped statistics table that every reader had to wrap in
+# date(); existing rows are folded into their day.
+DAILY_STATISTICS = [
+    '''
+    CREATE TABLE IF NOT EXISTS daily_statistics (
+        stat_name TEXT NOT NULL,
+        day TEXT NOT NULL, -- YYYY-MM-DD
+        stat_value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (stat_name, day)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    INSERT INTO daily_statistics (stat_name, day, stat_value)
+    SELECT stat_name, date(date) AS day, SUM(stat_value)
+    FROM statistics
+    WHERE date(date) IS NOT NULL
+    GROUP BY stat_name, day
+    ''',
+    'DROP INDEX IF EXISTS idx_statistics_name_day',
+    'DROP TABLE IF EXISTS statistics',
+]
+
+
+# Per-day, per-key, per-status request counts for the admin API usage chart.
+# ApiLogWriter keeps it current as it writes api_logs, so raw rows older than
+# API_LOG_RETENTION_DAYS can be pruned without losing the history. NULL key
+# names (unknown or invalid keys) are stored as ''.
+def rebuild_api_log_rollup(conn):
+    """Recompute api_log_daily for every day still present in api_logs.
+
+    Days whose raw rows were already pruned keep their rollup rows.
+    """
+    conn.execute('''
+        DELETE FROM api_log_daily
+        WHERE day IN (SELECT DISTINCT date(timestamp) FROM api_logs)
+    ''')
+    conn.execute('''
+        INSERT INTO api_log_daily (day, api_key_name, status_code, success, request_count)
+        SELECT date(timestamp), COALESCE(api_key_name, ''), status_code, success, COUNT(*)
+        FROM api_logs
+        WHERE date(timestamp) IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+API_LOG_ROLLUP = [
+    '''
+    CREATE TABLE IF NOT EXISTS api_log_daily (
+        day TEXT NOT NULL, -- YYYY-MM-DD (UTC, like api_logs.timestamp)
+        api_key_name TEXT NOT NULL DEFAULT '',
+        status_code INTEGER NOT NULL,
+        success INTEGER NOT NULL,
+        request_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, api_key_name, status_code, success)
+    ) WITHOUT ROWID
+    ''',
+    rebuild_api_log_rollup,
+]
+
+
+# Cache version stamps. Every cached table gets triggers that bump its row
+# here on any write, so each worker process can tell whether its in-memory
+# copy is stale with one small primary-key read instead of reloading.
+def version_bump_triggers(table, stamp):
+    """Triggers bumping cache_versions row ``stamp`` on every write to ``table``."""
+    statements = [f"INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('{stamp}', 0)"]
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        statements.append(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_bump_{stamp} AFTER {event} ON {table}
+    BEGIN
+        UPDATE cache_versions SET version = version + 1 WHERE name = '{stamp}';
+    END
+    ''')
+    return statements
+
+CACHE_VERSIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    *version_bump_triggers('site_settings', 'site_settings'),
+]
+
+
+# Counters the navbar needs on every render, kept exact by triggers so no
+# path that adds, approves or deletes an adventure has to remember them.
+# Only adventures with approved = 0 count as pending, as before.
+def recompute_site_counters(conn):
+    """Recompute site_counters from the tables. Returns the pending count."""
+    pending = conn.execute('SELECT COUNT(*) FROM adventures WHERE approved = 0').fetchone()[0]
+    conn.execute('''
+        INSERT INTO site_counters (name, value) VALUES ('pending_adventures', ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value WHERE value != excluded.value
+    ''', (pending,))
+    return pending
+
+SITE_COUNTERS = [
+    '''
+    CREATE TABLE IF NOT EXISTS site_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    recompute_site_counters,
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_pending_insert AFTER INSERT ON adventures
+    WHEN NEW.approved = 0
+    BEGIN
+        UPDATE site_counters SET value = value + 1 WHERE name = 'pending_adventures';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_pending_update AFTER UPDATE OF approved ON adventures
+    WHEN (OLD.approved = 0) IS NOT (NEW.approved = 0)
+    BEGIN
+        UPDATE site_counters
+        SET value = value + (NEW.approved IS 0) - (OLD.approved IS 0)
+        WHERE name = 'pending_adventures';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_pending_delete AFTER DELETE ON adventures
+    WHEN OLD.approved = 0
+    BEGIN
+        UPDATE site_counters SET value = value - 1 WHERE name = 'pending_adventures';
+    END
+    ''',
+    *version_bump_triggers('site_counters', 'site_counters'),
+    # Sessions cache the user's role; this stamp tells them when to re-read it
+    "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('user_roles', 0)",
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_role_bump_user_roles AFTER UPDATE OF role ON users
+    WHEN OLD.role IS NOT NEW.role
+    BEGIN
+        UPDATE cache_versions SET version = version + 1 WHERE name = 'user_roles';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_delete_bump_user_roles AFTER DELETE ON users
+    BEGIN
+        UPDATE cache_versions SET version = version + 1 WHERE name = 'user_roles';
+    END
+    ''',
+]
+
+
+# Data versions for HTTP validators (ETag / Last-Modified). 'catalog' moves on
+# any change to what the public catalog and detail pages show, 'tags' on any
+# change to the tag list. updated_at records when a stamp last moved.
+def _add_cache_version_timestamps(conn):
+    _add_column_if_missing(conn, 'cache_versions', 'updated_at', 'TIMESTAMP')
+    conn.execute('UPDATE cache_versions SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL')
+
+HTTP_VALIDATOR_STAMPS = [
+    _add_cache_version_timestamps,
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_cache_versions_touch AFTER UPDATE OF version ON cache_versions
+    BEGIN
+        UPDATE cache_versions SET updated_at = CURRENT_TIMESTAMP WHERE name = NEW.name;
+    END
+    ''',
+    *version_bump_triggers('adventures', 'catalog'),
+    *version_bump_triggers('adventure_tags', 'catalog'),
+    *version_bump_triggers('tags', 'catalog'),
+    *version_bump_triggers('ratings', 'catalog'),
+    *version_bump_triggers('reviews', 'catalog'),
+    *version_bump_triggers('tags', 'tags'),
+    "UPDATE cache_versions SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL",
+]
+
+
+# API keys are looked up by their SHA-256 digest (see utils.hash_api_key). The
+# plaintext column stays because the admin page shows and copies keys.
+def _add_api_key_hashes(conn):
+    _add_column_if_missing(conn, 'api_keys', 'key_hash', 'TEXT')
+    rows = conn.execute('SELECT id, key FROM api_keys WHERE key_hash IS NULL').fetchall()
+    conn.executemany('UPDATE api_keys SET key_hash = ? WHERE id = ?',
+                     [(hashlib.sha256(row[1].encode()).hexdigest(), row[0]) for row in rows])
+
+API_KEY_HASHES = [
+    _add_api_key_hashes,
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_api_keys_key_hash ON api_keys (key_hash)',
+    *version_bump_triggers('api_keys', 'api_keys'),
+]
+
+
+# Content-addressed package storage (see storage.py). packages holds one row
+# per distinct file; ref_count is the number of adventures whose content_hash
+# points at it and is kept exact by the triggers below. Existing flat files
+# are moved into the sharded layout by `flask migrate-storage`.
+def _add_adventure_content_hash(conn):
+    _add_column_if_missing(conn, 'adventures', 'content_hash', 'TEXT')
+
+PACKAGE_STORAGE = [
+    '''
+    CREATE TABLE IF NOT EXISTS packages (
+        content_hash TEXT PRIMARY KEY,
+        file_path TEXT NOT NULL,
+        file_size INTEGER,
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    ''',
+    _add_adventure_content_hash,
+    'CREATE INDEX IF NOT EXISTS idx_adventures_content_hash ON adventures (content_hash)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_insert_package_ref AFTER INSERT ON adventures
+    WHEN NEW.content_hash IS NOT NULL
+    BEGIN
+        UPDATE packages SET ref_count = ref_count + 1 WHERE content_hash = NEW.content_hash;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_delete_package_ref AFTER DELETE ON adventures
+    WHEN OLD.content_hash IS NOT NULL
+    BEGIN
+        UPDATE packages SET ref_count = ref_count - 1 WHERE content_hash = OLD.content_hash;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_adventures_update_package_ref AFTER UPDATE OF content_hash ON adventures
+    WHEN OLD.content_hash IS NOT NEW.content_hash
+    BEGIN
+        UPDATE packages SET ref_count = ref_count - 1 WHERE content_hash = OLD.content_hash;
+        UPDATE packages SET ref_count = ref_count + 1 WHERE content_hash = NEW.content_hash;
+    END
+    ''',
+]
+
+
+# Background job queue (see jobs.py). Workers claim the oldest due 'queued'
+# row, or a 'running' row whose lock has expired, with a single UPDATE.
+JOB_QUEUE = [
+    '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL DEFAULT '{}',
+        user_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        locked_until TIMESTAMP,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)',
+]
+
+
+# Resumable API uploads (see upload_sessions.py). Each session owns one
+# preallocated file; upload_chunks records the byte ranges received intact.
+UPLOAD_SESSIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        file_name TEXT,
+        file_size INTEGER NOT NULL,
+        sha256 TEXT,
+        path TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_upload_sessions_user ON upload_sessions (user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at ON upload_sessions (updated_at)',
+    '''
+    CREATE TABLE IF NOT EXISTS upload_chunks (
+        upload_id TEXT NOT NULL,
+        byte_offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (upload_id, byte_offset),
+        FOREIGN KEY (upload_id) REFERENCES upload_sessions (id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+MIGRATIONS = [
+    (1, 'Base schema', BASE_SCHEMA),
+    (2, 'Adventure game_version, version_compat and thumbnail_filename columns', [_add_adventure_metadata_columns]),
+    (3, 'Indexes for hot queries', HOT_QUERY_INDEXES),
+    (4, 'Trigger-maintained rating aggregates on adventures', [
+        _add_rating_aggregate_columns,
+        *RATING_AGGREGATE_TRIGGERS,
+        recompute_rating_aggregates,
+        # Featured / highest_rated listings: approved = 1 ORDER BY avg_rating DESC, downloads DESC
+        'CREATE INDEX IF NOT EXISTS idx_adventures_approved_rating ON adventures (approved, avg_rating, downloads)',
+    ]),
+    (5, 'FTS5 search index over adventure name, description and tags', SEARCH_INDEX),
+    (6, 'Index for the most_downloaded catalog sort', [
+        'CREATE INDEX IF NOT EXISTS idx_adventures_approved_downloads ON adventures (approved, downloads)',
+    ]),
+    (7, 'Daily statistics buckets keyed on (stat_name, day)', DAILY_STATISTICS),
+    (8, 'Daily API usage rollup', API_LOG_ROLLUP),
+    (9, 'Cache version stamps, starting with site_settings', CACHE_VERSIONS),
+    (10, 'Trigger-maintained pending moderation counter and user role stamp', SITE_COUNTERS),
+    (11, 'Catalog and tag version stamps with last-change times', HTTP_VALIDATOR_STAMPS),
+    (12, 'API key lookup by hash', API_KEY_HASHES),
+    (13, 'Content-addressed package storage with reference counts', PACKAGE_STORAGE),
+    (14, 'Background job queue', JOB_QUEUE),
+    (15, 'Resumable upload sessions', UPLOAD_SESSIONS),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def run_migrations(conn):
+    """Bring the database schema up to LATEST_VERSION.
+
+    Each migration runs in its own IMMEDIATE transaction together with the
+    user_version bump, so a failed migration leaves the previous version in
+    place and concurrent workers starting at the same time apply it once.
+
+    Returns the schema version after running.
+    """
+    current = get_schema_version(conn)
+    if current >= LATEST_VERSION:
+        return current  # Up to date: a single PRAGMA read
+
+    if conn.in_transaction:
+        conn.commit()
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated while we waited for the lock
+            current = get_schema_version(conn)
+            if version <= current:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            logger.error(f"Schema migration {version} ({description}) failed.", exc_info=True)
+            raise
+        current = version
+        logger.info(f"Schema migration {version} applied: {description}")
+
+    return current
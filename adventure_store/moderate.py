@@ -2,9 +2,11 @@ from flask import (
     Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 )
 from .db import get_db
+from .main import invalidate_home_cache
 from .utils import parse_datetime
 from packaging.version import parse as parse_version
 from .decorators import moderator_required
+from .storage import release_packages, unlink_files
 import os
 import sqlite3
 
@@ -77,7 +79,7 @@ def moderate_adventure(adventure_id):
     try:
         conn.execute('BEGIN TRANSACTION') # Explicitly start a transaction
         newly_approved_adventure = conn.execute(
-            'SELECT id, name, author_id, file_path, game_version, version_compat, thumbnail_filename FROM adventures WHERE id = ? AND approved = 0', 
+            'SELECT id, name, author_id, file_path, content_hash, game_version, version_compat, thumbnail_filename FROM adventures WHERE id = ? AND approved = 0', 
             (adventure_id,)
         ).fetchone()
 
@@ -86,6 +88,7 @@ def moderate_adventure(adventure_id):
             conn.rollback()
             return redirect(url_for('moderate.moderate_list'))
 
+        released = []  # Package files to unlink once the transaction is committed
         if action == 'approve':
             # 1. Set the new adventure to approved = 1
             conn.execute('UPDATE adventures SET approved = 1 WHERE id = ?', (newly_approved_adventure['id'],))
@@ -115,25 +118,29 @@ def moderate_adventure(adventure_id):
                 (newly_approved_adventure['author_id'], f"Your adventure '{newly_approved_adventure['name']}' has been rejected", 'rejection', None)
             )
 
-            # Delete the file
+            # The package file is shared by identical uploads: drop it only with its last reference
+            if newly_approved_adventure['content_hash']:
+                released = release_packages(conn, [newly_approved_adventure['content_hash']])
+            elif newly_approved_adventure['file_path']:
+                released = [newly_approved_adventure['file_path']]  # Not yet migrated to content storage
+
+            # Delete thumbnail
             try:
-                if newly_approved_adventure['file_path'] and os.path.exists(newly_approved_adventure['file_path']):
-                    # Delete adventure zip
-                    os.remove(newly_approved_adventure['file_path'])
-                    current_app.logger.info(f"Deleted rejected adventure file: {newly_approved_adventure['file_path']}")
-                    # Delete thumbnail
-                    if newly_approved_adventure['thumbnail_filename']:
-                        thumb_path = os.path.join(current_app.config['THUMBNAIL_FOLDER'], newly_approved_adventure['thumbnail_filename'])
-                        if os.path.exists(thumb_path):
-                            os.remove(thumb_path)
-                            current_app.logger.info(f"Deleted thumbnail for rejected adventure: {thumb_path}")
+                if newly_approved_adventure['thumbnail_filename']:
+                    thumb_path = os.path.join(current_app.config['THUMBNAIL_FOLDER'], newly_approved_adventure['thumbnail_filename'])
+                    if os.path.exists(thumb_path):
+                        os.remove(thumb_path)
+                        current_app.logger.info(f"Deleted thumbnail for rejected adventure: {thumb_path}")
             except OSError as e:
-                current_app.logger.error(f"Error deleting rejected file {newly_approved_adventure['file_path']}: {e}")
+                current_app.logger.error(f"Error deleting thumbnail for rejected adventure {adventure_id}: {e}")
                 flash('Adventure rejected, but failed to delete the associated file(s).', 'warning') # Non-critical error
 
             flash('Adventure rejected and deleted.', 'success')
 
         conn.commit()
+        if unlink_files(conn, released):
+            flash('Adventure rejected, but failed to delete the associated file(s).', 'warning') # Non-critical error
+        invalidate_home_cache()
 
     except sqlite3.Error as e:
         conn.rollback() # Rollback changes on DB error
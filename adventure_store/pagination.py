@@ -0,0 +1,46 @@
+import base64
+import binascii
+import json
+
+# Keyset (cursor) pagination helpers. A cursor holds the sort key values and
+# id of the row a page starts after (or ends before), so every page is a
+# single index range scan of page_size + 1 rows, however deep it is.
+
+def encode_cursor(values):
+    """Encode a row's sort key values (ending with its id) as an opaque URL-safe token.
+
+    Timestamps read back as datetime objects are stored as str(), which is
+    the same text SQLite holds, so they compare correctly in the next query.
+    """
+    raw = json.dumps(list(values), separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, length):
+    """Decode a token from encode_cursor. Returns None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    if not all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in values):
+        return None
+    return values
+
+def keyset_sql(columns, descending, backwards=False):
+    """Build the keyset WHERE fragment and ORDER BY clause for a sort.
+
+    ``columns`` are the sort expressions, the last one being a unique
+    tie-breaker (the id). Walking backwards flips both the comparison and the
+    ordering; the caller reverses the fetched rows to restore display order.
+    """
+    walk_descending = descending != backwards
+    comparison = '<' if walk_descending else '>'
+    direction = 'DESC' if walk_descending else 'ASC'
+    placeholders = ', '.join('?' * len(columns))
+    where = f"({', '.join(columns)}) {comparison} ({placeholders})"
+    order_by = ' ORDER BY ' + ', '.join(f'{column} {direction}' for column in columns)
+    return where, order_by
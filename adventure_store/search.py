@@ -0,0 +1,50 @@
+import re
+from markupsafe import Markup, escape
+
+# Full-text search over adventures, backed by the adventures_fts FTS5 table.
+# The index is kept in sync by triggers on adventures, adventure_tags and tags
+# (see migrations.py), so every write path updates it automatically.
+
+# Relative bm25 weights of the indexed columns: name, description, tags
+BM25_WEIGHTS = (10.0, 1.0, 5.0)
+RANK_EXPRESSION = 'bm25(adventures_fts, {}, {}, {})'.format(*BM25_WEIGHTS)
+
+# Private-use characters mark the matched terms in snippets. They do not occur
+# in normal text, so the snippet can be HTML-escaped before highlighting.
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_END = '\ue001'
+SNIPPET_EXPRESSION = "snippet(adventures_fts, -1, ?, ?, '…', 24)"
+SNIPPET_PARAMS = (HIGHLIGHT_START, HIGHLIGHT_END)
+
+MAX_TERMS = 8
+
+def build_match_query(text):
+    """Turn text from the search box into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term and all terms must match, so
+    "drag cast" finds "Dragon Castle". FTS5 operators in the input are
+    treated as plain text. Returns None if the text has no searchable words.
+    """
+    terms = re.findall(r'\w+', text or '')[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def highlight_snippet(snippet):
+    """Escape a snippet from SNIPPET_EXPRESSION and wrap matches in <mark>."""
+    if not snippet:
+        return None
+    escaped = str(escape(snippet))
+    return Markup(escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+def rebuild_search_index(conn):
+    """Repopulate adventures_fts from the adventures, tags and adventure_tags tables."""
+    conn.execute('DELETE FROM adventures_fts')
+    conn.execute('''
+        INSERT INTO adventures_fts (rowid, name, description, tags)
+        SELECT a.id, a.name, a.description,
+               COALESCE((SELECT group_concat(t.name, ' ')
+                         FROM adventure_tags at JOIN tags t ON t.id = at.tag_id
+                         WHERE at.adventure_id = a.id), '')
+        FROM adventures a
+    ''')
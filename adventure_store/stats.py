@@ -0,0 +1,154 @@
+import atexit
+import datetime
+import logging
+import sqlite3
+import threading
+from flask import current_app, g, has_app_context
+from .db import get_pool
+
+logger = logging.getLogger(__name__)
+
+
+class StatsBuffer:
+    """Process-local aggregator for the daily statistics counters.
+
+    Increments are coalesced in memory per (stat_name, day) and written to
+    daily_statistics as one UPSERT batch by a background thread, either every
+    ``flush_interval`` seconds or as soon as ``flush_threshold`` increments
+    are waiting. Remaining deltas are flushed at interpreter shutdown. With
+    ``flush_interval`` <= 0 every increment is written straight away, or at
+    the end of the app context when that holds a connection already.
+    """
+
+    def __init__(self, pool, flush_interval=5.0, flush_threshold=1000):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = {}  # (stat_name, 'YYYY-MM-DD') -> delta
+        self._pending_increments = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One writer at a time
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def increment(self, stat_name, value=1, day=None):
+        """Add ``value`` to today's (or ``day``'s) counter for ``stat_name``."""
+        day = day or datetime.date.today().isoformat()
+        with self._lock:
+            key = (stat_name, day)
+            self._pending[key] = self._pending.get(key, 0) + value
+            self._pending_increments += 1
+            threshold_reached = self._pending_increments >= self.flush_threshold
+
+        if self.flush_interval <= 0:
+            if has_app_context() and 'db' in g:
+                # Written at teardown on the context's own connection
+                # (flush_after_request), not on a second pooled one
+                return
+            self.flush()
+            return
+        self._ensure_started()
+        if threshold_reached:
+            self._wakeup.set()
+
+    def pending(self, day=None):
+        """Return a copy of the unflushed deltas, optionally for one day only.
+
+        Keys are (stat_name, day) tuples; add these to what the database
+        holds to get up-to-the-moment totals.
+        """
+        with self._lock:
+            return {key: delta for key, delta in self._pending.items()
+                    if day is None or key[1] == day}
+
+    def flush(self, conn=None):
+        """Write all pending deltas in one transaction. Returns the number of counters written.
+
+        Uses ``conn`` if given (it must have no transaction open), otherwise
+        a pooled connection. On failure the deltas go back into the buffer
+        for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._pending_increments = 0
+            if not batch:
+                return 0
+
+            pooled = None
+            try:
+                if conn is None:
+                    conn = pooled = self.pool.acquire()
+                conn.executemany(
+                    '''INSERT INTO daily_statistics (stat_name, day, stat_value) VALUES (?, ?, ?)
+                       ON CONFLICT (stat_name, day) DO UPDATE SET stat_value = stat_value + excluded.stat_value''',
+                    [(stat_name, day, delta) for (stat_name, day), delta in batch.items()]
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Database error flushing {len(batch)} statistics counters: {e}")
+                if conn is not None and conn.in_transaction:
+                    conn.rollback()
+                # Put the deltas back so they are retried on the next flush
+                with self._lock:
+                    for key, delta in batch.items():
+                        self._pending[key] = self._pending.get(key, 0) + delta
+                        self._pending_increments += 1
+                return 0
+            finally:
+                if pooled is not None:
+                    self.pool.release(pooled)
+            return len(batch)
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stats-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Keep the thread alive: nothing else would flush the buffer
+                logger.error('Unexpected error flushing statistics counters.', exc_info=True)
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+
+def get_stats_buffer():
+    return current_app.extensions['stats_buffer']
+
+def flush_after_request(e=None):
+    """With STATS_FLUSH_INTERVAL <= 0, write the context's increments on its own connection."""
+    buffer = get_stats_buffer()
+    if buffer.flush_interval > 0:
+        return
+    conn = g.get('db')  # None if released early: flush() then uses the pool
+    if conn is not None and conn.in_transaction:
+        conn.rollback()  # Left over; the db teardown would roll it back next anyway
+    buffer.flush(conn)
+
+def init_app(app):
+    """Create the statistics buffer for this app and flush it at shutdown."""
+    buffer = StatsBuffer(
+        get_pool(app),
+        flush_interval=app.config['STATS_FLUSH_INTERVAL'],
+        flush_threshold=app.config['STATS_FLUSH_THRESHOLD']
+    )
+    app.extensions['stats_buffer'] = buffer
+    # Registered after db.init_app, so it runs before the connection is released
+    app.teardown_appcontext(flush_after_request)
+    atexit.register(buffer.stop)
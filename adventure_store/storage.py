@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import get_db
+from .uploads import UploadStream, save_upload, CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Adventure packages are stored once per distinct content, at
+# UPLOAD_FOLDER/<h[:2]>/<h[2:4]>/<sha256>.zip. The packages table maps each
+# hash to its file and counts the adventures pointing at it (triggers on
+# adventures.content_hash keep ref_count exact). A file is unlinked only when
+# its last reference is gone, and always after the deleting transaction has
+# committed.
+#
+# The packages row is the lock on its file. store_file() upserts the row before
+# it looks at the disk, so it holds the database write lock while it decides
+# whether to reuse or write the file, until its transaction ends. Unlinking takes
+# the same lock and only removes files that no row points at, so a release can
+# never delete a file that a concurrent upload has just claimed again.
+
+
+def package_path(content_hash):
+    """Sharded on-disk location of the package with this SHA-256."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], content_hash[:2], content_hash[2:4], f'{content_hash}.zip')
+
+def store_upload(conn, file):
+    """Store an uploaded FileStorage by content. Returns (file_path, file_size, content_hash).
+
+    If a package with the same hash is already on disk, the upload is not
+    written again and its path is returned. Otherwise the streamed temp file
+    is renamed into place. Either way the packages row is registered in the
+    current (uncommitted) transaction; it gains its reference when the
+    adventure row pointing at it is inserted.
+    """
+    stream = file.stream
+    streamed = isinstance(stream, UploadStream)
+    if streamed:
+        file_size, content_hash = stream.size, stream.sha256.hexdigest()
+        stream.flush()
+        stream.close()
+        temp_path = stream.path
+    else:
+        fd, temp_path = tempfile.mkstemp(prefix='.upload-', suffix='.part', dir=current_app.config['UPLOAD_FOLDER'])
+        os.close(fd)
+        file_size, content_hash = save_upload(file, temp_path)
+    try:
+        stored = store_file(conn, temp_path, file_size, content_hash)
+    except Exception:
+        if not streamed:
+            _remove_temp(temp_path)  # An UploadStream removes its own file when the request closes
+        raise
+    if streamed:
+        stream.committed = True  # store_file() has taken the file over
+    return stored
+
+def store_file(conn, temp_path, file_size, content_hash):
+    """Move the finished file at ``temp_path`` into content storage, as store_upload() does.
+
+    ``temp_path`` must be inside UPLOAD_FOLDER; it is renamed into place, or
+    removed if the package is stored already.
+    """
+    # Claim the row first: the upsert takes the write lock, so the file cannot
+    # be released and unlinked between the check below and our commit
+    stored_path = conn.execute('''
+        INSERT INTO packages (content_hash, file_path, file_size) VALUES (?, ?, ?)
+        ON CONFLICT (content_hash) DO UPDATE SET file_path = packages.file_path
+        RETURNING file_path
+    ''', (content_hash, package_path(content_hash), file_size)).fetchone()['file_path']
+    if os.path.exists(stored_path):
+        # Identical package already stored: skip the write entirely
+        os.remove(temp_path)
+        return stored_path, file_size, content_hash
+
+    # New package, or its file has gone missing: put this copy in place
+    file_path = package_path(content_hash)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    os.replace(temp_path, file_path)
+    if file_path != stored_path:
+        conn.execute('UPDATE packages SET file_path = ? WHERE content_hash = ?', (file_path, content_hash))
+    return file_path, file_size, content_hash
+
+def release_packages(conn, content_hashes):
+    """Drop packages rows that no adventure references any more.
+
+    Call inside the transaction that removed the references. Returns the
+    file paths to pass to unlink_files() once that transaction has committed.
+    """
+    paths = []
+    for content_hash in set(filter(None, content_hashes)):
+        row = conn.execute(
+            'DELETE FROM packages WHERE content_hash = ? AND ref_count <= 0 RETURNING file_path', (content_hash,)
+        ).fetchone()
+        if row:
+            paths.append(row['file_path'])
+    return paths
+
+def add_package_ref(conn, content_hash):
+    """Count a reference held by something other than an adventure row, such as a queued job."""
+    conn.execute('UPDATE packages SET ref_count = ref_count + 1 WHERE content_hash = ?', (content_hash,))
+
+def drop_package_ref(conn, content_hash):
+    """Undo add_package_ref(). Returns the paths to unlink after commit, as release_packages() does."""
+    conn.execute('UPDATE packages SET ref_count = ref_count - 1 WHERE content_hash = ?', (content_hash,))
+    return release_packages(conn, [content_hash])
+
+def _remove_temp(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _prune_empty_dirs(path):
+    """Remove the shard directories above ``path`` that are now empty, up to UPLOAD_FOLDER.
+
+    Only call under the write lock: store_file() creates them while it holds it.
+    """
+    root = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    directory = os.path.dirname(os.path.abspath(path))
+    while directory != root and directory.startswith(root + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return  # Not empty (or already gone)
+        directory = os.path.dirname(directory)
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+        current_app.logger.info(f"Deleted unreferenced package file: {path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        current_app.logger.error(f"Error deleting package file {path}: {e}")
+        return False
+    _prune_empty_dirs(path)
+    return True
+
+def unlink_files(conn, paths):
+    """Remove files released by release_packages(), after that transaction has committed.
+
+    Each file is removed under the write lock and only if no packages row
+    points at it: the same content may have been stored again since it was
+    released. Shard directories left empty are removed too. Returns the
+    paths that could not be removed.
+    """
+    failed = []
+    if not paths:
+        return failed
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for path in paths:
+                if conn.execute('SELECT 1 FROM packages WHERE file_path = ?', (path,)).fetchone():
+                    continue  # Claimed again by a newer upload
+                if not _remove_file(path):
+                    failed.append(path)
+        finally:
+            conn.commit()
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Could not lock packages to delete {len(paths)} file(s): {e}")
+        return list(paths)
+    return failed
+
+def discard_upload(conn, content_hash):
+    """Undo store_upload() after a failed submission.
+
+    Rolls back the open transaction, then removes the package file unless
+    another adventure already uses it.
+    """
+    conn.rollback()
+    if not content_hash:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT ref_count FROM packages WHERE content_hash = ?', (content_hash,)).fetchone()
+        if row is None:
+            # No row, and no other store_file() in progress (it would hold the
+            # write lock): the file there was left by this request's rollback
+            _remove_file(package_path(content_hash))
+            released = []
+        else:
+            released = release_packages(conn, [content_hash])
+    finally:
+        conn.commit()
+    unlink_files(conn, released)
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@click.command('migrate-storage')
+@with_appcontext
+def migrate_storage_command():
+    """Move legacy flat uploads into the content-addressed layout, merging duplicates."""
+    conn = get_db()
+    rows = conn.execute('SELECT id, file_path FROM adventures WHERE content_hash IS NULL').fetchall()
+    moved = merged = missing = 0
+    for row in rows:
+        old_path = row['file_path']
+        if old_path and not os.path.exists(old_path):
+            # Older rows may hold a path relative to another working directory
+            old_path = os.path.join(current_app.config['UPLOAD_FOLDER'], os.path.basename(old_path))
+        if not old_path or not os.path.exists(old_path):
+            missing += 1
+            logger.warning(f"Adventure {row['id']}: file {old_path} not found, left unmigrated.")
+            continue
+        content_hash = hash_file(old_path)
+        existing = conn.execute('SELECT file_path FROM packages WHERE content_hash = ?', (content_hash,)).fetchone()
+        if existing and os.path.exists(existing['file_path']):
+            new_path = existing['file_path']
+            if os.path.abspath(old_path) != os.path.abspath(new_path):
+                os.remove(old_path)
+            merged += 1
+        else:
+            new_path = package_path(content_hash)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.replace(old_path, new_path)
+            conn.execute('''
+                INSERT INTO packages (content_hash, file_path, file_size) VALUES (?, ?, ?)
+                ON CONFLICT (content_hash) DO UPDATE SET file_path = excluded.file_path
+            ''', (content_hash, new_path, os.path.getsize(new_path)))
+            moved += 1
+        # The refcount trigger on adventures.content_hash counts the reference
+        conn.execute('UPDATE adventures SET content_hash = ?, file_path = ? WHERE id = ?', (content_hash, new_path, row['id']))
+        conn.commit()  # Per file, so an interrupted run can simply be repeated
+    click.echo(f'Storage migrated: {moved} file(s) moved, {merged} duplicate(s) merged, {missing} missing.')
+
+def init_app(app):
+    app.cli.add_command(migrate_storage_command)
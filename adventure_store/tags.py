@@ -0,0 +1,46 @@
+import json
+from collections import namedtuple
+from types import MappingProxyType
+from .db import get_db
+from .cache import get_versioned_cache
+
+Tag = namedtuple('Tag', ['id', 'name'])
+
+
+class TagRegistry:
+    """Immutable snapshot of the tags table.
+
+    Built once per change to the tags table (tracked by the 'tags' cache
+    version stamp) and shared by every request: ``tags`` is the list sorted
+    by name as the forms and filters show it, ``by_id`` / ``by_name`` are
+    read-only lookups and ``json`` is the /api/tags body, serialised once.
+    """
+
+    def __init__(self, rows):
+        self.tags = tuple(Tag(row['id'], row['name']) for row in rows)  # Rows come sorted by name
+        self.by_id = MappingProxyType({tag.id: tag.name for tag in self.tags})
+        self.by_name = MappingProxyType({tag.name: tag.id for tag in self.tags})
+        self.json = json.dumps([tag._asdict() for tag in self.tags], separators=(',', ':'))
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def are_valid_ids(self, tag_ids):
+        """True if every id names an existing tag and none is repeated."""
+        return len(set(tag_ids)) == len(tag_ids) and all(tag_id in self.by_id for tag_id in tag_ids)
+
+
+def _load_tag_registry():
+    return TagRegistry(get_db().execute('SELECT id, name FROM tags ORDER BY name').fetchall())
+
+def get_tag_registry():
+    """Return the current TagRegistry, rebuilding it only after tags change."""
+    return get_versioned_cache('tags').get(_load_tag_registry)
+
+def init_app(app):
+    """Load the registry at startup so the first request does not pay for it."""
+    with app.app_context():
+        get_tag_registry()
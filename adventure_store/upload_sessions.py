@@ -0,0 +1,200 @@
+import click
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import time
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import get_db
+from .uploads import CHUNK_SIZE, max_upload_bytes
+
+logger = logging.getLogger(__name__)
+
+# Resumable uploads: a session owns a file preallocated to the full package
+# size under UPLOAD_FOLDER/.upload-sessions. Chunks are written in place at
+# their offset and recorded in upload_chunks only once their SHA-256 matched,
+# so the received ranges are always trustworthy. Sessions untouched for
+# UPLOAD_SESSION_TTL seconds are removed together with their file.
+
+SESSION_DIR = '.upload-sessions'
+
+
+class UploadSessionError(Exception):
+    """A request against an upload session that cannot be honoured."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def merge_ranges(chunks):
+    """Merge (offset, length) pairs into sorted, non-overlapping [start, end) ranges."""
+    ranges = []
+    for offset, length in sorted(chunks):
+        end = offset + length
+        if ranges and offset <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([offset, end])
+    return ranges
+
+def received_ranges(conn, upload_id):
+    rows = conn.execute('SELECT byte_offset, length FROM upload_chunks WHERE upload_id = ?', (upload_id,)).fetchall()
+    return merge_ranges((row['byte_offset'], row['length']) for row in rows)
+
+def _preallocate(path, size):
+    with open(path, 'wb') as f:
+        if size and hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(f.fileno(), 0, size)  # Reserve the blocks now, fail early if the disk is full
+        else:
+            f.truncate(size)
+
+def create_session(conn, user_id, file_size, file_name=None, sha256=None):
+    """Create an upload session and its preallocated file. Returns the session row."""
+    if file_size <= 0:
+        raise UploadSessionError("'size' must be a positive number of bytes.")
+    max_bytes = max_upload_bytes()
+    if file_size > max_bytes:
+        raise UploadSessionError(f"File exceeds the maximum allowed size ({max_bytes // (1024 * 1024)}MB).", 413)
+    open_sessions = conn.execute('SELECT COUNT(*) FROM upload_sessions WHERE user_id = ?', (user_id,)).fetchone()[0]
+    if open_sessions >= current_app.config['UPLOAD_SESSIONS_PER_USER']:
+        raise UploadSessionError('Too many unfinished uploads. Finalize or delete one first.', 429)
+
+    upload_id = secrets.token_hex(16)
+    directory = os.path.join(current_app.config['UPLOAD_FOLDER'], SESSION_DIR)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{upload_id}.part')
+    try:
+        _preallocate(path, file_size)
+    except OSError:
+        _unlink(path)
+        raise
+    conn.execute(
+        'INSERT INTO upload_sessions (id, user_id, file_name, file_size, sha256, path) VALUES (?, ?, ?, ?, ?, ?)',
+        (upload_id, user_id, file_name, file_size, sha256.lower() if sha256 else None, path)
+    )
+    conn.commit()
+    return get_session(conn, upload_id, user_id)
+
+def get_session(conn, upload_id, user_id):
+    """The session row, if it exists and belongs to ``user_id``."""
+    return conn.execute('SELECT * FROM upload_sessions WHERE id = ? AND user_id = ?', (upload_id, user_id)).fetchone()
+
+def receive_chunk(session, offset, length, stream):
+    """Write ``length`` bytes from ``stream`` at ``offset``. Returns (bytes written, their SHA-256 hex).
+
+    Uses no database connection, so the caller can release its own while the
+    body arrives; record_chunk() then checks and records the result.
+    """
+    if offset < 0 or length <= 0 or offset + length > session['file_size']:
+        raise UploadSessionError(f"Chunk {offset}+{length} is outside the upload (size {session['file_size']}).", 416)
+    if length > current_app.config['UPLOAD_CHUNK_MAX_SIZE']:
+        raise UploadSessionError(f"Chunks may be at most {current_app.config['UPLOAD_CHUNK_MAX_SIZE']} bytes.", 413)
+
+    sha256 = hashlib.sha256()
+    written = 0
+    with open(session['path'], 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+            if not data:
+                break
+            sha256.update(data)
+            f.write(data)
+            written += len(data)
+    return written, sha256.hexdigest()
+
+def record_chunk(conn, session, offset, length, written, digest, checksum):
+    """Record a chunk from receive_chunk() if it is complete and ``digest`` matches ``checksum``.
+
+    Returns the received ranges after the write.
+    """
+    if written != length or digest != checksum.lower():
+        # The bytes on disk in this range are no longer known to be good
+        conn.execute('''
+            DELETE FROM upload_chunks
+            WHERE upload_id = ? AND byte_offset < ? AND byte_offset + length > ?
+        ''', (session['id'], offset + length, offset))
+        conn.commit()
+        if written != length:
+            raise UploadSessionError(f"Chunk body ended after {written} of {length} bytes.")
+        raise UploadSessionError('Chunk checksum mismatch.', 422)
+
+    conn.execute('INSERT OR REPLACE INTO upload_chunks (upload_id, byte_offset, length) VALUES (?, ?, ?)',
+                 (session['id'], offset, length))
+    conn.execute('UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (session['id'],))
+    conn.commit()
+    return received_ranges(conn, session['id'])
+
+def is_complete(session, received):
+    """Whether the ``received`` ranges (from received_ranges()) cover the whole upload."""
+    return received == [[0, session['file_size']]]
+
+def delete_session(conn, session):
+    """Remove the session rows, leaving the file alone. Does not commit."""
+    conn.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (session['id'],))
+    conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session['id'],))
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def discard_session(conn, session):
+    """Delete a session and its file."""
+    delete_session(conn, session)
+    conn.commit()
+    _unlink(session['path'])
+
+def collect_expired_sessions(conn, ttl):
+    """Delete sessions not written to for ``ttl`` seconds. Returns how many were removed."""
+    expired = conn.execute(
+        "SELECT * FROM upload_sessions WHERE updated_at < datetime('now', ?)", (f'{-int(ttl)} seconds',)
+    ).fetchall()
+    for session in expired:
+        discard_session(conn, session)
+    if expired:
+        logger.info(f"Removed {len(expired)} abandoned upload session(s).")
+    return len(expired)
+
+class SessionCollector:
+    """Runs collect_expired_sessions() for one app at most once per ``interval`` seconds."""
+
+    def __init__(self, ttl, interval):
+        self.ttl = ttl
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_run = None
+
+    def maybe_collect(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            if self._last_run is not None and now - self._last_run < self.interval:
+                return 0
+            self._last_run = now
+        return collect_expired_sessions(conn, self.ttl)
+
+def maybe_collect_expired_sessions(conn):
+    """collect_expired_sessions(), at most once per UPLOAD_SESSION_GC_INTERVAL for this app."""
+    return current_app.extensions['upload_session_collector'].maybe_collect(conn)
+
+
+@click.command('gc-uploads')
+@click.option('--ttl', type=int, default=None,
+              help='Remove sessions idle for this many seconds (default: UPLOAD_SESSION_TTL).')
+@with_appcontext
+def gc_uploads_command(ttl):
+    """Delete abandoned resumable upload sessions and their files."""
+    if ttl is None:
+        ttl = current_app.config['UPLOAD_SESSION_TTL']
+    removed = collect_expired_sessions(get_db(), ttl)
+    click.echo(f'{removed} abandoned upload session(s) removed.')
+
+def init_app(app):
+    app.extensions['upload_session_collector'] = SessionCollector(
+        app.config['UPLOAD_SESSION_TTL'], app.config['UPLOAD_SESSION_GC_INTERVAL']
+    )
+    app.cli.add_command(gc_uploads_command)
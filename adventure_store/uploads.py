@@ -0,0 +1,124 @@
+import hashlib
+import os
+import tempfile
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from .db import release_db
+from .utils import get_site_settings
+
+# Uploads are streamed by Werkzeug's multipart parser straight into a temp
+# file inside UPLOAD_FOLDER, hashed and counted as they arrive, and moved to
+# their final name with an atomic rename. Nothing is spooled elsewhere first
+# and nothing is copied a second time.
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    """Raised while the body is still arriving, as soon as a file passes the limit."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        super().__init__(f"File exceeds the maximum allowed size ({max_bytes // (1024 * 1024)}MB).")
+
+
+class UploadStream:
+    """Writable temp file that tracks the SHA-256 and size of what is written.
+
+    Exceeding ``max_bytes`` deletes the partial file and raises
+    UploadTooLarge. ``commit(path)`` renames the file into place; an
+    uncommitted file is removed by ``discard()`` when the request closes.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        fd, self.path = tempfile.mkstemp(prefix='.upload-', suffix='.part', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.committed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.discard()
+            raise UploadTooLarge(self.max_bytes)
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read, seek, tell, close, ... go to the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def commit(self, destination):
+        """Move the finished upload to ``destination``. Returns (size, sha256 hex)."""
+        self._file.flush()
+        self._file.close()
+        os.replace(self.path, destination)
+        self.committed = True
+        return self.size, self.sha256.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def max_upload_bytes():
+    """Largest accepted package, from the max_upload_size site setting (MB)."""
+    return int(get_site_settings().get('max_upload_size', 50)) * 1024 * 1024  # Default 50MB if not set
+
+
+class StreamingRequest(Request):
+    """Request class that streams file parts into UploadStreams.
+
+    The request's pooled database connection is released while a multipart
+    body is read, so slow uploads do not starve the pool.
+    """
+
+    def _load_form_data(self):
+        if 'form' not in self.__dict__ and self.mimetype == 'multipart/form-data':
+            # Read the limit first: it may need the database
+            self._max_upload_bytes = max_upload_bytes()
+            release_db()
+        super()._load_form_data()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_bytes = self.__dict__.get('_max_upload_bytes')
+        if max_bytes is None:
+            max_bytes = max_upload_bytes()
+        stream = UploadStream(current_app.config['UPLOAD_FOLDER'], max_bytes)
+        self.__dict__.setdefault('_upload_streams', []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        for stream in self.__dict__.get('_upload_streams', ()):
+            stream.discard()
+
+
+def save_upload(file, destination):
+    """Store an uploaded FileStorage at ``destination``. Returns (size, sha256 hex).
+
+    Streamed uploads are renamed into place; any other stream is copied in
+    chunks while hashing.
+    """
+    if isinstance(file.stream, UploadStream):
+        return file.stream.commit(destination)
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(destination, 'wb') as target:
+        while True:
+            chunk = file.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            size += len(chunk)
+            target.write(chunk)
+    return size, sha256.hexdigest()
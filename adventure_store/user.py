@@ -3,9 +3,12 @@ from flask import (
 )
 from werkzeug.utils import secure_filename
 from .db import get_db
-from .utils import parse_datetime, log_statistic, get_site_settings
+from .main import invalidate_home_cache
+from .utils import parse_datetime, log_statistic
 from .decorators import login_required
-import os
+from .tags import get_tag_registry
+from .storage import store_upload, discard_upload
+from .inspector import inspect_package, UnsafePackage
 import datetime
 import zipfile
 import json
@@ -34,6 +37,7 @@ def rate_adventure(adventure_id):
         else:
             conn.execute('INSERT INTO ratings (adventure_id, user_id, rating) VALUES (?, ?, ?)', (adventure_id, session['user_id'], rating))
         conn.commit()
+        invalidate_home_cache()
         flash('Rating submitted successfully.', 'success')
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error rating adventure (ID: {adventure_id}): {e}")
@@ -70,7 +74,6 @@ def add_review(adventure_id):
 @user_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload_adventure():
-    conn = get_db()
     if request.method == 'POST':
         name = request.form.get('name')
         description = request.form.get('description')
@@ -80,58 +83,48 @@ def upload_adventure():
         if not name or not description or not tags or not file or file.filename == '':
             flash('All fields and a file are required.', 'error')
             # Fetch tags again for rendering the form with error
-            tags_data = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
-            return render_template('upload.html', tags=tags_data)
+            return render_template('upload.html', tags=get_tag_registry())
 
         if not file.filename.lower().endswith('.zip'):
             flash('Only ZIP files are allowed.', 'error')
-            tags_data = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
-            return render_template('upload.html', tags=tags_data)
-
-        # --- File Size Check ---
-        site_settings = get_site_settings()
-        max_mb = int(site_settings.get('max_upload_size', 50)) # Default 50MB if not set
-        max_bytes = max_mb * 1024 * 1024
-        file.seek(0, os.SEEK_END) # Go to end of file
-        file_size = file.tell() # Get size
-        file.seek(0) # Reset pointer to beginning
-        if file_size > max_bytes:
-            flash(f'File size ({file_size // 1024 // 1024}MB) exceeds the maximum allowed size ({max_mb}MB).', 'error')
-            tags_data = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
-            return render_template('upload.html', tags=tags_data)
-
-        # Secure filename and create path
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        safe_base_filename = secure_filename(f"{session['username']}_{timestamp}.zip")
-        # Store path relative to instance or static/uploads? Let's use UPLOAD_FOLDER config
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        file_path = os.path.join(upload_folder, safe_base_filename)
+            return render_template('upload.html', tags=get_tag_registry())
+
+        try:
+            tags = [int(tag_id) for tag_id in tags]
+        except ValueError:
+            tags = None
+        if not tags or not get_tag_registry().are_valid_ids(tags):
+            flash('One or more selected tags are invalid.', 'error')
+            return render_template('upload.html', tags=get_tag_registry())
+
+        safe_base_filename = secure_filename(file.filename)  # For log messages only
+        content_hash = None
+        # Checked out only now: the connection is released while the body streams in
+        conn = get_db()
 
         try:
-            # Save file
-            file.save(file_path)
+            # Store the streamed upload by content (size was limited while streaming)
+            file_path, file_size, content_hash = store_upload(conn, file)
 
             # Extract version compatibility
             game_version = "1.0.0" # Default game version
             version_compat = "Unknown"
             try:
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    if 'game_data.json' in zip_ref.namelist():
-                        with zip_ref.open('game_data.json') as game_data_file:
-                            game_data = json.load(game_data_file)
-                            game_info = game_data.get('game_info', {})
-                            # Game's own version (e.g., "2.0.0")
-                            game_version = game_info.get('version', '1.0.0')
-                            # Engine/Builder version (e.g., "1.1.0")
-                            version_compat = game_info.get('builder_version', 'Unknown')
+                package = inspect_package(file_path)
+                if package.game_data_error:
+                    raise package.game_data_error
+                # Game's own version (e.g., "2.0.0")
+                game_version = package.game_info.get('version', '1.0.0')
+                # Engine/Builder version (e.g., "1.1.0")
+                version_compat = package.game_info.get('builder_version', 'Unknown')
             except (zipfile.BadZipFile, json.JSONDecodeError) as e_zip:
                 current_app.logger.warning(f"Could not extract version info from {safe_base_filename}: {e_zip}")
                 # Decide if this is a critical error. For now, we proceed with defaults.
 
             # Insert into DB
             cursor = conn.execute(
-                'INSERT INTO adventures (name, description, author_id, file_path, file_size, game_version, version_compat, approved) VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
-                (name, description, session['user_id'], file_path, file_size, game_version, version_compat)
+                'INSERT INTO adventures (name, description, author_id, file_path, file_size, content_hash, game_version, version_compat, approved) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)',
+                (name, description, session['user_id'], file_path, file_size, content_hash, game_version, version_compat)
             )
             adventure_id = cursor.lastrowid
 
@@ -152,25 +145,26 @@ def upload_adventure():
             flash('Adventure uploaded successfully and is pending approval.', 'success')
             return redirect(url_for('user.my_adventures'))
 
+        except UnsafePackage as e:
+            flash(f'The adventure file was rejected: {e}', 'error')
+            discard_upload(conn, content_hash)
         except sqlite3.Error as e:
             current_app.logger.error(f"Database error uploading adventure: {e}")
             flash('A database error occurred during upload.', 'error')
+            discard_upload(conn, content_hash)
         except Exception as e:
             current_app.logger.error(f"File handling error during upload: {e}")
             flash(f'An error occurred: {e}', 'error')
-            # Clean up potentially saved file if DB insert failed
-            if 'adventure_id' not in locals() and os.path.exists(file_path):
-                 try: os.remove(file_path)
-                 except OSError: pass
+            # Drop the stored package unless another adventure uses it
+            discard_upload(conn, content_hash)
 
-        # If we reached here, an error occurred, fetch tags and render form again
-        tags_data = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
-        return render_template('upload.html', tags=tags_data)
+        # If we reached here, an error occurred, render the form again
+        return render_template('upload.html', tags=get_tag_registry())
 
     # GET request
     tags_data = []
     try:
-        tags_data = conn.execute('SELECT id, name FROM tags ORDER BY name').fetchall()
+        tags_data = get_tag_registry()
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error fetching tags for upload form: {e}")
         flash('Could not load tags for the upload form.', 'error')
@@ -185,12 +179,9 @@ def my_adventures():
     try:
         adventures_data = conn.execute('''
             SELECT a.id, a.name, a.description, a.creation_date, a.approved,
-                   COALESCE(AVG(r.rating), 0) as avg_rating, COUNT(DISTINCT r.id) as rating_count,
-                   a.downloads
+                   a.avg_rating, a.rating_count, a.downloads
             FROM adventures a
-            LEFT JOIN ratings r ON a.id = r.adventure_id
             WHERE a.author_id = ?
-            GROUP BY a.id
             ORDER BY a.creation_date DESC
         ''', (session['user_id'],)).fetchall()
 
@@ -2,6 +2,7 @@ import sqlite3
 import os
 import hashlib
 import datetime
+from adventure_store.migrations import run_migrations
 
 # Function to hash passwords
 def hash_password(password):
@@ -14,170 +15,9 @@ os.makedirs('instance', exist_ok=True)
 conn = sqlite3.connect('instance/adventure_store.db')
 cursor = conn.cursor()
 
-# Create users table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    email TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL,
-    role TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    last_login TIMESTAMP
-)
-''')
-
-# Create adventures table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS adventures (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    description TEXT NOT NULL,
-    author_id INTEGER NOT NULL,
-    creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    file_path TEXT NOT NULL,
-    file_size INTEGER NOT NULL,
-    game_version TEXT NOT NULL DEFAULT '1.0.0',
-    version_compat TEXT NOT NULL DEFAULT 'Unknown',
-    approved INTEGER DEFAULT 0,
-    downloads INTEGER DEFAULT 0,
-    thumbnail_filename TEXT,
-    FOREIGN KEY (author_id) REFERENCES users (id)
-)
-''')
-
-# Create tags table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS tags (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT UNIQUE NOT NULL
-)
-''')
-
-# Create adventure_tags table (many-to-many relationship)
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS adventure_tags (
-    adventure_id INTEGER NOT NULL,
-    tag_id INTEGER NOT NULL,
-    PRIMARY KEY (adventure_id, tag_id),
-    FOREIGN KEY (adventure_id) REFERENCES adventures (id),
-    FOREIGN KEY (tag_id) REFERENCES tags (id)
-)
-''')
-
-# Create ratings table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS ratings (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    adventure_id INTEGER NOT NULL,
-    user_id INTEGER NOT NULL,
-    rating INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (adventure_id) REFERENCES adventures (id),
-    FOREIGN KEY (user_id) REFERENCES users (id),
-    UNIQUE(adventure_id, user_id)
-)
-''')
-
-# Create reviews table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS reviews (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    adventure_id INTEGER NOT NULL,
-    user_id INTEGER NOT NULL,
-    content TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (adventure_id) REFERENCES adventures (id),
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-''')
-
-# Create notifications table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS notifications (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    content TEXT NOT NULL,
-    type TEXT NOT NULL,
-    related_id INTEGER,
-    is_read INTEGER DEFAULT 0,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-''')
-
-# Create site_settings table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS site_settings (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    setting_name TEXT UNIQUE NOT NULL,
-    setting_value TEXT NOT NULL
-)
-''')
-
-# Create statistics table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS statistics (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    stat_name TEXT NOT NULL,
-    stat_value INTEGER NOT NULL,
-    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-''')
-
-# Create api_keys table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS api_keys (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    key TEXT UNIQUE NOT NULL,
-    name TEXT NOT NULL,
-    user_id INTEGER NOT NULL,
-    is_active INTEGER DEFAULT 1,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-''')
-
-# Create api_logs table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS api_logs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    api_key_name TEXT,
-    ip_address TEXT,
-    endpoint TEXT NOT NULL,
-    status_code INTEGER NOT NULL,
-    success BOOLEAN NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-''')
-
-# Schema migration: Attempt to add columns if they don't exist
-try:
-    cursor.execute("ALTER TABLE adventures ADD COLUMN game_version TEXT NOT NULL DEFAULT '1.0.0'")
-    print("Schema migration: Added column 'game_version' to 'adventures' table.")
-except sqlite3.OperationalError as e:
-    if "duplicate column name" in str(e).lower():
-        pass  # Column already exists
-    else:
-        print(f"Warning during schema migration for 'game_version': {e}")
-
-try:
-    cursor.execute("ALTER TABLE adventures ADD COLUMN version_compat TEXT NOT NULL DEFAULT 'Unknown'")
-    print("Schema migration: Added column 'version_compat' to 'adventures' table.")
-except sqlite3.OperationalError as e:
-    if "duplicate column name" in str(e).lower():
-        pass  # Column already exists
-    else:
-        print(f"Warning during schema migration for 'version_compat': {e}")
-
-try:
-    cursor.execute("ALTER TABLE adventures ADD COLUMN thumbnail_filename TEXT")
-    print("Schema migration: Added column 'thumbnail_filename' to 'adventures' table.")
-except sqlite3.OperationalError as e:
-    if "duplicate column name" in str(e).lower():
-        pass  # Column already exists
-    else:
-        print(f"Warning during schema migration for 'thumbnail_filename': {e}")
+# Create tables, columns and indexes (same migrations the app runs at startup)
+version = run_migrations(conn)
+print(f"Database schema is at version {version}.")
 
 
 # Insert default admin user
@@ -302,6 +302,14 @@ function initializeCharts() {
                         backgroundColor: 'rgba(255, 193, 7, 0.1)',
                         tension: 0.4,
                         fill: true
+                    },
+                    {
+                        label: 'Rejected Packages',
+                        data: dailyStatsData.rejected_packages.values,
+                        borderColor: 'rgba(220, 53, 69, 1)',
+                        backgroundColor: 'rgba(220, 53, 69, 0.1)',
+                        tension: 0.4,
+                        fill: true
                     }
                 ]
             },
@@ -346,11 +354,11 @@ function initializeApiUsageChart() {
         const ctx = document.getElementById('api-usage-chart').getContext('2d');
         const apiUsageDataRaw = JSON.parse(document.getElementById('api-usage-data').textContent);
 
-        // --- Data Processing for Chart.js ---
-        // We need a consistent timeline (last 30 days) and datasets for each key (success/failure)
-        const labels = []; // Array of dates for the X-axis
+        // The server sends one dense series per key (every day of the window,
+        // zeros included), so the days can be used as labels directly.
         const datasets = [];
-        const today = new Date();
+        const firstKey = Object.keys(apiUsageDataRaw)[0];
+        const labels = firstKey ? apiUsageDataRaw[firstKey].days : [];
         const colors = [ // Define some colors for different keys
             { success: 'rgba(40, 167, 69, 0.8)', failure: 'rgba(220, 53, 69, 0.8)' }, // Green/Red
             { success: 'rgba(37, 117, 252, 0.8)', failure: 'rgba(255, 193, 7, 0.8)' }, // Blue/Yellow
@@ -359,29 +367,11 @@ function initializeApiUsageChart() {
         ];
         let colorIndex = 0;
 
-        // Generate labels for the last 30 days
-        for (let i = 29; i >= 0; i--) {
-            const date = new Date(today);
-            date.setDate(today.getDate() - i);
-            labels.push(date.toISOString().split('T')[0]); // Format as YYYY-MM-DD
-        }
-
         // Process data for each API key
         for (const keyName in apiUsageDataRaw) {
             const keyData = apiUsageDataRaw[keyName];
-            const successData = new Array(30).fill(0); // Initialize with zeros
-            const failureData = new Array(30).fill(0);
-
-            // Map the fetched counts to the correct date index
-            for (let i = 0; i < keyData.days.length; i++) {
-                const day = keyData.days[i];
-                const index = labels.indexOf(day);
-                if (index !== -1) {
-                    // Assuming success/failure arrays align with days array
-                    if (keyData.success[i] !== undefined) successData[index] = keyData.success[i];
-                    if (keyData.failure[i] !== undefined) failureData[index] = keyData.failure[i];
-                }
-            }
+            const successData = keyData.success;
+            const failureData = keyData.failure;
 
             const keyColors = colors[colorIndex % colors.length];
             colorIndex++;
@@ -0,0 +1,53 @@
+import sqlite3
+import time
+
+from adventure_store import create_app
+from adventure_store.api_log import ApiLogWriter
+from adventure_store.db import ConnectionPool
+
+
+def make_app(tmp_path, **config):
+    return create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'DATABASE': str(tmp_path / 'adventure_store.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'THUMBNAIL_FOLDER': str(tmp_path / 'thumbs'),
+        'JOB_WORKERS': 0,
+        'STATS_FLUSH_INTERVAL': 0,
+        **config,
+    })
+
+
+def logged_endpoints(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'adventure_store.db')
+    try:
+        return [row[0] for row in conn.execute('SELECT endpoint FROM api_logs ORDER BY id')]
+    finally:
+        conn.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_writer_survives_pool_timeout(tmp_path):
+    make_app(tmp_path)  # Runs the migrations
+    pool = ConnectionPool(str(tmp_path / 'adventure_store.db'), size=1, timeout=0.05)
+    writer = ApiLogWriter(pool)
+    held = pool.acquire()
+    try:
+        writer.submit('builder key', '127.0.0.1', '/api/tags', 200, True)
+        assert wait_for(lambda: writer.dropped == 1)  # The write timed out on the pool
+        assert writer._thread.is_alive()
+    finally:
+        pool.release(held)
+
+    writer.submit('builder key', '127.0.0.1', '/api/submit', 202, True)
+
+    assert wait_for(lambda: logged_endpoints(tmp_path) == ['/api/submit'])
+    assert writer._thread.is_alive()
+    writer.stop()
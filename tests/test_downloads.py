@@ -0,0 +1,197 @@
+import builtins
+import hashlib
+import os
+import sqlite3
+
+import pytest
+from werkzeug.wsgi import FileWrapper
+
+from adventure_store import create_app
+
+PACKAGE = b'PK\x05\x06' + b'\x00' * 18 + b'adventure package bytes' * 100
+CONTENT_HASH = hashlib.sha256(PACKAGE).hexdigest()
+RELATIVE_PATH = f'{CONTENT_HASH[:2]}/{CONTENT_HASH[2:4]}/{CONTENT_HASH}.zip'
+
+
+def make_app(tmp_path, **config):
+    return create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'DATABASE': str(tmp_path / 'adventure_store.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'THUMBNAIL_FOLDER': str(tmp_path / 'thumbs'),
+        'JOB_WORKERS': 0,
+        'STATS_FLUSH_INTERVAL': 0,
+        **config,
+    })
+
+
+@pytest.fixture
+def package(tmp_path):
+    """An approved adventure whose package is stored under UPLOAD_FOLDER. Returns (user_id, adventure_id, path)."""
+    make_app(tmp_path)  # Runs the migrations
+    path = tmp_path / 'uploads' / RELATIVE_PATH
+    path.parent.mkdir(parents=True)
+    path.write_bytes(PACKAGE)
+    conn = sqlite3.connect(tmp_path / 'adventure_store.db')
+    user_id = conn.execute(
+        "INSERT INTO users (username, email, password, role) VALUES ('player', 'player@example.com', 'x', 'user')"
+    ).lastrowid
+    conn.execute('INSERT INTO packages (content_hash, file_path, file_size) VALUES (?, ?, ?)',
+                 (CONTENT_HASH, str(path), len(PACKAGE)))
+    adventure_id = conn.execute('''
+        INSERT INTO adventures (name, description, author_id, file_path, file_size, content_hash, game_version, version_compat, approved)
+        VALUES ('Cave', 'A cave.', ?, ?, ?, ?, '1.0.0', '1.0.0', 1)
+    ''', (user_id, str(path), len(PACKAGE), CONTENT_HASH)).lastrowid
+    conn.commit()
+    conn.close()
+    return user_id, adventure_id, str(path)
+
+
+def download_count(tmp_path, adventure_id):
+    conn = sqlite3.connect(tmp_path / 'adventure_store.db')
+    try:
+        return conn.execute('SELECT downloads FROM adventures WHERE id = ?', (adventure_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def download(app, user_id, adventure_id, monkeypatch, headers=None, environ_base=None):
+    """GET the download as a logged-in user. Returns (response, body, paths opened while serving)."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['role'] = 'user'
+    opened = []
+    real_open = builtins.open
+
+    def tracing_open(file, *args, **kwargs):
+        opened.append(os.path.abspath(os.fspath(file)) if isinstance(file, (str, os.PathLike)) else file)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, 'open', tracing_open)
+    try:
+        response = client.get(f'/download/{adventure_id}', headers=headers or {}, environ_base=environ_base or {})
+        body = response.get_data()  # Drains the body, so a streamed file is read here
+    finally:
+        monkeypatch.setattr(builtins, 'open', real_open)
+    return response, body, opened
+
+
+@pytest.mark.parametrize('mode, header, expected', [
+    ('x-sendfile', 'X-Sendfile', None),
+    ('x-accel-redirect', 'X-Accel-Redirect', f'/protected-uploads/{RELATIVE_PATH}'),
+])
+def test_offloaded_download_sends_no_body_bytes(tmp_path, package, monkeypatch, mode, header, expected):
+    user_id, adventure_id, path = package
+    app = make_app(tmp_path, DOWNLOAD_OFFLOAD=mode)
+
+    response, body, opened = download(app, user_id, adventure_id, monkeypatch)
+
+    assert response.status_code == 200
+    assert body == b''
+    assert response.headers[header] == (expected or path)
+    assert ('X-Accel-Redirect' if header == 'X-Sendfile' else 'X-Sendfile') not in response.headers
+    assert response.headers['Content-Length'] == str(len(PACKAGE))
+    assert response.headers['Content-Disposition'] == 'attachment; filename=Cave.zip'
+    assert path not in opened
+    assert download_count(tmp_path, adventure_id) == 1
+
+
+def test_offload_prefix_is_configurable(tmp_path, package, monkeypatch):
+    user_id, adventure_id, _ = package
+    app = make_app(tmp_path, DOWNLOAD_OFFLOAD='x-accel-redirect', DOWNLOAD_ACCEL_PREFIX='/internal/packages')
+
+    response, body, _ = download(app, user_id, adventure_id, monkeypatch)
+
+    assert body == b''
+    assert response.headers['X-Accel-Redirect'] == f'/internal/packages/{RELATIVE_PATH}'
+
+
+def test_download_without_offload_streams_the_file(tmp_path, package, monkeypatch):
+    user_id, adventure_id, path = package
+    app = make_app(tmp_path)
+
+    response, body, opened = download(app, user_id, adventure_id, monkeypatch)
+
+    assert response.status_code == 200
+    assert body == PACKAGE
+    assert 'X-Sendfile' not in response.headers and 'X-Accel-Redirect' not in response.headers
+    assert response.headers['Content-Disposition'] == 'attachment; filename=Cave.zip'
+    assert path in opened
+    assert download_count(tmp_path, adventure_id) == 1
+
+
+@pytest.mark.parametrize('mode', ['x-sendfile', 'x-accel-redirect'])
+def test_offloaded_download_carries_content_hash_etag(tmp_path, package, monkeypatch, mode):
+    user_id, adventure_id, _ = package
+    app = make_app(tmp_path, DOWNLOAD_OFFLOAD=mode)
+
+    response, _, _ = download(app, user_id, adventure_id, monkeypatch)
+
+    assert response.headers['ETag'] == f'"{CONTENT_HASH}"'
+
+
+@pytest.mark.parametrize('mode', [None, 'x-sendfile', 'x-accel-redirect'])
+def test_range_with_stale_if_range_counts_as_full_download(tmp_path, package, monkeypatch, mode):
+    user_id, adventure_id, _ = package
+    app = make_app(tmp_path, DOWNLOAD_OFFLOAD=mode)
+
+    response, body, _ = download(app, user_id, adventure_id, monkeypatch,
+                                 headers={'Range': 'bytes=10-', 'If-Range': '"an-older-package"'})
+
+    assert response.status_code == 200
+    if mode is None:
+        assert body == PACKAGE  # Range ignored, the whole file is sent
+    assert download_count(tmp_path, adventure_id) == 1
+
+
+@pytest.mark.parametrize('mode', [None, 'x-sendfile', 'x-accel-redirect'])
+def test_resumed_range_is_not_counted(tmp_path, package, monkeypatch, mode):
+    user_id, adventure_id, _ = package
+    app = make_app(tmp_path, DOWNLOAD_OFFLOAD=mode)
+
+    response, body, _ = download(app, user_id, adventure_id, monkeypatch,
+                                 headers={'Range': 'bytes=10-', 'If-Range': f'"{CONTENT_HASH}"'})
+
+    if mode is None:
+        assert response.status_code == 206
+        assert body == PACKAGE[10:]
+    assert download_count(tmp_path, adventure_id) == 0
+
+
+class RecordingFileWrapper(FileWrapper):
+    """A server's wsgi.file_wrapper: like most, it sends the file to its end."""
+
+    created = []
+
+    def __init__(self, file, buffer_size=8192):
+        super().__init__(file, buffer_size)
+        self.created.append(self)
+
+
+@pytest.mark.parametrize('byte_range, expected', [('bytes=10-19', PACKAGE[10:20]), ('bytes=-5', PACKAGE[-5:])],
+                         ids=['middle', 'suffix'])
+def test_range_is_bounded_with_a_file_wrapper(tmp_path, package, monkeypatch, byte_range, expected):
+    user_id, adventure_id, _ = package
+    app = make_app(tmp_path)
+
+    response, body, _ = download(app, user_id, adventure_id, monkeypatch, headers={'Range': byte_range},
+                                 environ_base={'wsgi.file_wrapper': RecordingFileWrapper})
+
+    assert response.status_code == 206
+    assert response.headers['Content-Length'] == str(len(expected))
+    assert body == expected
+
+
+def test_full_download_goes_through_the_file_wrapper(tmp_path, package, monkeypatch):
+    user_id, adventure_id, _ = package
+    app = make_app(tmp_path)
+    RecordingFileWrapper.created.clear()
+
+    response, body, _ = download(app, user_id, adventure_id, monkeypatch,
+                                 environ_base={'wsgi.file_wrapper': RecordingFileWrapper})
+
+    assert response.status_code == 200
+    assert body == PACKAGE
+    assert len(RecordingFileWrapper.created) == 1
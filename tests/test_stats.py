@@ -0,0 +1,67 @@
+import sqlite3
+import time
+
+from adventure_store import create_app
+from adventure_store.db import ConnectionPool, get_db
+from adventure_store.stats import StatsBuffer
+from adventure_store.utils import log_statistic
+
+
+def make_app(tmp_path, **config):
+    return create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'DATABASE': str(tmp_path / 'adventure_store.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'THUMBNAIL_FOLDER': str(tmp_path / 'thumbs'),
+        'JOB_WORKERS': 0,
+        'STATS_FLUSH_INTERVAL': 0,
+        **config,
+    })
+
+
+def stat_total(tmp_path, stat_name):
+    conn = sqlite3.connect(tmp_path / 'adventure_store.db')
+    try:
+        return conn.execute('SELECT COALESCE(SUM(stat_value), 0) FROM daily_statistics WHERE stat_name = ?',
+                            (stat_name,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_flusher_survives_pool_timeout(tmp_path):
+    make_app(tmp_path)  # Runs the migrations
+    pool = ConnectionPool(str(tmp_path / 'adventure_store.db'), size=1, timeout=0.05)
+    buffer = StatsBuffer(pool, flush_interval=0.05)
+    held = pool.acquire()
+    try:
+        buffer.increment('downloads', 3)
+        assert wait_for(lambda: buffer._thread is not None)
+        time.sleep(0.3)  # Several flushes time out on the pool
+
+        assert buffer._thread.is_alive()
+        assert stat_total(tmp_path, 'downloads') == 0
+    finally:
+        pool.release(held)
+
+    assert wait_for(lambda: stat_total(tmp_path, 'downloads') == 3)
+    assert buffer.pending() == {}
+    buffer.stop()
+
+
+def test_inline_flush_reuses_the_context_connection(tmp_path):
+    app = make_app(tmp_path, DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.5)
+
+    with app.app_context():
+        get_db()  # Holds the only pooled connection
+        log_statistic('page_views')
+
+    assert stat_total(tmp_path, 'page_views') == 1
+    assert app.extensions['stats_buffer'].pending() == {}
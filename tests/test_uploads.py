@@ -0,0 +1,268 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+import zipfile
+
+import pytest
+from flask import g
+
+from adventure_store import api, create_app, storage
+from adventure_store.db import get_db
+from adventure_store.uploads import StreamingRequest
+
+API_KEY = 'test-api-key'
+
+
+def make_app(tmp_path, **config):
+    return create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'DATABASE': str(tmp_path / 'adventure_store.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'THUMBNAIL_FOLDER': str(tmp_path / 'thumbs'),
+        'JOB_WORKERS': 0,
+        'STATS_FLUSH_INTERVAL': 0,
+        **config,
+    })
+
+
+def make_package(name='Cave'):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('game_data.json', json.dumps({'game_info': {'name': name, 'version': '1.0.0'}}))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def api_user(tmp_path):
+    """A user with an active API key and one tag. Returns the tag id."""
+    make_app(tmp_path)  # Runs the migrations
+    conn = sqlite3.connect(tmp_path / 'adventure_store.db')
+    user_id = conn.execute(
+        "INSERT INTO users (username, email, password, role) VALUES ('builder', 'builder@example.com', 'x', 'user')"
+    ).lastrowid
+    conn.execute('INSERT INTO api_keys (key, key_hash, name, user_id) VALUES (?, ?, ?, ?)',
+                 (API_KEY, hashlib.sha256(API_KEY.encode()).hexdigest(), 'builder key', user_id))
+    tag_id = conn.execute("INSERT INTO tags (name) VALUES ('Fantasy')").lastrowid
+    conn.commit()
+    conn.close()
+    return tag_id
+
+
+def test_submit_streams_the_body_without_a_pooled_connection(tmp_path, api_user, monkeypatch):
+    app = make_app(tmp_path, DB_POOL_SIZE=1)
+    held_while_streaming = []
+    real_get_file_stream = StreamingRequest._get_file_stream
+
+    def tracing_get_file_stream(self, *args, **kwargs):
+        held_while_streaming.append('db' in g)
+        return real_get_file_stream(self, *args, **kwargs)
+
+    monkeypatch.setattr(StreamingRequest, '_get_file_stream', tracing_get_file_stream)
+    response = app.test_client().post('/api/submit', headers={'X-API-Key': API_KEY}, data={
+        'adventure_file': (io.BytesIO(make_package()), 'cave.zip'),
+        'tags': str(api_user),
+    })
+
+    assert response.status_code == 202
+    assert held_while_streaming == [False]
+
+
+def test_upload_chunk_streams_without_a_pooled_connection(tmp_path, api_user, monkeypatch):
+    app = make_app(tmp_path, DB_POOL_SIZE=1)
+    client = app.test_client()
+    package = make_package()
+    created = client.post('/api/uploads', headers={'X-API-Key': API_KEY},
+                          json={'filename': 'cave.zip', 'size': len(package)})
+    assert created.status_code == 201
+    held_while_streaming = []
+    real_receive_chunk = api.receive_chunk
+
+    def tracing_receive_chunk(*args, **kwargs):
+        held_while_streaming.append('db' in g)
+        return real_receive_chunk(*args, **kwargs)
+
+    monkeypatch.setattr(api, 'receive_chunk', tracing_receive_chunk)
+    response = client.put(f"/api/uploads/{created.json['upload_id']}?offset=0", data=package, headers={
+        'X-API-Key': API_KEY, 'X-Chunk-SHA256': hashlib.sha256(package).hexdigest(),
+    })
+
+    assert response.status_code == 200
+    assert response.json['complete'] is True
+    assert held_while_streaming == [False]
+
+
+def test_failed_store_leaves_no_temp_file(tmp_path, api_user, monkeypatch):
+    app = make_app(tmp_path)
+
+    def failing_store_file(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(storage, 'store_file', failing_store_file)
+    response = app.test_client().post('/api/submit', headers={'X-API-Key': API_KEY}, data={
+        'adventure_file': (io.BytesIO(make_package()), 'cave.zip'),
+        'tags': str(api_user),
+    })
+
+    assert response.status_code == 500
+    assert os.listdir(tmp_path / 'uploads') == []
+
+
+def test_unlink_files_prunes_empty_shard_directories(tmp_path):
+    app = make_app(tmp_path)
+    with app.app_context():
+        kept = storage.package_path('ab' + 'cd' + '1' * 60)
+        removed = storage.package_path('ab' + 'ef' + '2' * 60)
+        for path in (kept, removed):
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(make_package())
+
+        assert storage.unlink_files(get_db(), [removed]) == []
+
+    assert sorted(os.listdir(tmp_path / 'uploads')) == ['ab']
+    assert os.listdir(tmp_path / 'uploads' / 'ab') == ['cd']
+
+
+def stat_total(tmp_path, stat_name):
+    conn = sqlite3.connect(tmp_path / 'adventure_store.db')
+    try:
+        return conn.execute('SELECT COALESCE(SUM(stat_value), 0) FROM daily_statistics WHERE stat_name = ?',
+                            (stat_name,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_submission_job_counts_the_upload_after_commit(tmp_path, api_user, caplog):
+    app = make_app(tmp_path)
+    response = app.test_client().post('/api/submit', headers={'X-API-Key': API_KEY}, data={
+        'adventure_file': (io.BytesIO(make_package()), 'cave.zip'),
+        'tags': str(api_user),
+    })
+    assert response.status_code == 202
+
+    started = time.monotonic()
+    assert app.extensions['job_queue'].run_pending()
+
+    assert time.monotonic() - started < 2  # Not waiting out busy_timeout on its own write lock
+    assert stat_total(tmp_path, 'uploads') == 1
+    assert 'database is locked' not in caplog.text
+
+
+def test_rejection_during_a_batch_is_counted_without_waiting(tmp_path, api_user, caplog):
+    app = make_app(tmp_path)
+    nested = io.BytesIO()
+    with zipfile.ZipFile(nested, 'w') as archive:
+        archive.writestr('inner.zip', make_package())
+    tags = str(api_user)
+
+    started = time.monotonic()
+    response = app.test_client().post('/api/submit_batch', headers={'X-API-Key': API_KEY}, data={
+        'manifest': json.dumps({'items': [{'file': 'good', 'tags': tags}, {'file': 'nested', 'tags': tags}]}),
+        'good': (io.BytesIO(make_package()), 'good.zip'),
+        'nested': (io.BytesIO(nested.getvalue()), 'nested.zip'),
+    })
+
+    assert response.status_code == 202
+    assert [item['status'] for item in response.json['items']] == ['queued', 'rejected']
+    assert time.monotonic() - started < 2
+    assert stat_total(tmp_path, 'rejected_packages') == 1
+    assert 'database is locked' not in caplog.text
+
+
+@pytest.mark.parametrize('size', [True, False, '12', 1.5, None])
+def test_create_upload_refuses_non_integer_sizes(tmp_path, api_user, size):
+    app = make_app(tmp_path)
+
+    response = app.test_client().post('/api/uploads', headers={'X-API-Key': API_KEY},
+                                      json={'filename': 'cave.zip', 'size': size})
+
+    assert response.status_code == 400
+    assert response.json == {'error': "Missing or invalid 'size' (bytes)."}
+
+
+def failing_tag_registry():
+    raise sqlite3.OperationalError('disk I/O error')
+
+
+def test_finalize_reports_tag_lookup_errors_as_json(tmp_path, api_user, monkeypatch):
+    app = make_app(tmp_path)
+    monkeypatch.setattr(api, 'get_tag_registry', failing_tag_registry)
+
+    response = app.test_client().post('/api/uploads/unknown/finalize', headers={'X-API-Key': API_KEY},
+                                      json={'tags': str(api_user)})
+
+    assert response.status_code == 500
+    assert response.json == {'error': 'Database error during submission.'}
+
+
+def test_batch_reports_tag_lookup_errors_as_json(tmp_path, api_user, monkeypatch):
+    app = make_app(tmp_path)
+    monkeypatch.setattr(api, 'get_tag_registry', failing_tag_registry)
+
+    response = app.test_client().post('/api/submit_batch', headers={'X-API-Key': API_KEY}, data={
+        'manifest': json.dumps({'items': [{'file': 'good', 'tags': str(api_user)}]}),
+        'good': (io.BytesIO(make_package()), 'good.zip'),
+    })
+
+    assert response.status_code == 500
+    assert response.json == {'error': 'Error during batch submission; nothing was stored.'}
+    assert os.listdir(tmp_path / 'uploads') == []
+
+
+def job_count(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'adventure_store.db')
+    try:
+        return conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_submit_refuses_a_file_that_is_not_a_zip(tmp_path, api_user):
+    app = make_app(tmp_path)
+
+    response = app.test_client().post('/api/submit', headers={'X-API-Key': API_KEY}, data={
+        'adventure_file': (io.BytesIO(b'not a zip at all'), 'cave.zip'),
+        'tags': str(api_user),
+    })
+
+    assert response.status_code == 400
+    assert response.json['error'].startswith('Could not process ZIP file')
+    assert os.listdir(tmp_path / 'uploads') == []
+    assert job_count(tmp_path) == 0
+
+
+def test_batch_rejects_an_item_that_is_not_a_zip(tmp_path, api_user):
+    app = make_app(tmp_path)
+
+    response = app.test_client().post('/api/submit_batch', headers={'X-API-Key': API_KEY}, data={
+        'manifest': json.dumps({'items': [{'file': 'junk', 'tags': str(api_user)}]}),
+        'junk': (io.BytesIO(b'not a zip at all'), 'junk.zip'),
+    })
+
+    assert response.status_code == 400
+    item, = response.json['items']
+    assert item['status'] == 'rejected' and item['error'].startswith('Could not process ZIP file')
+    assert os.listdir(tmp_path / 'uploads') == []
+    assert job_count(tmp_path) == 0
+
+
+def test_finalize_refuses_a_file_that_is_not_a_zip(tmp_path, api_user):
+    app = make_app(tmp_path)
+    client = app.test_client()
+    junk = b'not a zip at all'
+    upload_id = client.post('/api/uploads', headers={'X-API-Key': API_KEY},
+                            json={'filename': 'cave.zip', 'size': len(junk)}).json['upload_id']
+    client.put(f'/api/uploads/{upload_id}?offset=0', data=junk,
+               headers={'X-API-Key': API_KEY, 'X-Chunk-SHA256': hashlib.sha256(junk).hexdigest()})
+
+    response = client.post(f'/api/uploads/{upload_id}/finalize', headers={'X-API-Key': API_KEY},
+                           json={'tags': str(api_user)})
+
+    assert response.status_code == 400
+    assert response.json['error'].startswith('Could not process ZIP file')
+    assert job_count(tmp_path) == 0
+    assert client.get(f'/api/uploads/{upload_id}', headers={'X-API-Key': API_KEY}).status_code == 404